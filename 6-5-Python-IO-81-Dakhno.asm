@@ -28,13 +28,14 @@ start:
 geom_progression PROC
 push ebp
 mov ebp, esp
+sub esp, 4
 
 mov eax, 0
-push eax
+mov [ebp + -4], eax
 _1:
 mov eax, [ebp + -4]
 push eax
-mov eax, [ebp + 8]
+mov eax, [ebp + 16]
 pop ebx
 .if ebx < eax
     mov eax, 1
@@ -46,10 +47,10 @@ jmp _2
 .else
 mov eax, [ebp + 12]
 push eax
-mov eax, [ebp + 16]
+mov eax, [ebp + 8]
 pop ebx
 mul ebx
-mov [ebp + 16], eax
+mov [ebp + 8], eax
 
 mov eax, [ebp + -4]
 inc dword ptr[ebp + -4]
@@ -58,7 +59,7 @@ jmp _1
 .endif
 _2:
 
-mov eax, [ebp + 16]
+mov eax, [ebp + 8]
 mov esp, ebp
 pop ebp
 ret
@@ -69,15 +70,16 @@ geom_progression ENDP
 sum_geom_progression PROC
 push ebp
 mov ebp, esp
-mov eax, [ebp + 16]
-push eax
+sub esp, 8
+mov eax, [ebp + 8]
+mov [ebp + -4], eax
 
 mov eax, 0
-push eax
+mov [ebp + -8], eax
 _3:
 mov eax, [ebp + -8]
 push eax
-mov eax, [ebp + 8]
+mov eax, [ebp + 16]
 pop ebx
 .if ebx < eax
     mov eax, 1
@@ -89,13 +91,13 @@ jmp _4
 .else
 mov eax, [ebp + 12]
 push eax
-mov eax, [ebp + 16]
+mov eax, [ebp + 8]
 pop ebx
 mul ebx
-mov [ebp + 16], eax
+mov [ebp + 8], eax
 mov eax, [ebp + -4]
 push eax
-mov eax, [ebp + 16]
+mov eax, [ebp + 8]
 pop ebx
 add eax,ebx
 mov [ebp + -4], eax
@@ -118,6 +120,7 @@ sum_geom_progression ENDP
 main PROC
 push ebp
 mov ebp, esp
+sub esp, 4
 mov eax, 2
 push eax
 mov eax, 2
@@ -127,7 +130,7 @@ push eax
 call sum_geom_progression
 add esp, 12
 
-push eax
+mov [ebp + -4], eax
 mov eax, [ebp + -4]
 mov esp, ebp
 pop ebp
@@ -8,9 +8,11 @@ output = open("6-5-Python-IO-81-Dakhno.asm", "w")
 try:
     with open("6-5-Python-IO-81-Dakhno.txt", "r") as f:
         code = f.read()
-        output.write(f"{Parser.program_parsing(Wrapper(Lexer.tokeniser(code))).masm_32()}")
+        Parser.program_parsing(Wrapper(Lexer.tokeniser(code))).masm_32(output)
         print("Компілятор завершив роботу!")
 except Exception as error:
+    output.seek(0)
+    output.truncate()
     output.write(str(error))
     print("Компілятор завершив роботу з помилкою!")
 output.close()
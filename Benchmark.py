@@ -0,0 +1,206 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import Parser
+from Generator import program_of_size
+from Lexer import Lexer
+from Optimizer import Options
+from Parser import Wrapper
+from Stats import measure
+
+KB = 1024
+MB = 1024 * KB
+SIZES = (1 * KB, 10 * KB, 100 * KB, 1 * MB, 10 * MB, 50 * MB)
+TIERS = {"small": 10 * KB, "medium": 100 * KB, "large": 1 * MB}  # sizes of the generated programs of `suite`
+SUITE_PHASES = ("lex", "parse", "generate")
+SUITE_SEED = 0
+BASELINE = "benchmark-baseline.json"
+
+
+def make_source(size):
+    with open("6-5-Python-IO-81-Dakhno.txt", "r") as f:
+        sample = f.read() + "\n"
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def lexer_scaling(sizes=SIZES):
+    """Times both lexer engines and checks that they produce the same token stream."""
+    print(f"{'engine':>6} {'size':>12} {'tokens':>10} {'seconds':>10} {'MB/s':>8} {'us/KB':>8}")
+    for size in sizes:
+        code = make_source(size)
+        streams = []
+        for engine, regex in (("scan", False), ("regex", True)):
+            start = time.perf_counter()
+            tokens = Lexer.tokeniser(code, regex=regex)
+            elapsed = time.perf_counter() - start
+            streams.append(tokens)
+            print(f"{engine:>6} {size:>12} {len(tokens):>10} {elapsed:>10.3f} {size / MB / elapsed:>8.2f} "
+                  f"{elapsed * 1e6 / (size / KB):>8.1f}")
+        if streams[0] != streams[1]:
+            raise Exception(f"Lexer engines disagree on a {size} byte input.")
+
+
+def token_memory(count=1_000_000):
+    """Compares the traced memory of a list of Tokens against a TokenStore holding the same tokens."""
+    code = make_source(count * 4)
+    tokens_per_byte = len(Lexer.tokeniser(code[:MB], regex=True)) / len(code[:MB])
+    code = make_source(int(count / tokens_per_byte))
+    results = []
+    for layout, lex in (("list", lambda: Lexer.tokeniser(code, regex=True)), ("store", lambda: Lexer.token_store(code))):
+        tracemalloc.start()
+        tokens = lex()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(size)
+        print(f"{layout:>6} {len(tokens):>10} tokens {size / MB:>9.1f} MB {size / len(tokens):>7.1f} B/token")
+        del tokens
+    print(f"reduction: {results[0] / results[1]:.1f}x")
+
+
+def make_expressions(statements):
+    lines = ["int f(int x, int y){", "    return x + y * 2;", "}", "int main(){", "    int a = 1;", "    int b = 2;"]
+    for i in range(statements):
+        lines.append(f"    a = (a + {i} * b - (b % 7)) / (f(a, b + {i}) + 1) == (a < b) + (a > {i} ? a - 1 : b * 3);")
+    lines += ["    return a;", "}"]
+    return "\n".join(lines)
+
+
+def expression_parsing(statements=20_000, repeat=5):
+    """Times program_parsing alone on expression-heavy code."""
+    tokens = Lexer.tokeniser(make_expressions(statements), regex=True)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Parser.program_parsing(Wrapper(tokens))
+        best = min(best, time.perf_counter() - start)
+    print(f"{len(tokens)} tokens parsed in {best:.3f} s, {len(tokens) / best / 1e6:.2f} M tokens/s")
+
+
+def calibration_work():
+    """Fixed pure Python work, like the compiler's, that the suite measures the speed of the phases against."""
+    counts = dict()
+    total = 0
+    for i in range(100_000):
+        word = "v" + str(i % 997)
+        counts[word] = counts.get(word, 0) + 1
+        total += len(word) * 3 % 7
+    return total
+
+
+def calibrate(repeat=50):
+    """Returns the best time of repeat runs of calibration_work."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_work()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_tier(size, repeat=5):
+    """Returns the best throughput and the traced peak memory of every phase compiling size bytes at -O0."""
+    code = program_of_size(SUITE_SEED, size)
+    best = dict()
+    calibration = float("inf")
+    for _ in range(max(repeat, MB // len(code))):
+        calibration = min(calibration, calibrate(3))
+        _, report = measure(code, Options(), memory=False)
+        for phase in SUITE_PHASES:
+            best[phase] = min(best.get(phase, float("inf")), report["phases"][phase]["wall_seconds"])
+    _, traced = measure(code, Options(), memory=True)
+    return {
+        "bytes": report["bytes"],
+        "tokens": report["tokens"],
+        "calibration_seconds": calibration,
+        "phases": {phase: {
+            "bytes_per_second": report["bytes"] / best[phase] if best[phase] else None,
+            "tokens_per_second": report["tokens"] / best[phase] if best[phase] else None,
+            "peak_bytes": traced["phases"][phase]["peak_bytes"],
+        } for phase in SUITE_PHASES},
+    }
+
+
+def calibrated(results, calibration):
+    """Returns results with one calibration for every tier and bytes_per_calibration for every phase."""
+    for result in results.values():
+        result["calibration_seconds"] = calibration
+        for measured in result["phases"].values():
+            measured["bytes_per_calibration"] = measured["bytes_per_second"] * calibration
+    return results
+
+
+def regressions(results, baseline, tolerance, memory_tolerance):
+    """Returns a line for every regression of results against baseline, comparing speed per calibration."""
+    found = []
+    for tier, result in results.items():
+        base = baseline.get(tier)
+        if base is None:
+            continue
+        if (base["bytes"], base["tokens"]) != (result["bytes"], result["tokens"]) or "calibration_seconds" not in base:
+            found.append(f"{tier}: the baseline was recorded on another program or by an older suite, save it again")
+            continue
+        for phase, measured in result["phases"].items():
+            before = base["phases"][phase]
+            if measured["bytes_per_calibration"] < before["bytes_per_calibration"] * (1 - tolerance):
+                found.append(f"{tier} {phase}: {measured['bytes_per_calibration'] / KB:.1f} KB per calibration, "
+                             f"the baseline is {before['bytes_per_calibration'] / KB:.1f} KB")
+            if measured["peak_bytes"] > before["peak_bytes"] * (1 + memory_tolerance):
+                found.append(f"{tier} {phase}: {measured['peak_bytes'] / MB:.2f} MB at peak, "
+                             f"the baseline is {before['peak_bytes'] / MB:.2f} MB")
+    return found
+
+
+def suite(argv):
+    """Checks the phases on every tier against the baseline, or stores it with --save; 1 on a regression."""
+    parser = argparse.ArgumentParser(prog="Benchmark.py suite")
+    parser.add_argument("tiers", nargs="*", help=f"some of {', '.join(TIERS)}, all of them by default")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="slowdown allowed, as a fraction")
+    parser.add_argument("--memory-tolerance", type=float, default=0.1, help="memory growth allowed, as a fraction")
+    args = parser.parse_args(argv)
+    for tier in args.tiers:
+        if tier not in TIERS:
+            parser.error(f"unknown tier: {tier}")
+    print(f"{'tier':>6} {'phase':>8} {'size':>10} {'tokens':>9} {'MB/s':>8} {'M tokens/s':>10} {'KB/cal':>8} "
+          f"{'peak MB':>8}")
+    calibration = calibrate()
+    results = {tier: run_tier(TIERS[tier], args.repeat) for tier in args.tiers or TIERS}
+    calibrated(results, min([calibration] + [result["calibration_seconds"] for result in results.values()]))
+    for tier, result in results.items():
+        for phase, measured in result["phases"].items():
+            print(f"{tier:>6} {phase:>8} {result['bytes']:>10} {result['tokens']:>9} "
+                  f"{measured['bytes_per_second'] / MB:>8.2f} {measured['tokens_per_second'] / 1e6:>10.2f} "
+                  f"{measured['bytes_per_calibration'] / KB:>8.1f} {measured['peak_bytes'] / MB:>8.2f}")
+    if args.save:
+        try:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = dict()
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    found = regressions(results, baseline, args.tolerance, args.memory_tolerance)
+    for line in found:
+        print(f"regression: {line}")
+    return int(bool(found))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(suite(sys.argv[2:]))
+    elif sys.argv[1:2] == ["memory"]:
+        token_memory(*map(int, sys.argv[2:3]))
+    elif sys.argv[1:2] == ["expressions"]:
+        expression_parsing(*map(int, sys.argv[2:3]))
+    else:
+        lexer_scaling(tuple(int(size) for size in sys.argv[1:]) or SIZES)
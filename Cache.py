@@ -0,0 +1,89 @@
+import hashlib
+import os
+import tempfile
+
+MB = 1024 * 1024
+
+
+class CompilationCache:
+    """On-disk cache of generated MASM, keyed by a hash of the source text, the compiler version and the options.
+
+    Entries are plain .asm files. A hit refreshes the file's modification time, and when the directory grows
+    past `max_bytes` the least recently used entries are deleted first.
+    """
+
+    def __init__(self, directory, max_bytes=512 * MB):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None  # bytes on disk, counted on the first put
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(code, version, options=()) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{version}\0{options!r}\0".encode())
+        digest.update(code.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".asm")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "r") as f:
+                masm = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return masm
+
+    def put(self, key, masm):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(descriptor, "w") as f:
+            f.write(masm)
+        os.replace(temporary, path)
+        if self.size is None:
+            self.size = self.disk_size()
+        else:
+            self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".asm"):
+                    path = os.path.join(directory, name)
+                    try:
+                        status = os.stat(path)
+                    except FileNotFoundError:  # evicted by another process
+                        continue
+                    yield status.st_mtime, status.st_size, path
+
+    def disk_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Deletes least recently used entries until the cache is back under 90% of its limit."""
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,224 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
+import Parser
+from Cache import MB, CompilationCache
+from Incremental import compile_incremental
+from Lexer import Lexer
+from Optimizer import Options, inline_threshold, optimize
+from Parser import CompilationContext, StreamWrapper
+from Peephole import peephole
+from Stats import measure
+
+
+def compiler_version():
+    """Hash of the compiler's own modules, so that any change to the compiler invalidates cached output."""
+    digest = hashlib.sha256()
+    for module in ("Lexer.py", "Token.py", "Parser.py", "Emitter.py", "Optimizer.py", "Registers.py", "IR.py",
+                   "Peephole.py", "Incremental.py", "Compiler.py"):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+COMPILER_VERSION = compiler_version()
+
+caches = dict()  # one CompilationCache per directory in every process
+
+
+class Result(NamedTuple):
+    source: str
+    error: str  # None on success
+    seconds: float
+    cached: bool
+    stats: dict = None  # the report of Stats.measure, when asked for
+
+
+def get_cache(directory, max_bytes=512 * MB):
+    cache = caches.get(directory)
+    if cache is None:
+        cache = caches[directory] = CompilationCache(directory, max_bytes)
+    return cache
+
+
+def parse_source(code, context) -> Parser.Program:
+    """Parses code as the lexer yields its tokens, holding only the parser's lookahead of them at a time."""
+    return Parser.program_parsing(StreamWrapper(Lexer.token_stream(code, regex=True)), context)
+
+
+def compile_source(code, cache=None, unit=None, options=Options()) -> str:
+    """Compiles code to MASM; with a CompilationCache, a hit skips lexing, parsing and code generation.
+
+    With a `unit` name as well, a miss recompiles only the functions of the unit that changed since its last build.
+    """
+    # incremental and full builds are cached apart, so that either is never served the output of the other
+    key = cache.key(code, COMPILER_VERSION, (options, unit is not None)) if cache is not None else None
+    masm = cache.get(key) if cache is not None else None
+    if masm is None:
+        hits = cache.hits if cache is not None else 0
+        if unit is not None:
+            masm = compile_incremental(code, cache, unit, COMPILER_VERSION, options)[0]
+            cache.hits = hits  # the function manifest is not a hit for the whole file
+        else:
+            context = CompilationContext()
+            masm = optimize(parse_source(code, context), options).masm_32(context=context)
+            masm = peephole(masm) if options.peephole else masm
+        if cache is not None:
+            cache.put(key, masm)
+    return masm
+
+
+def compile_file(source_path, output_path, cache_dir=None, cache_size=512 * MB, incremental=False,
+                 options=Options(), stats=False) -> Result:
+    """Compiles one file; with stats, the compilation is instrumented by Stats.measure and skips the cache."""
+    start = time.perf_counter()
+    cache = get_cache(cache_dir, cache_size) if cache_dir and not stats else None
+    hits = cache.hits if cache is not None else 0
+    report = None
+    try:
+        with open(source_path, "r") as f:
+            code = f.read()
+        if stats:
+            masm, report = measure(code, options)
+            with open(output_path, "w") as output:
+                output.write(masm)
+        elif cache is not None:
+            masm = compile_source(code, cache, os.path.abspath(source_path) if incremental else None, options)
+            with open(output_path, "w") as output:
+                output.write(masm)
+        else:
+            context = CompilationContext()
+            program = optimize(parse_source(code, context), options)
+            try:
+                with open(output_path, "w") as output:
+                    if options.peephole:  # rewrites whole functions, so the code is not streamed
+                        output.write(peephole(program.masm_32(context=context)))
+                    else:
+                        program.masm_32(output, context)
+            except Exception:
+                os.remove(output_path)
+                raise
+    except Exception as error:
+        return Result(source_path, str(error) or type(error).__name__, time.perf_counter() - start, False)
+    return Result(source_path, None, time.perf_counter() - start, cache is not None and cache.hits > hits, report)
+
+
+def expand_sources(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"warning: {pattern} matches no files", file=sys.stderr)
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def output_path_for(source_path, output_dir):
+    name = os.path.splitext(source_path)[0] + ".asm"
+    return os.path.join(output_dir, os.path.basename(name)) if output_dir else name
+
+
+def compile_files(sources, outputs, jobs, cache_dir=None, cache_size=512 * MB, incremental=False, options=Options(),
+                  stats=False):
+    """Yields the result of compile_file for every source, spreading the work over `jobs` processes."""
+    compile_one = partial(compile_file, cache_dir=cache_dir, cache_size=cache_size, incremental=incremental,
+                          options=options, stats=stats)
+    if jobs == 1 or len(sources) < 2:
+        yield from map(compile_one, sources, outputs)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(compile_one, sources, outputs, chunksize=max(1, len(sources) // (jobs * 8)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compiles C source files into MASM32 assembly.")
+    parser.add_argument("sources", nargs="+", help="source files or glob patterns (** is recursive)")
+    parser.add_argument("-o", "--output-dir", help="directory for the .asm files, by default next to each source")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--cache-dir", help="directory of a persistent compilation cache, disabled by default")
+    parser.add_argument("--cache-size", type=int, default=512, help="cache size limit in MB (default: 512)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="recompile only the functions that changed since the last build (needs --cache-dir); "
+                             "files are compiled in full when functions are inlined, as at -O2 and -O3")
+    parser.add_argument("-O", dest="level", type=int, choices=range(4), default=0,
+                        help="optimisation level: 0 (default); 1 for --fold, --tail-calls, --dead-code, "
+                             "--loops and peephole rewriting; "
+                             "2 also inlines small leaf functions and keeps hot locals and expression temporaries "
+                             "in registers; "
+                             "3 generates through the three-address IR with CSE, dead code elimination and "
+                             "loop invariant code motion")
+    parser.add_argument("--fold", action="store_true",
+                        help="fold constant expressions and reduce multiplications by powers of two to shifts")
+    parser.add_argument("--inline", type=int, default=None, metavar="SIZE",
+                        help="inline the calls of leaf functions of at most SIZE nodes, twice that inside loops "
+                             f"(-O2 and -O3 use {inline_threshold}, 0 disables inlining)")
+    parser.add_argument("--tail-calls", action="store_true",
+                        help="turn the returns of a call of the function itself into jumps to its start")
+    parser.add_argument("--dead-code", action="store_true",
+                        help="drop statements that never run and functions that main never calls")
+    parser.add_argument("--loops", action="store_true",
+                        help="test loops at their bottom and compute the invariant parts of their conditions once")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write a JSON report of the time, CPU time and memory of every phase of every "
+                             "compilation to FILE, - for the standard output; the cache is not used")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.incremental and not args.cache_dir:
+        parser.error("--incremental needs --cache-dir")
+
+    sources = expand_sources(args.sources)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [output_path_for(source, args.output_dir) for source in sources]
+
+    options = Options.level(args.level)
+    if args.fold:
+        options = options._replace(fold=True)
+    if args.inline is not None:
+        options = options._replace(inline=args.inline)
+    if args.tail_calls:
+        options = options._replace(tail_calls=True)
+    if args.dead_code:
+        options = options._replace(dead_code=True)
+    if args.loops:
+        options = options._replace(loops=True)
+
+    log = sys.stderr if args.stats == "-" else sys.stdout  # the standard output is left to the JSON
+    start = time.perf_counter()
+    failed = hits = 0
+    reports = []
+    for source, error, seconds, cached, report in compile_files(sources, outputs, args.jobs, args.cache_dir,
+                                                                args.cache_size * MB, args.incremental, options,
+                                                                args.stats is not None):
+        if error is None:
+            hits += cached
+            print(f"ok     {source} ({seconds:.3f} s{', cached' if cached else ''})", file=log)
+            if report is not None:
+                reports.append({"source": source, **report})
+        else:
+            failed += 1
+            print(f"FAILED {source}: {error}", file=log)
+    print(f"{len(sources) - failed} compiled, {failed} failed in {time.perf_counter() - start:.2f} s "
+          f"with {args.jobs} worker(s)", file=log)
+    if args.cache_dir and args.stats is None:
+        print(f"cache: {hits} hits, {len(sources) - failed - hits} misses", file=log)
+    if args.stats == "-":
+        json.dump({"sources": reports}, sys.stdout, indent=2)
+        print()
+    elif args.stats is not None:
+        with open(args.stats, "w") as f:
+            json.dump({"sources": reports}, f, indent=2)
+    return 1 if failed or not sources else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import io
+
+
+class Emitter:
+    """Shared output buffer for code generation.
+
+    Parts are collected in a list and written to `stream` whenever `buffer_size` characters have piled up,
+    so the memory used by the emitter stays flat however large the program is.
+    """
+
+    def __init__(self, stream=None, buffer_size=1 << 16):
+        self.stream = stream if stream is not None else io.StringIO()
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, part):
+        self.chunks.append(part)
+        self.size += len(part)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, parts):
+        for part in parts:
+            self.write(part)
+        self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks.clear()
+            self.size = 0
+
+    def getvalue(self):
+        self.flush()
+        return self.stream.getvalue()
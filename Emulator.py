@@ -0,0 +1,271 @@
+import re
+import sys
+from collections import Counter
+from typing import NamedTuple
+
+from Compiler import compile_source
+from Optimizer import Options
+
+MASK = 0xFFFFFFFF  # as in Optimizer.py
+STACK_TOP = 0x00800000  # esp when main is called
+RETURN = -1  # the return address of main, a ret to it ends the run
+
+registers = ("eax", "ebx", "ecx", "edx", "esi", "edi", "ebp", "esp")
+memory_operand = re.compile(r"^(?:dword ptr\s*)?\[\s*(\w+)\s*(?:\+\s*(-?\d+)\s*)?\]$")
+if_condition = re.compile(r"^(.+?)\s*(==|!=|<=|>=|<|>)\s*(.+)$")
+comparisons = {  # the operands of .if are DWORDs, so MASM compares them unsigned
+    "==": lambda left, right: left == right,
+    "!=": lambda left, right: left != right,
+    "<": lambda left, right: left < right,
+    ">": lambda left, right: left > right,
+    "<=": lambda left, right: left <= right,
+    ">=": lambda left, right: left >= right,
+}
+flag_conditions = {  # jcc and setcc suffix -> condition on (zero, carry), after cmp or arithmetic
+    "e": lambda zero, carry: zero,
+    "z": lambda zero, carry: zero,
+    "ne": lambda zero, carry: not zero,
+    "nz": lambda zero, carry: not zero,
+    "b": lambda zero, carry: carry,
+    "ae": lambda zero, carry: not carry,
+    "a": lambda zero, carry: not carry and not zero,
+    "be": lambda zero, carry: carry or zero,
+}
+costs = {".if": 2, ".else": 1, ".endif": 0}  # instructions MASM expands them to: cmp and jcc, jmp to .endif
+
+
+class Run(NamedTuple):
+    value: int  # eax when main returns, unsigned
+    instructions: int  # instructions executed, with .if, .else and .endif counted as in `costs`
+    counts: Counter  # mnemonic or directive -> times executed
+    stack: int  # bytes of stack used at most, from the return address of main down
+
+
+def operand(text):
+    """Decodes an operand into ("reg", name), ("imm", value) or ("mem", base register, offset)."""
+    text = text.strip()
+    if text in registers or text == "al":
+        return "reg", text
+    match = memory_operand.match(text)
+    if match is not None:
+        return "mem", match.group(1), int(match.group(2) or 0)
+    try:
+        return "imm", int(text) & MASK
+    except ValueError:
+        raise Exception(f"Unsupported operand: {text}")
+
+
+def decode(line):
+    """Splits a line into its mnemonic and decoded operands, as Peephole.instruction does for the text."""
+    if line.startswith(".if "):
+        match = if_condition.match(line[4:])
+        if match is None:
+            return ".if", (operand(line[4:]), "!=", ("imm", 0))
+        left, comparison, right = match.groups()
+        return ".if", (operand(left), comparison, operand(right))
+    mnemonic, _, operands = line.partition(" ")
+    if mnemonic == "call" or mnemonic.startswith("j"):
+        return mnemonic, (operands.strip(),)
+    return mnemonic, tuple(operand(text) for text in operands.split(",")) if operands else ()
+
+
+class Program:
+    """The PROCs of a MASM listing, decoded once, with the targets of their labels and .if blocks resolved."""
+
+    def __init__(self, masm):
+        self.lines = []  # (mnemonic, operands, text) of every line of every PROC body
+        self.labels = dict()  # label or PROC name -> index of the line it stands before
+        self.ends = dict()  # index of an .if -> index after its .else or .endif; of an .else -> after its .endif
+        body = None
+        stack = []
+        for line in masm.split("\n"):
+            line = line.strip()
+            if body is None:
+                if line.endswith(" PROC"):
+                    body = line[:-5].strip()
+                    self.labels[body] = len(self.lines)
+            elif line.endswith(" ENDP"):
+                self.lines.append(("endp", (), line))  # running into it is an error
+                body = None
+            elif line.endswith(":"):
+                self.labels[line[:-1]] = len(self.lines)
+            elif line:
+                index = len(self.lines)
+                if line.startswith(".if "):
+                    stack.append(index)
+                elif line == ".else":
+                    self.ends[stack[-1]] = index + 1
+                    stack[-1] = index
+                elif line == ".endif":
+                    self.ends[stack.pop()] = index + 1
+                self.lines.append(decode(line) + (line,))
+
+    def run(self, entry="main", max_instructions=100_000_000, max_stack=None):
+        """Calls entry with no arguments and returns the Run. A stack deeper than max_stack bytes overflows."""
+        if entry not in self.labels:
+            raise Exception(f"No PROC named {entry}")
+        regs = dict.fromkeys(registers, 0)
+        regs["esp"] = STACK_TOP
+        memory = {STACK_TOP: RETURN}
+        zero = carry = False
+        lowest = STACK_TOP
+        bottom = 0 if max_stack is None else STACK_TOP - max_stack
+        counts = Counter()
+        lines, labels, ends = self.lines, self.labels, self.ends
+
+        def read(decoded):
+            kind = decoded[0]
+            if kind == "reg":
+                return regs["eax"] & 0xFF if decoded[1] == "al" else regs[decoded[1]]
+            if kind == "imm":
+                return decoded[1]
+            return memory.get((regs[decoded[1]] + decoded[2]) & MASK, 0)
+
+        def write(decoded, value):
+            kind = decoded[0]
+            if kind == "reg":
+                if decoded[1] == "al":
+                    regs["eax"] = regs["eax"] & ~0xFF & MASK | value & 0xFF
+                else:
+                    regs[decoded[1]] = value & MASK
+            elif kind == "mem":
+                memory[(regs[decoded[1]] + decoded[2]) & MASK] = value & MASK
+            else:
+                raise Exception("An immediate is not writable")
+
+        def jump(label):
+            target = labels.get(label)
+            if target is None:
+                raise Exception(f"Unknown label: {label}")
+            return target
+
+        i = labels[entry]
+        executed = 0
+        while True:
+            mnemonic, operands, text = lines[i]
+            counts[mnemonic] += 1
+            executed += costs.get(mnemonic, 1)
+            if executed > max_instructions:
+                raise Exception(f"More than {max_instructions} instructions executed, at: {text}")
+            i += 1
+            if mnemonic == "mov":
+                write(operands[0], read(operands[1]))
+            elif mnemonic == "push":
+                regs["esp"] = (regs["esp"] - 4) & MASK
+                lowest = min(lowest, regs["esp"])
+                if lowest < bottom:
+                    raise Exception(f"Stack overflow, more than {max_stack} bytes, at: {text}")
+                memory[regs["esp"]] = read(operands[0])
+            elif mnemonic == "pop":
+                value = memory.get(regs["esp"], 0)
+                regs["esp"] = (regs["esp"] + 4) & MASK
+                write(operands[0], value)
+            elif mnemonic in ("add", "sub", "cmp"):
+                left, right = read(operands[0]), read(operands[1])
+                result = left + right if mnemonic == "add" else left - right
+                zero, carry = result & MASK == 0, result > MASK if mnemonic == "add" else left < right
+                if mnemonic != "cmp":
+                    write(operands[0], result)
+            elif mnemonic == ".if":
+                left, comparison, right = operands
+                if not comparisons[comparison](read(left), read(right)):
+                    i = ends[i - 1]
+            elif mnemonic == ".else":  # reached at the end of the true branch
+                i = ends[i - 1]
+            elif mnemonic == ".endif":
+                pass
+            elif mnemonic == "jmp":
+                i = jump(operands[0])
+            elif mnemonic[0] == "j" and mnemonic[1:] in flag_conditions:
+                if flag_conditions[mnemonic[1:]](zero, carry):
+                    i = jump(operands[0])
+            elif mnemonic == "call":
+                regs["esp"] = (regs["esp"] - 4) & MASK
+                lowest = min(lowest, regs["esp"])
+                if lowest < bottom:
+                    raise Exception(f"Stack overflow, more than {max_stack} bytes, at: {text}")
+                memory[regs["esp"]] = i
+                i = jump(operands[0])
+            elif mnemonic == "ret":
+                i = memory.get(regs["esp"], 0)
+                regs["esp"] = (regs["esp"] + 4) & MASK
+                if i == RETURN:
+                    break
+            elif mnemonic in ("mul", "div"):
+                value = read(operands[0])
+                if mnemonic == "mul":
+                    product = regs["eax"] * value
+                    regs["eax"], regs["edx"] = product & MASK, product >> 32
+                else:
+                    if value == 0:
+                        raise Exception(f"Division by zero at: {text}")
+                    dividend = regs["edx"] << 32 | regs["eax"]
+                    if dividend // value > MASK:
+                        raise Exception(f"Division overflow at: {text}")
+                    regs["eax"], regs["edx"] = dividend // value, dividend % value
+            elif mnemonic == "imul":
+                factors = [read(decoded) for decoded in operands[1:]] if len(operands) == 3 \
+                    else [read(operands[0]), read(operands[1])]
+                write(operands[0], factors[0] * factors[1])
+            elif mnemonic in ("and", "xor", "shl", "shr"):
+                left, right = read(operands[0]), read(operands[1])
+                result = left & right if mnemonic == "and" else left ^ right if mnemonic == "xor" \
+                    else left << (right & 31) if mnemonic == "shl" else left >> (right & 31)
+                zero, carry = result & MASK == 0, False
+                write(operands[0], result)
+            elif mnemonic == "inc":
+                write(operands[0], read(operands[0]) + 1)
+                zero = read(operands[0]) == 0
+            elif mnemonic == "dec":
+                write(operands[0], read(operands[0]) - 1)
+                zero = read(operands[0]) == 0
+            elif mnemonic == "neg":
+                value = read(operands[0])
+                write(operands[0], -value)
+                zero, carry = value == 0, value != 0
+            elif mnemonic == "xchg":
+                left, right = read(operands[0]), read(operands[1])
+                write(operands[0], right)
+                write(operands[1], left)
+            elif mnemonic == "lea":
+                address = operands[1]
+                if address[0] != "mem":
+                    raise Exception(f"lea needs a memory operand: {text}")
+                write(operands[0], regs[address[1]] + address[2])
+            elif mnemonic == "movzx":
+                write(operands[0], read(operands[1]))
+            elif mnemonic.startswith("set") and mnemonic[3:] in flag_conditions:
+                write(operands[0], int(flag_conditions[mnemonic[3:]](zero, carry)))
+            elif mnemonic == "endp":
+                raise Exception(f"Ran past the end of a PROC: {text}")
+            else:
+                raise Exception(f"Unsupported instruction: {text}")
+        return Run(regs["eax"], executed, counts, STACK_TOP - lowest)
+
+
+def emulate(masm, entry="main", max_instructions=100_000_000, max_stack=None):
+    """Runs the PROC entry of masm, as the start code of Program does with main, and returns the Run."""
+    return Program(masm).run(entry, max_instructions, max_stack)
+
+
+def main(paths):
+    """Compiles every source at every -O level and runs it; the exit status is 1 if the levels disagree."""
+    status = 0
+    for path in paths:
+        with open(path, "r") as f:
+            code = f.read()
+        print(path)
+        print(f"{'level':>6} {'value':>12} {'instructions':>14} {'stack':>8}")
+        values = set()
+        for level in range(4):
+            run = emulate(compile_source(code, options=Options.level(level)))
+            values.add(run.value)
+            print(f"{'-O' + str(level):>6} {run.value:>12} {run.instructions:>14} {run.stack:>8}")
+        if len(values) > 1:
+            print("the levels return different values")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"]))
@@ -0,0 +1,326 @@
+import sys
+from typing import NamedTuple
+
+from Lexer import Lexer
+from Parser import (Assign, BinaryOperation, Compound, Conditional, Conditional_exp, Constant, Declare, ExpStatement,
+                    For, ForDecl, Function, FunctionCalling, ImmediateOperation, ReturnStatement, Sequence,
+                    TailCall, UnaryOperation, Variable, While, Wrapper, program_parsing, run_parsing)
+
+MASK = 0xFFFFFFFF  # values are unsigned 32-bit, as eax with the mul, div and .if comparisons of the backends
+
+# opcodes of the bytecode; an instruction is a tuple (opcode, argument)
+CONST, LOAD, STORE, POP, INCREMENT, NEGATE, JUMP, JUMP_IF_FALSE, CALL, TAIL_CALL, RETURN, END = range(12)
+ADD, SUBTRACT, MULTIPLY, DIVIDE, REMAINDER, LESS, GREATER, EQUAL, SHIFT_LEFT, SHIFT_RIGHT, AND = range(12, 23)
+binary_opcodes = {"+": ADD, "-": SUBTRACT, "*": MULTIPLY, "/": DIVIDE, "%": REMAINDER, "<": LESS, ">": GREATER,
+                  "==": EQUAL}
+immediate_opcodes = {"add": ADD, "sub": SUBTRACT, "shl": SHIFT_LEFT, "shr": SHIFT_RIGHT, "and": AND}
+
+
+class Code:
+    """Bytecode of one function. Its parameters are the first slots of its frame, its locals the next ones."""
+
+    def __init__(self, name, parameters):
+        self.name = name
+        self.parameters = len(parameters)
+        self.slots = 0  # the Builder declares the parameters, then the locals
+        self.instructions = []
+
+
+class Evaluation(NamedTuple):
+    value: int  # what the entry function returns, unsigned; None if a function ran off the end of its body
+    steps: int  # bytecode instructions executed
+
+
+class Builder:
+    """Compiles a Function to Code. Like IR.Lowering, the methods are generators that yield the generator of a
+    subtree and are resumed with its result, so run_parsing walks deep trees without recursion."""
+
+    def __init__(self, code, codes):
+        self.code = code
+        self.codes = codes  # (name, amount of arguments) -> Code, of every function of the program
+        self.scopes = [dict()]
+
+    def emit(self, opcode, argument=None):
+        self.code.instructions.append((opcode, argument))
+        return len(self.code.instructions) - 1
+
+    def patch(self, index, target=None):
+        """Points the jump at index to target, by default to the next instruction emitted."""
+        target = len(self.code.instructions) if target is None else target
+        self.code.instructions[index] = (self.code.instructions[index][0], target)
+
+    def declare(self, name, kind="int"):
+        if name in self.scopes[-1]:
+            raise Exception(f"Variable {name} is already declared. You are trying to switch its type to {kind}.")
+        self.scopes[-1][name] = self.code.slots
+        self.code.slots += 1
+        return self.scopes[-1][name]
+
+    def lookup(self, name):
+        for scope in self.scopes[::-1]:
+            if name in scope:
+                return scope[name]
+        raise Exception(f"Variable is not declared: {name}")
+
+    def callee(self, name, arguments):
+        code = self.codes.get((name, arguments))
+        if code is None:
+            raise Exception(f"Function is not defined: {name}")
+        return code
+
+    def function_body(self, node):
+        for parameter in node.parameters:
+            self.declare(parameter)
+        for statement in node.statement_list:
+            yield self.statement(statement)
+        self.emit(END)
+
+    def statement(self, node):
+        if isinstance(node, Declare):
+            if node.default_expression is not None:
+                yield self.expression(node.default_expression)
+            else:
+                self.emit(CONST, 0)
+            self.emit(STORE, self.declare(node.dec_name_string, node.dec_type))
+            self.emit(POP)
+        elif isinstance(node, ReturnStatement):
+            yield self.expression(node.expression)
+            self.emit(RETURN)
+        elif isinstance(node, TailCall):
+            yield self.arguments(node.args)
+            self.emit(TAIL_CALL, len(node.args))
+        elif isinstance(node, Compound):
+            self.scopes.append(dict())
+            for statement in node.statements:
+                yield self.statement(statement)
+            self.scopes.pop()
+        elif isinstance(node, Conditional):
+            yield self.expression(node.condition)
+            skip = self.emit(JUMP_IF_FALSE)
+            yield self.statement(node.con_true)
+            if node.con_false is not None:
+                end = self.emit(JUMP)
+                self.patch(skip)
+                yield self.statement(node.con_false)
+                self.patch(end)
+            else:
+                self.patch(skip)
+        elif isinstance(node, While):
+            self.scopes.append(dict())
+            yield self.loop(node, None)
+            self.scopes.pop()
+        elif isinstance(node, (ForDecl, For)):
+            if isinstance(node.initial, Declare):
+                yield self.statement(node.initial)  # declared in the enclosing scope, as by the templates
+            elif node.initial is not None:
+                yield self.expression(node.initial)
+                self.emit(POP)
+            yield self.loop(node, node.post_conditional)
+        elif isinstance(node, (ExpStatement, Conditional_exp)):
+            yield self.expression(node if isinstance(node, Conditional_exp) else node.expression)
+            self.emit(POP)
+        else:
+            raise Exception(f"Unknown statement: {type(node).__name__}")
+
+    def loop(self, node, post_conditional):
+        for invariant in getattr(node, "invariants", ()):  # the loops of Optimizer.optimize_loops
+            yield self.expression(invariant)
+            self.emit(POP)
+        start = len(self.code.instructions)
+        exit_jump = None
+        if node.conditional is not None:
+            yield self.expression(node.conditional)
+            exit_jump = self.emit(JUMP_IF_FALSE)
+        yield self.statement(node.statement)
+        if post_conditional is not None:
+            yield self.expression(post_conditional)
+            self.emit(POP)
+        self.emit(JUMP, start)
+        if exit_jump is not None:
+            self.patch(exit_jump)
+
+    def arguments(self, arguments):
+        for argument in arguments[::-1]:  # last first, as the backends push them
+            yield self.expression(argument)
+
+    def expression(self, node):
+        if isinstance(node, Constant):
+            self.emit(CONST, node.value & MASK)
+        elif isinstance(node, Variable):
+            self.emit(LOAD, self.lookup(node.name_string))
+        elif isinstance(node, Assign):
+            yield self.expression(node.ass_expression)
+            self.emit(STORE, self.lookup(node.ass_name_string))
+        elif isinstance(node, BinaryOperation):
+            if node.operation not in binary_opcodes:
+                raise Exception(f"Unknown binary operator: {node.operation}")
+            if node.operation in ("-", "*"):  # the templates evaluate the right operand of - and * first
+                yield self.expression(node.right)
+                yield self.expression(node.left)
+                self.emit(binary_opcodes[node.operation], True)  # True: the operands are swapped on the stack
+            else:
+                yield self.expression(node.left)
+                yield self.expression(node.right)
+                self.emit(binary_opcodes[node.operation], False)
+        elif isinstance(node, ImmediateOperation):
+            yield self.expression(node.expression)
+            self.emit(CONST, node.operand & MASK)
+            self.emit(immediate_opcodes[node.instruction], False)
+        elif isinstance(node, UnaryOperation):
+            if node.operation == "-":
+                yield self.expression(node.expression)
+                self.emit(NEGATE)
+            elif node.operation == "postfix_++":
+                self.emit(INCREMENT, self.lookup(node.expression.name_string))
+            else:
+                raise Exception(f"Unknown unary operator: {node.operation}")
+        elif isinstance(node, Conditional_exp):
+            yield self.expression(node.condition)
+            skip = self.emit(JUMP_IF_FALSE)
+            yield self.expression(node.con_true)
+            end = self.emit(JUMP)
+            self.patch(skip)
+            if node.con_false is not None:
+                yield self.expression(node.con_false)
+            else:
+                self.emit(CONST, 0)
+            self.patch(end)
+        elif isinstance(node, FunctionCalling):
+            yield self.arguments(node.args)
+            self.emit(CALL, (self.callee(node.func_name, len(node.args)), len(node.args)))
+        elif isinstance(node, Sequence):
+            for i, expression in enumerate(node.expressions):
+                if i:
+                    self.emit(POP)
+                yield self.expression(expression)
+            if not node.expressions:
+                self.emit(CONST, 0)
+        else:
+            raise Exception(f"Unknown expression: {type(node).__name__}")
+
+
+def compile_program(program):
+    """Returns the Code of every defined function of program, keyed by (name, amount of arguments)."""
+    functions = [function for function in program.functions
+                 if isinstance(function, Function) and function.statement_list is not None]
+    codes = {(function.name_string, len(function.parameters)): Code(function.name_string, function.parameters)
+             for function in functions}
+    for function in functions:  # calls refer to the Code objects, so they are filled in place
+        builder = Builder(codes[(function.name_string, len(function.parameters))], codes)
+        run_parsing(builder.function_body(function))
+    return codes
+
+
+def execute(code, arguments=(), max_steps=100_000_000):
+    """Runs code with arguments and returns the Evaluation; calls keep their frames on a list, not on the
+    Python stack."""
+    frame = list(arguments) + [0] * (code.slots - len(arguments))
+    instructions = code.instructions
+    stack = []
+    calls = []  # (instructions, return index, frame) of every caller
+    pc = steps = 0
+    while True:
+        opcode, argument = instructions[pc]
+        pc += 1
+        steps += 1
+        if opcode == LOAD:
+            stack.append(frame[argument])
+        elif opcode == CONST:
+            stack.append(argument)
+        elif opcode == STORE:
+            frame[argument] = stack[-1]
+        elif opcode == POP:
+            stack.pop()
+        elif opcode == JUMP_IF_FALSE:
+            if not stack.pop():
+                pc = argument
+        elif opcode == JUMP:
+            pc = argument
+            if steps > max_steps:
+                raise Exception(f"More than {max_steps} steps executed")
+        elif opcode >= ADD:
+            right = stack.pop()
+            left = stack.pop()
+            if argument:
+                left, right = right, left
+            if opcode == ADD:
+                stack.append((left + right) & MASK)
+            elif opcode == SUBTRACT:
+                stack.append((left - right) & MASK)
+            elif opcode == MULTIPLY:
+                stack.append((left * right) & MASK)
+            elif opcode == DIVIDE or opcode == REMAINDER:
+                if right == 0:
+                    raise Exception("Division by zero")
+                stack.append(left // right if opcode == DIVIDE else left % right)
+            elif opcode == LESS:
+                stack.append(int(left < right))
+            elif opcode == GREATER:
+                stack.append(int(left > right))
+            elif opcode == EQUAL:
+                stack.append(int(left == right))
+            elif opcode == SHIFT_LEFT:
+                stack.append((left << right) & MASK)
+            elif opcode == SHIFT_RIGHT:
+                stack.append(left >> right)
+            else:
+                stack.append(left & right)
+        elif opcode == INCREMENT:
+            stack.append(frame[argument])
+            frame[argument] = (frame[argument] + 1) & MASK
+        elif opcode == NEGATE:
+            stack.append(-stack.pop() & MASK)
+        elif opcode == CALL:
+            callee, count = argument
+            calls.append((instructions, pc, frame))
+            frame = stack[len(stack) - count:][::-1] + [0] * (callee.slots - count)
+            del stack[len(stack) - count:]
+            instructions, pc = callee.instructions, 0
+            if steps > max_steps:
+                raise Exception(f"More than {max_steps} steps executed")
+        elif opcode == TAIL_CALL:
+            frame[:argument] = stack[len(stack) - argument:][::-1]
+            del stack[len(stack) - argument:]
+            pc = 0
+        elif opcode == RETURN:
+            if not calls:
+                return Evaluation(stack.pop(), steps)
+            instructions, pc, frame = calls.pop()
+        elif opcode == END:
+            # the backends return whatever eax holds then, so the run has no value to compare theirs against
+            return Evaluation(None, steps)
+        else:
+            raise Exception(f"Unknown opcode: {opcode}")
+
+
+def evaluate(program, entry="main", arguments=(), max_steps=100_000_000):
+    """Compiles program and runs its function entry with arguments."""
+    code = compile_program(program).get((entry, len(arguments)))
+    if code is None:
+        raise Exception(f"Function is not defined: {entry}")
+    return execute(code, [argument & MASK for argument in arguments], max_steps)
+
+
+def main(paths):
+    """Evaluates every source and checks that the emulated MASM of every -O level returns the same value. A source
+    whose run reaches the end of a function without a return has no defined value, and is not compared."""
+    from Compiler import compile_source  # Emulator and Compiler are only needed for the comparison
+    from Emulator import emulate
+    from Optimizer import Options
+    status = 0
+    for path in paths:
+        with open(path, "r") as f:
+            code = f.read()
+        expected = evaluate(program_parsing(Wrapper(Lexer.tokeniser(code, regex=True)))).value
+        if expected is None:
+            print(f"{path}: undefined, a function ends without a return")
+            continue
+        values = [emulate(compile_source(code, options=Options.level(level))).value for level in range(4)]
+        mismatches = [f"-O{level} returns {value}" for level, value in enumerate(values) if value != expected]
+        print(f"{path}: {expected}" + (f", but {', '.join(mismatches)}" if mismatches else ""))
+        status = status or int(bool(mismatches))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"]))
@@ -0,0 +1,166 @@
+import argparse
+import random
+import sys
+from typing import NamedTuple
+
+
+class Shape(NamedTuple):
+    """Knobs of generate_program."""
+    functions: int = 10  # functions before main, each may call the ones before it
+    depth: int = 3  # nesting of if, while, for and blocks
+    expression: int = 4  # binary operators in an expression at most
+    loops: float = 0.3  # chance that a nested statement is a loop
+    statements: int = 5  # statements in a block at most
+    parameters: int = 3  # parameters of a function at most
+    calls: float = 0.1  # chance that an operand outside of loops is a call
+
+
+operators = ("+", "-", "*", "/", "%", "<", ">", "==")
+parenthesised_depth = 2  # nesting of parenthesised subexpressions, ternaries and call arguments
+
+
+class ProgramGenerator:
+    """Writes a random program that Parser accepts and that always ends: functions call only the ones defined
+    before them and not from loops, loops count a variable that their body does not assign up to a small constant,
+    and every divisor is a nonzero constant or ((e) % 7 + 1)."""
+
+    def __init__(self, seed, shape):
+        self.random = random.Random(seed)
+        self.shape = shape
+        self.functions = []  # (name, amount of parameters) of the functions written so far
+        self.lines = []
+
+    def program(self):
+        for i in range(self.shape.functions):
+            self.function(f"f{i}", self.random.randint(0, self.shape.parameters))
+        self.function("main", 0)
+        return "\n".join(self.lines) + "\n"
+
+    def function(self, name, parameters):
+        self.variables = [f"p{i}" for i in range(parameters)]  # assignable names in scope
+        self.counters = []  # loop variables in scope, read but never assigned by the body
+        self.loops = 0  # loops around the statement being written
+        self.names = 0
+        self.lines.append(f"int {name}({', '.join('int ' + variable for variable in self.variables)}){{")
+        for _ in range(self.random.randint(1, 3)):
+            self.declare(1)
+        self.block(1, self.shape.depth)
+        self.lines.append(f"    return {self.expression()};")
+        self.lines.append("}")
+        self.functions.append((name, parameters))
+
+    def fresh(self, prefix):
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def declare(self, indent):
+        name = self.fresh("v")
+        self.lines.append(f"{'    ' * indent}int {name} = {self.expression()};")
+        self.variables.append(name)
+
+    def block(self, indent, depth):
+        """Writes the statements of a block; the names it declares go out of scope at its end."""
+        variables, counters = len(self.variables), len(self.counters)
+        for _ in range(self.random.randint(1, self.shape.statements)):
+            self.statement(indent, depth)
+        del self.variables[variables:], self.counters[counters:]
+
+    def statement(self, indent, depth):
+        pad = "    " * indent
+        choice = self.random.random()
+        if depth > 0 and choice < self.shape.loops:
+            self.loop(indent, depth)
+        elif depth > 0 and choice < self.shape.loops + 0.2:
+            self.lines.append(f"{pad}if ({self.expression()}) {{")
+            self.block(indent + 1, depth - 1)
+            if self.random.random() < 0.5:
+                self.lines.append(f"{pad}}} else {{")
+                self.block(indent + 1, depth - 1)
+            self.lines.append(f"{pad}}}")
+        elif choice < 0.75:
+            self.lines.append(f"{pad}{self.random.choice(self.variables)} = {self.expression()};")
+        elif choice < 0.85:
+            self.declare(indent)
+        elif choice < 0.9:
+            self.lines.append(f"{pad}{self.random.choice(self.variables)}++;")
+        else:
+            self.lines.append(f"{pad}{self.expression()};")
+
+    def loop(self, indent, depth):
+        pad = "    " * indent
+        counter = self.fresh("i")
+        bound = self.random.randint(1, 4)
+        if self.random.random() < 0.5:
+            self.lines.append(f"{pad}for (int {counter} = 0; {counter} < {bound}; {counter}++) {{")
+            self.counters.append(counter)
+            self.body(indent, depth)
+            self.counters.pop()
+            self.lines.append(f"{pad}}}")
+        else:
+            self.lines.append(f"{pad}int {counter} = 0;")
+            self.lines.append(f"{pad}while ({counter} < {bound}) {{")
+            self.counters.append(counter)
+            self.body(indent, depth)
+            self.lines.append(f"{pad}    {counter}++;")
+            self.counters.pop()
+            self.lines.append(f"{pad}}}")
+            self.counters.append(counter)  # still in scope, and still not to be assigned
+
+    def body(self, indent, depth):
+        self.loops += 1
+        self.block(indent + 1, depth - 1)
+        self.loops -= 1
+
+    def expression(self, nesting=0):
+        parts = [self.operand(nesting)]
+        for _ in range(self.random.randint(0, self.shape.expression)):
+            operator = self.random.choice(operators)
+            parts.append(operator)
+            parts.append(self.divisor(nesting) if operator in ("/", "%") else self.operand(nesting))
+        return " ".join(parts)
+
+    def divisor(self, nesting):
+        if nesting >= parenthesised_depth or self.random.random() < 0.5:
+            return str(self.random.randint(1, 9))
+        return f"(({self.expression(nesting + 1)}) % 7 + 1)"
+
+    def operand(self, nesting):
+        choice = self.random.random()
+        if nesting < parenthesised_depth:
+            if choice < 0.1:
+                return f"({self.expression(nesting + 1)})"
+            if choice < 0.15:
+                return f"({self.expression(nesting + 1)} ? {self.expression(nesting + 1)} : " \
+                       f"{self.expression(nesting + 1)})"
+            if choice < 0.15 + self.shape.calls and self.functions and not self.loops:
+                name, parameters = self.random.choice(self.functions)
+                return f"{name}({', '.join(self.expression(nesting + 1) for _ in range(parameters))})"
+        if choice < 0.3:
+            return f"-{self.random.choice(self.variables + self.counters) if self.variables else '1'}"
+        if choice < 0.6 or not self.variables and not self.counters:
+            return str(self.random.randint(0, 100))
+        return self.random.choice(self.variables + self.counters)
+
+
+def generate_program(seed, shape=Shape()):
+    """Returns the text of a random program of the given shape; the same seed and shape give the same text."""
+    return ProgramGenerator(seed, shape).program()
+
+
+def program_of_size(seed, size, shape=Shape()):
+    """A program of about size bytes or more: shape with as many functions as that takes."""
+    sample = len(generate_program(seed, shape._replace(functions=10)))
+    return generate_program(seed, shape._replace(functions=max(1, size * 10 // sample)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a random program in the C subset of the compiler.")
+    parser.add_argument("--seed", type=int, default=0)
+    for field, default in Shape._field_defaults.items():
+        parser.add_argument(f"--{field}", type=type(default), default=default)
+    args = parser.parse_args(argv)
+    sys.stdout.write(generate_program(args.seed, Shape(**{field: getattr(args, field) for field in Shape._fields})))
+
+
+if __name__ == "__main__":
+    main()
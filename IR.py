@@ -0,0 +1,845 @@
+import sys
+from collections import defaultdict
+
+from Lexer import Lexer
+from Parser import (Assign, BinaryOperation, Compound, Conditional, Conditional_exp, Constant, Declare, ExpStatement,
+                    For, ForDecl, Function, FunctionCalling, ImmediateOperation, Program, ReturnStatement,
+                    Sequence, TailCall, UnaryOperation, Variable, While, Wrapper, program_parsing, run_parsing)
+from Registers import pool, restore
+
+MASK = 0xFFFFFFFF  # 32-bit unsigned arithmetic, as in Optimizer.py
+
+evaluators = {
+    "+": lambda left, right: (left + right) & MASK,
+    "-": lambda left, right: (left - right) & MASK,
+    "*": lambda left, right: (left * right) & MASK,
+    "/": lambda left, right: left // right,
+    "%": lambda left, right: left % right,
+    "<": lambda left, right: int(left < right),
+    ">": lambda left, right: int(left > right),
+    "==": lambda left, right: int(left == right),
+    "shl": lambda left, right: (left << right) & MASK,
+    "shr": lambda left, right: left >> right,
+    "and": lambda left, right: left & right,
+}
+binary = ("+", "-", "*", "/", "%", "<", ">", "==")  # operators of BinaryOperation
+commutative = {"+", "*", "==", "and"}
+immediates = {"add": "+", "sub": "-", "shl": "shl", "shr": "shr", "and": "and"}  # ImmediateOperation -> IR
+mnemonics = {"+": "add", "-": "sub", "shl": "shl", "shr": "shr", "and": "and"}
+conditions = {"<": ("b", "ae"), ">": ("a", "be"), "==": ("e", "ne")}  # unsigned jcc/setcc suffix, and its negation
+loop_weight = 10  # as in Registers.py
+
+
+class Instruction:
+    """target = operation(operands). Operands are virtual registers, named by strings, or int constants.
+
+    extra is the jump label, the (true, false) labels of a branch, the called function or the offset of a param.
+    """
+
+    def __init__(self, operation, target=None, operands=(), extra=None):
+        self.operation = operation
+        self.target = target
+        self.operands = list(operands)
+        self.extra = extra
+
+    def registers(self):
+        return [operand for operand in self.operands if type(operand) is str]
+
+    def __str__(self):
+        operands = ", ".join(map(str, self.operands))
+        if self.operation == "copy":
+            return f"{self.target} = {operands}"
+        if self.operation == "neg":
+            return f"{self.target} = -{operands}"
+        if self.operation in evaluators:
+            return f"{self.target} = {self.operands[0]} {self.operation} {self.operands[1]}"
+        if self.operation == "param":
+            return f"{self.target} = param {self.extra}"
+        if self.operation == "call":
+            return f"{self.target} = call {self.extra}({operands})"
+        if self.operation == "jump":
+            return f"jump L{self.extra}"
+        if self.operation == "branch":
+            return f"branch {operands}, L{self.extra[0]}, L{self.extra[1]}"
+        return f"{self.operation} {operands}"
+
+
+class Block:
+    def __init__(self, label):
+        self.label = label
+        self.instructions = []
+
+    def successors(self):
+        last = self.instructions[-1]
+        if last.operation == "jump":
+            return [last.extra]
+        if last.operation == "branch":
+            return list(last.extra)
+        return []
+
+    def retarget(self, old, new):
+        last = self.instructions[-1]
+        if last.operation == "jump":
+            last.extra = new
+        elif last.operation == "branch":
+            last.extra = tuple(new if label == old else label for label in last.extra)
+
+
+class FunctionIR:
+    """A function as a control flow graph of basic blocks, each ending in a jump, branch or ret."""
+
+    def __init__(self, name, parameters):
+        self.name = name
+        self.parameters = parameters
+        self.blocks = dict()  # label -> Block
+        self.labels = 0
+        self.counter = 0
+        self.entry = self.new_block().label
+
+    def new_block(self):
+        block = Block(self.labels)
+        self.labels += 1
+        self.blocks[block.label] = block
+        return block
+
+    def new_register(self, name="t"):
+        self.counter += 1
+        return f"{name}{self.counter}" if name == "t" else f"{name}.{self.counter}"
+
+    def order(self):
+        """Labels of the blocks reachable from the entry, in reverse postorder."""
+        order = []
+        visited = {self.entry}
+        stack = [(self.entry, iter(self.blocks[self.entry].successors()))]
+        while stack:
+            label, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(self.blocks[successor].successors())))
+                    break
+            else:
+                stack.pop()
+                order.append(label)
+        order.reverse()
+        return order
+
+    def predecessors(self):
+        predecessors = {label: [] for label in self.blocks}
+        for label, block in self.blocks.items():
+            for successor in block.successors():
+                predecessors[successor].append(label)
+        return predecessors
+
+    def __str__(self):
+        lines = [f"{self.name}({', '.join(self.parameters)}):"]
+        for label in self.order():
+            lines.append(f"L{label}:")
+            lines.extend(f"    {instruction}" for instruction in self.blocks[label].instructions)
+        return "\n".join(lines)
+
+
+class Lowering:
+    """Builds the FunctionIR of a Function node; the methods are generators that run_parsing drives."""
+
+    def __init__(self, function):
+        self.function = FunctionIR(function.name_string, function.parameters)
+        self.block = self.function.blocks[self.function.entry]
+        self.scopes = [dict()]
+
+    def emit(self, operation, target=None, operands=(), extra=None):
+        self.block.instructions.append(Instruction(operation, target, operands, extra))
+        return target
+
+    def start(self, block):
+        self.block = block
+
+    def jump(self, block):
+        self.emit("jump", extra=block.label)
+
+    def lookup(self, name):
+        for scope in self.scopes[::-1]:
+            if name in scope:
+                return scope[name]
+        raise Exception(f"Variable is not declared: {name}")
+
+    def function_body(self, node):
+        for i, parameter in enumerate(node.parameters):
+            self.scopes[-1][parameter] = self.emit("param", self.function.new_register(parameter), extra=8 + i * 4)
+        self.body = self.function.new_block()  # where TailCalls jump to, merged into the entry without them
+        self.jump(self.body)
+        self.start(self.body)
+        for statement in node.statement_list:
+            yield self.statement(statement)
+        self.emit("ret", operands=[0])
+
+    def statement(self, node):
+        if isinstance(node, Declare):
+            if node.dec_name_string in self.scopes[-1]:
+                raise Exception(f"Variable {node.dec_name_string} is already declared. "
+                                f"You are trying to switch its type to {node.dec_type}.")
+            value = (yield self.expression(node.default_expression)) if node.default_expression else 0
+            variable = self.function.new_register(node.dec_name_string)
+            self.scopes[-1][node.dec_name_string] = variable
+            self.emit("copy", variable, [value])
+        elif isinstance(node, ReturnStatement):
+            self.emit("ret", operands=[(yield self.expression(node.expression))])
+            self.start(self.function.new_block())  # whatever follows is unreachable
+        elif isinstance(node, TailCall):
+            arguments = []
+            for argument in node.args[::-1]:
+                arguments.append((yield self.expression(argument)))
+            for parameter, value in zip(self.function.parameters, arguments[::-1]):
+                self.emit("copy", self.scopes[0][parameter], [value])
+            self.jump(self.body)
+            self.start(self.function.new_block())  # whatever follows is unreachable
+        elif isinstance(node, Compound):
+            self.scopes.append(dict())
+            for statement in node.statements:
+                yield self.statement(statement)
+            self.scopes.pop()
+        elif isinstance(node, Conditional):
+            condition = yield self.expression(node.condition)
+            true, false, end = self.function.new_block(), self.function.new_block(), self.function.new_block()
+            self.emit("branch", operands=[condition], extra=(true.label, false.label))
+            self.start(true)
+            yield self.statement(node.con_true)
+            self.jump(end)
+            self.start(false)
+            if node.con_false is not None:
+                yield self.statement(node.con_false)
+            self.jump(end)
+            self.start(end)
+        elif isinstance(node, While):
+            self.scopes.append(dict())
+            yield self.loop(node.conditional, node.statement, None)
+            self.scopes.pop()
+        elif isinstance(node, (ForDecl, For)):
+            if node.initial is not None:
+                yield (self.statement(node.initial) if isinstance(node.initial, Declare)
+                       else self.expression(node.initial))
+            yield self.loop(node.conditional, node.statement, node.post_conditional)
+        elif isinstance(node, ExpStatement) and not isinstance(node, Conditional_exp):
+            yield self.expression(node.expression)
+        else:
+            raise Exception(f"Unknown statement: {type(node).__name__}")
+
+    def loop(self, conditional, statement, post_conditional):
+        header, body, end = self.function.new_block(), self.function.new_block(), self.function.new_block()
+        self.jump(header)
+        self.start(header)
+        condition = (yield self.expression(conditional)) if conditional is not None else 1
+        self.emit("branch", operands=[condition], extra=(body.label, end.label))
+        self.start(body)
+        yield self.statement(statement)
+        if post_conditional is not None:
+            yield self.expression(post_conditional)
+        self.jump(header)
+        self.start(end)
+
+    def expression(self, node):
+        """Returns the operand holding the value of node, a constant or a register that nothing assigns later."""
+        if isinstance(node, Constant):
+            return node.value & MASK
+        if isinstance(node, Variable):
+            return self.emit("copy", self.function.new_register(), [self.lookup(node.name_string)])
+        if isinstance(node, Assign):
+            variable = self.lookup(node.ass_name_string)
+            value = yield self.expression(node.ass_expression)
+            self.emit("copy", variable, [value])
+            return value
+        if isinstance(node, BinaryOperation):
+            if node.operation not in binary:
+                raise Exception(f"Unknown binary operator: {node.operation}")
+            if node.operation in ("-", "*"):  # the templates evaluate the right operand of - and * first
+                right = yield self.expression(node.right)
+                left = yield self.expression(node.left)
+            else:
+                left = yield self.expression(node.left)
+                right = yield self.expression(node.right)
+            return self.emit(node.operation, self.function.new_register(), [left, right])
+        if isinstance(node, ImmediateOperation):
+            value = yield self.expression(node.expression)
+            return self.emit(immediates[node.instruction], self.function.new_register(), [value, node.operand])
+        if isinstance(node, UnaryOperation):
+            if node.operation == "-":
+                return self.emit("neg", self.function.new_register(), [(yield self.expression(node.expression))])
+            if node.operation == "postfix_++":
+                variable = self.lookup(node.expression.name_string)
+                value = self.emit("copy", self.function.new_register(), [variable])
+                self.emit("+", variable, [variable, 1])
+                return value
+            raise Exception(f"Unknown unary operator: {node.operation}")
+        if isinstance(node, Conditional_exp):
+            condition = yield self.expression(node.condition)
+            true, false, end = self.function.new_block(), self.function.new_block(), self.function.new_block()
+            result = self.function.new_register()
+            self.emit("branch", operands=[condition], extra=(true.label, false.label))
+            self.start(true)
+            self.emit("copy", result, [(yield self.expression(node.con_true))])
+            self.jump(end)
+            self.start(false)
+            self.emit("copy", result, [(yield self.expression(node.con_false)) if node.con_false else 0])
+            self.jump(end)
+            self.start(end)
+            return result
+        if isinstance(node, FunctionCalling):
+            arguments = []
+            for argument in node.args[::-1]:
+                arguments.append((yield self.expression(argument)))
+            return self.emit("call", self.function.new_register(), arguments, node.func_name)
+        if isinstance(node, Sequence):
+            value = 0
+            for expression in node.expressions:
+                value = yield self.expression(expression)
+            return value
+        raise Exception(f"Unknown expression: {type(node).__name__}")
+
+
+def lower_function(node):
+    lowering = Lowering(node)
+    run_parsing(lowering.function_body(node))
+    return lowering.function
+
+
+def is_pure(instruction):
+    """Whether the instruction only computes its target: it has no side effect and cannot fault."""
+    if instruction.operation in ("/", "%"):
+        return type(instruction.operands[1]) is int and instruction.operands[1] != 0
+    return instruction.operation in evaluators or instruction.operation in ("copy", "neg", "param")
+
+
+def simplify_cfg(function):
+    """Folds branches on constants, threads jumps through empty blocks, drops unreachable blocks and merges a
+    block into its only predecessor when that predecessor jumps straight to it."""
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks.values():
+            last = block.instructions[-1]
+            if last.operation == "branch" and (type(last.operands[0]) is int or last.extra[0] == last.extra[1]):
+                taken = last.extra[0] if last.extra[0] == last.extra[1] or last.operands[0] else last.extra[1]
+                block.instructions[-1] = Instruction("jump", extra=taken)
+                changed = True
+            for successor in block.successors():
+                target, seen = successor, {successor}
+                while len(function.blocks[target].instructions) == 1 \
+                        and function.blocks[target].instructions[0].operation == "jump":
+                    target = function.blocks[target].instructions[0].extra
+                    if target in seen:
+                        break
+                    seen.add(target)
+                if target != successor:
+                    block.retarget(successor, target)
+                    changed = True
+        reachable = function.order()
+        function.blocks = {label: function.blocks[label] for label in reachable}
+        predecessors = function.predecessors()
+        for label in reachable:
+            block = function.blocks.get(label)
+            if block is None:
+                continue
+            while block.instructions[-1].operation == "jump":
+                successor = block.instructions[-1].extra
+                if successor == function.entry or successor == label or len(predecessors[successor]) != 1:
+                    break
+                merged = function.blocks.pop(successor)
+                block.instructions[-1:] = merged.instructions
+                for following in block.successors():
+                    predecessors[following] = [label if p == successor else p for p in predecessors[following]]
+                changed = True
+
+
+def number_values(function):
+    """Local value numbering: propagates copies and constants, folds constant operations and replaces an
+    operation computed again in the same block, with the same operands, by a copy of the first result."""
+    for block in function.blocks.values():
+        values = dict()  # register -> the operand it is a copy of
+        expressions = dict()  # (operation, operands) -> register holding the result
+        copies = defaultdict(set)  # register -> registers in values that copy it
+        users = defaultdict(set)  # register -> keys of expressions that read or hold it
+        instructions = []
+        for instruction in block.instructions:
+            operands = [values.get(operand, operand) if type(operand) is str else operand
+                        for operand in instruction.operands]
+            instruction.operands = operands
+            operation = instruction.operation
+            key = None
+            if operation in evaluators or operation == "neg":
+                if all(type(operand) is int for operand in operands) and (operation not in ("/", "%") or operands[1]):
+                    value = -operands[0] & MASK if operation == "neg" else evaluators[operation](*operands)
+                    instruction.operation, instruction.operands = "copy", [value]
+                else:
+                    ordered = sorted(operands, key=str) if operation in commutative else operands
+                    key = (operation, *ordered)
+                    if key in expressions:
+                        instruction.operation, instruction.operands = "copy", [expressions[key]]
+                        key = None
+            target = instruction.target
+            if instruction.operation == "copy" and instruction.operands[0] == target:
+                continue
+            if target is not None:
+                values.pop(target, None)
+                for copy in copies.pop(target, ()):
+                    if values.get(copy) == target:
+                        del values[copy]
+                for stale in users.pop(target, ()):
+                    expressions.pop(stale, None)
+                if instruction.operation == "copy":
+                    values[target] = instruction.operands[0]
+                    if type(instruction.operands[0]) is str:
+                        copies[instruction.operands[0]].add(target)
+                elif key is not None and target not in operands:
+                    expressions[key] = target
+                    for register in instruction.registers() + [target]:
+                        users[register].add(key)
+            instructions.append(instruction)
+        block.instructions = instructions
+
+
+def liveness(function, order):
+    """Returns the registers live on entry to and on exit from every block."""
+    used, defined = dict(), dict()
+    for label in order:
+        used[label], defined[label] = set(), set()
+        for instruction in function.blocks[label].instructions:
+            used[label].update(r for r in instruction.registers() if r not in defined[label])
+            if instruction.target is not None:
+                defined[label].add(instruction.target)
+    live_in = {label: set() for label in order}
+    live_out = {label: set() for label in order}
+    changed = True
+    while changed:
+        changed = False
+        for label in reversed(order):
+            out = set().union(*(live_in[successor] for successor in function.blocks[label].successors()))
+            if out != live_out[label]:
+                live_out[label] = out
+            entry = used[label] | (out - defined[label])
+            if entry != live_in[label]:
+                live_in[label] = entry
+                changed = True
+    return live_in, live_out
+
+
+def eliminate_dead_code(function):
+    """Removes pure instructions whose result is never read."""
+    changed = True
+    while changed:
+        changed = False
+        order = function.order()
+        _, live_out = liveness(function, order)
+        for label in order:
+            block = function.blocks[label]
+            live = set(live_out[label])
+            kept = []
+            for instruction in reversed(block.instructions):
+                if instruction.target is not None and instruction.target not in live and is_pure(instruction):
+                    changed = True
+                    continue
+                live.discard(instruction.target)
+                live.update(instruction.registers())
+                kept.append(instruction)
+            kept.reverse()
+            block.instructions = kept
+
+
+def read_counts(function):
+    reads = defaultdict(int)
+    for block in function.blocks.values():
+        for instruction in block.instructions:
+            for register in instruction.registers():
+                reads[register] += 1
+    return reads
+
+
+def fused_comparisons(function, reads):
+    """Targets of the comparisons that only decide the branch right after them; they need no location."""
+    fused = set()
+    for block in function.blocks.values():
+        if len(block.instructions) > 1:
+            comparison, last = block.instructions[-2:]
+            if last.operation == "branch" and comparison.operation in conditions \
+                    and last.operands[0] == comparison.target and reads[comparison.target] == 1:
+                fused.add(comparison.target)
+    return fused
+
+
+def coalesce_copies(function):
+    """Writes the result of an instruction straight into the register that the next instruction copies it to,
+    when nothing else reads it: t = a + b / x = t -> x = a + b."""
+    reads = read_counts(function)
+    for block in function.blocks.values():
+        instructions = []
+        for instruction in block.instructions:
+            previous = instructions[-1] if instructions else None
+            if instruction.operation == "copy" and previous is not None and previous.target is not None \
+                    and instruction.operands[0] == previous.target and reads[previous.target] == 1:
+                previous.target = instruction.target
+                continue
+            instructions.append(instruction)
+        block.instructions = instructions
+
+
+def dominators(function, order):
+    """Immediate dominator of every block, by the iterative algorithm of Cooper, Harvey and Kennedy."""
+    index = {label: i for i, label in enumerate(order)}
+    predecessors = function.predecessors()
+    immediate = {function.entry: function.entry}
+    changed = True
+    while changed:
+        changed = False
+        for label in order[1:]:
+            candidates = [p for p in predecessors[label] if p in immediate]
+            new = candidates[0]
+            for other in candidates[1:]:
+                while new != other:
+                    while index[new] > index[other]:
+                        new = immediate[new]
+                    while index[other] > index[new]:
+                        other = immediate[other]
+            if immediate.get(label) != new:
+                immediate[label] = new
+                changed = True
+    return immediate
+
+
+def dominator_intervals(immediate):
+    """Numbers the dominator tree in depth first order: a dominates b when b's interval lies within a's."""
+    tree = defaultdict(list)
+    for label, parent in immediate.items():
+        if label != parent:
+            tree[parent].append(label)
+    intervals = dict()
+    counter = 0
+    stack = [(root, False) for root, parent in immediate.items() if root == parent]
+    while stack:
+        label, done = stack.pop()
+        if done:
+            intervals[label] = (intervals[label], counter)
+            continue
+        intervals[label] = counter
+        counter += 1
+        stack.append((label, True))
+        stack.extend((child, False) for child in tree[label])
+    return intervals
+
+
+def dominates(intervals, dominator, label):
+    return intervals[dominator][0] <= intervals[label][0] and intervals[label][1] <= intervals[dominator][1]
+
+
+def loops(function, order):
+    """Natural loops as (header, set of labels), innermost first."""
+    intervals = dominator_intervals(dominators(function, order))
+    predecessors = function.predecessors()
+    bodies = dict()
+    for label in order:
+        for successor in function.blocks[label].successors():
+            if dominates(intervals, successor, label):
+                body = bodies.setdefault(successor, {successor})
+                stack = [label]
+                while stack:
+                    current = stack.pop()
+                    if current not in body:
+                        body.add(current)
+                        stack.extend(predecessors[current])
+    return sorted(bodies.items(), key=lambda loop: len(loop[1]))
+
+
+def preheader(function, header, body):
+    """The block that runs right before the loop starts, created if there is none."""
+    outside = [label for label in function.predecessors()[header] if label not in body]
+    if len(outside) == 1 and function.blocks[outside[0]].successors() == [header]:
+        return function.blocks[outside[0]]
+    block = function.new_block()
+    block.instructions.append(Instruction("jump", extra=header))
+    for label in outside:
+        function.blocks[label].retarget(header, block.label)
+    return block
+
+
+def hoist_invariants(function):
+    """Moves the pure instructions of every loop whose operands the loop does not assign, and whose target is
+    assigned once in the function, to the loop's preheader."""
+    definitions = defaultdict(int)
+    for block in function.blocks.values():
+        for instruction in block.instructions:
+            if instruction.target is not None:
+                definitions[instruction.target] += 1
+    order = function.order()
+    nest = loops(function, order)
+    for header, body in nest:
+        if header == function.entry:
+            continue
+        assigned = defaultdict(int)
+        for label in body:
+            for instruction in function.blocks[label].instructions:
+                if instruction.target is not None:
+                    assigned[instruction.target] += 1
+        hoisted = []
+        changed = True
+        while changed:
+            changed = False
+            for label in order:
+                if label not in body:
+                    continue
+                block = function.blocks[label]
+                kept = []
+                for instruction in block.instructions:
+                    if is_pure(instruction) and instruction.operation != "param" \
+                            and definitions[instruction.target] == 1 \
+                            and not any(assigned[register] for register in instruction.registers()):
+                        hoisted.append(instruction)
+                        assigned[instruction.target] -= 1
+                        changed = True
+                    else:
+                        kept.append(instruction)
+                block.instructions = kept
+        if hoisted:
+            block = preheader(function, header, body)
+            block.instructions[-1:-1] = hoisted
+            for _, outer in nest:
+                if header in outer and outer is not body:
+                    outer.add(block.label)  # the preheader is part of the loops around this one
+            order = function.order()
+
+
+def optimize_function(function):
+    simplify_cfg(function)
+    number_values(function)
+    eliminate_dead_code(function)
+    hoist_invariants(function)
+    number_values(function)
+    eliminate_dead_code(function)
+    coalesce_copies(function)
+    simplify_cfg(function)
+    return function
+
+
+def allocate(function, order, fused):
+    """Linear scan register allocation over the blocks in `order`. Returns the location of every register, a pool
+    register or a memory operand, the pool registers used and the number of stack slots."""
+    live_in, live_out = liveness(function, order)
+    depth = defaultdict(int)
+    for _, body in loops(function, order):
+        for label in body:
+            depth[label] += 1
+    start, end, weight = dict(), dict(), defaultdict(int)
+    parameters = dict()
+
+    def extend(register, position):
+        start[register] = min(start.get(register, position), position)
+        end[register] = max(end.get(register, position), position)
+
+    position = 0
+    for label in order:
+        instructions = function.blocks[label].instructions
+        first, last = position, position + 2 * len(instructions) - 1
+        for register in live_in[label]:
+            extend(register, first)
+        for instruction in instructions:
+            for register in instruction.registers():
+                if register not in fused:
+                    extend(register, position)
+                    weight[register] += loop_weight ** min(depth[label], 6)
+            if instruction.target is not None and instruction.target not in fused:
+                extend(instruction.target, position + 1)
+                weight[instruction.target] += loop_weight ** min(depth[label], 6)
+                if instruction.operation == "param":
+                    parameters[instruction.target] = instruction.extra
+            position += 2
+        for register in live_out[label]:
+            extend(register, last)
+    locations = dict()
+    active = []  # registers holding a pool register
+    free = list(pool)
+    spilled = []
+    for register in sorted(start, key=lambda r: (start[r], r)):
+        for other in [other for other in active if end[other] < start[register]]:
+            active.remove(other)
+            free.append(locations[other])
+        if free:
+            free.sort(key=pool.index)
+            locations[register] = free.pop(0)
+            active.append(register)
+            continue
+        cheapest = min(active, key=lambda r: weight[r])
+        if weight[cheapest] < weight[register]:
+            locations[register] = locations.pop(cheapest)
+            active.remove(cheapest)
+            active.append(register)
+            spilled.append(cheapest)
+        else:
+            spilled.append(register)
+    used = [register for register in pool if register in locations.values()]
+    slots = 0
+    for register in spilled:
+        if register in parameters:
+            locations[register] = f"dword ptr [ebp + {parameters[register]}]"
+        else:
+            slots += 1
+            locations[register] = f"dword ptr [ebp + {-4 * (len(used) + slots)}]"
+    return locations, used, slots
+
+
+class IRFunction(Function):
+    """Function generated from its FunctionIR instead of the templates of the tree."""
+    __slots__ = ("ir",)
+
+    def __init__(self, function, ir):
+        super().__init__(function.name_string, function.statement_list, function.parameters)
+        self.ir = ir
+
+    def masm_32_parts(self, context):
+        order = self.ir.order()
+        reads = read_counts(self.ir)
+        fused = fused_comparisons(self.ir, reads)
+        locations, saved, slots = allocate(self.ir, order, fused)
+        following = dict(zip(order, order[1:] + [None]))
+        targets = set()
+        for label in order:
+            last = self.ir.blocks[label].instructions[-1]
+            if last.operation == "jump" and last.extra != following[label]:
+                targets.add(last.extra)
+            elif last.operation == "branch":
+                targets.update(successor for successor in last.extra if successor != following[label])
+        marks = {label: context.mark_generating() for label in order if label in targets}
+        selector = Selector(locations, saved, marks, reads, fused)
+        lines = [f"{self.name_string} PROC", "push ebp", "mov ebp, esp"]
+        lines += [f"push {register}" for register in saved]
+        if slots:
+            lines.append(f"sub esp, {4 * slots}")
+        for label in order:
+            if label in marks:
+                lines.append(f"_{marks[label]}:")
+            lines.extend(selector.block(self.ir.blocks[label], following[label]))
+        lines.append(f"{self.name_string} ENDP")
+        yield "\n".join(lines)
+
+
+class Selector:
+    """Selects the MASM instructions of the IR instructions of one function, given where every register lives."""
+
+    def __init__(self, locations, saved, marks, reads, fused):
+        self.locations = locations
+        self.saved = saved
+        self.marks = marks
+        self.reads = reads
+        self.fused = fused
+
+    def location(self, operand):
+        return str(operand) if type(operand) is int else self.locations[operand]
+
+    def block(self, block, following):
+        instructions = block.instructions
+        last, comparison = instructions[-1], instructions[-2] if len(instructions) > 1 else None
+        fused = comparison is not None and comparison.target in self.fused
+        lines = []
+        for instruction in instructions[:-2] if fused else instructions[:-1]:
+            lines.extend(self.instruction(instruction, following))
+        if last.operation == "branch":  # the comparison that only feeds the branch sets the flags it tests
+            lines.extend(self.branch(last, following, comparison if fused else None))
+        else:
+            lines.extend(self.instruction(last, following))
+        return lines
+
+    def compare(self, left, right):
+        left, right = self.location(left), self.location(right)
+        if left[0].isdigit() or left.startswith("dword") and right.startswith("dword"):
+            return [f"mov eax, {left}", f"cmp eax, {right}"]
+        return [f"cmp {left}, {right}"]
+
+    def jump(self, label, following):
+        return [] if label == following else [f"jmp _{self.marks[label]}"]
+
+    def branch(self, instruction, following, comparison=None):
+        true, false = instruction.extra
+        if comparison is not None:
+            lines = self.compare(*comparison.operands)
+            taken, negated = conditions[comparison.operation]
+        else:
+            lines = self.compare(instruction.operands[0], 0)
+            taken, negated = "ne", "e"
+        if true == following:
+            return lines + [f"j{negated} _{self.marks[false]}"]
+        return lines + [f"j{taken} _{self.marks[true]}"] + self.jump(false, following)
+
+    def instruction(self, instruction, following):
+        operation, operands = instruction.operation, instruction.operands
+        target = self.locations.get(instruction.target) if instruction.target is not None else None
+        if operation == "jump":
+            return self.jump(instruction.extra, following)
+        if operation == "ret":
+            return [f"mov eax, {self.location(operands[0])}", restore(self.saved) + "mov esp, ebp", "pop ebp", "ret"]
+        if operation == "param":
+            source = f"dword ptr [ebp + {instruction.extra}]"
+            return [] if target == source else [f"mov {target}, {source}"]
+        if operation == "call":
+            lines = [f"push {self.location(operand)}" for operand in operands]
+            lines.append(f"call {instruction.extra}")
+            if operands:
+                lines.append(f"add esp, {4 * len(operands)}")
+            return lines + ([f"mov {target}, eax"] if self.reads[instruction.target] else [])
+        if operation == "copy":
+            source = self.location(operands[0])
+            if source == target:
+                return []
+            if source.startswith("dword") and target.startswith("dword"):
+                return [f"mov eax, {source}", f"mov {target}, eax"]
+            return [f"mov {target}, {source}"]
+        if operation in ("/", "%"):
+            divisor = self.location(operands[1])
+            lines = [f"mov eax, {self.location(operands[0])}", "xor edx, edx"]
+            if divisor[0].isdigit():
+                lines += [f"push {divisor}", "div dword ptr [esp]", "add esp, 4"]
+            else:
+                lines.append(f"div {divisor}")
+            return lines + [f"mov {target}, {'eax' if operation == '/' else 'edx'}"]
+        if operation in conditions:
+            return self.compare(*operands) + [f"set{conditions[operation][0]} al", "movzx eax, al",
+                                              f"mov {target}, eax"]
+        left, right = operands if operation != "neg" else (operands[0], None)
+        if operation in commutative and (type(left) is int or self.location(right) == target):
+            left, right = right, left
+        register = target if not target.startswith("dword") and (right is None or self.location(right) != target) \
+            else "eax"
+        lines = []
+        if operation == "*" and type(right) is int:
+            lines.append(f"imul {register}, {self.location(left)}, {right}")
+        else:
+            if self.location(left) != register:
+                lines.append(f"mov {register}, {self.location(left)}")
+            if operation == "neg":
+                lines.append(f"neg {register}")
+            elif operation == "*":
+                lines.append(f"imul {register}, {self.location(right)}")
+            else:
+                lines.append(f"{mnemonics[operation]} {register}, {self.location(right)}")
+        if register != target:
+            lines.append(f"mov {target}, {register}")
+        return lines
+
+
+def lower(node):
+    """Replaces every defined function of a Program, or a Function, by an IRFunction generated from its IR."""
+    if isinstance(node, Program):
+        node.functions = [lower(function) for function in node.functions]
+        return node
+    if not isinstance(node, Function) or node.statement_list is None:
+        return node
+    return IRFunction(node, optimize_function(lower_function(node)))
+
+
+def main(paths):
+    for path in paths:
+        with open(path, "r") as f:
+            program = program_parsing(Wrapper(Lexer.tokeniser(f.read(), regex=True)))
+        for function in program.functions:
+            if function.statement_list is not None:
+                print(optimize_function(lower_function(function)))
+                print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"])
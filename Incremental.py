@@ -0,0 +1,140 @@
+import hashlib
+import json
+import re
+
+from Lexer import Lexer
+from Optimizer import Options, called_from_main, called_functions, optimize
+from Peephole import peephole
+from Parser import CompilationContext, Program, StreamWrapper, Wrapper, func_parsing, program_parsing, run_parsing
+
+braces = re.compile(r"[{}]")
+label_line = re.compile(r"^(j\w+ )?_(\d+)(:?)$", re.MULTILINE)
+
+
+def function_chunks(code):
+    """Splits the source text into one chunk per top-level function, or returns None if it does not split.
+
+    Braces, parentheses and semicolons are always tokens of their own, so no token crosses a chunk boundary
+    and every chunk lexes on its own exactly as it does inside the whole file.
+    """
+    chunks = []
+    start = 0
+    while code[start:].strip():
+        close = code.find(")", start)
+        if close < 0:
+            return None
+        body = close + 1
+        while body < len(code) and code[body].isspace():
+            body += 1
+        if code.startswith(";", body):
+            end = body + 1
+        elif code.startswith("{", body):
+            depth = 0
+            for match in braces.finditer(code, body):
+                depth += 1 if match.group() == "{" else -1
+                if depth == 0:
+                    end = match.end()
+                    break
+            else:
+                return None
+        else:
+            return None
+        chunks.append(code[start:end])
+        start = end
+    return chunks
+
+
+def relabel(code, shift):
+    """Shifts every _N mark of a generated block, labels and the jumps to them, by `shift`."""
+    if not shift:
+        return code
+    return label_line.sub(lambda match: f"{match.group(1) or ''}_{int(match.group(2)) + shift}{match.group(3)}", code)
+
+
+def compile_incremental(code, cache, unit, version="", options=Options()):
+    """Compiles code reusing the PROC ... ENDP blocks of functions that did not change since the last build of `unit`.
+
+    A function is identified by its source text together with the state, in CompilationContext.functions at
+    that point of the file, of the signatures it calls and of its own. Unchanged functions are neither lexed,
+    parsed nor generated, so a build costs time proportional to the functions that changed.
+    Returns (masm, reused, regenerated); the output is identical to a full compilation. Sources that do not
+    split into functions cleanly, or fail to compile, are compiled in full so errors are reported as usual, and
+    so are all sources when options.inline is set: inlining a call needs the body of the callee, which a function
+    compiled on its own does not see.
+    """
+    chunks = function_chunks(code) if not options.inline else None
+    if chunks is None:
+        return full_compile(code, options), 0, 0
+    manifest_key = cache.key(unit, version, ("functions", options))
+    manifest = cache.get(manifest_key)
+    # text hash -> [name, amount of arguments, is prototype, called names, their signatures, marks, first mark, code,
+    #               names called once optimised]
+    blocks = json.loads(manifest) if manifest is not None else dict()
+    new_blocks = dict()
+    context = CompilationContext()
+    signatures = dict()  # name -> {amount of arguments: is defined}, mirrors context.functions
+    built = []
+    reused = 0
+    try:
+        for chunk in chunks:
+            text_hash = hashlib.sha256(chunk.encode()).hexdigest()
+            block = blocks.get(text_hash)
+            if block is not None and block[4] == called_signatures(signatures, block[3]):
+                reused += 1
+                name, arity, prototype, _, _, marks, first_mark, masm, _ = block
+                context.var_dict.add_function(name)
+                context.functions[(name, arity)] = context.functions.get((name, arity), False) if prototype else True
+                block[6], block[7] = context.mark_value, relabel(masm, context.mark_value - first_mark)
+            else:
+                tokens = Lexer.tokeniser(chunk, regex=True)
+                close = next(i for i, t in enumerate(tokens) if t.name == ")")
+                name = tokens[1].value
+                arity = sum(1 for t in tokens[:close] if t.name == "identifier") - 1
+                called = sorted({tokens[i].value for i in range(close, len(tokens) - 1)
+                                 if tokens[i].name == "identifier" and tokens[i + 1].name == "("} | {name})
+                snapshot = called_signatures(signatures, called)
+                wrapper = Wrapper(tokens)
+                function = run_parsing(func_parsing(wrapper, context))
+                if function is None or wrapper.look_ahead() is not None:
+                    return full_compile(code, options), 0, 0
+                block_context = CompilationContext()
+                block_context.mark_value = context.mark_value
+                function = optimize(function, options)
+                masm = function.masm_32(context=block_context)
+                masm = peephole(masm) if options.peephole else masm
+                marks = block_context.mark_value - context.mark_value
+                block = [name, arity, tokens[close + 1].name == ";", called, snapshot, marks, context.mark_value, masm,
+                         sorted(called_functions(function))]
+            signatures.setdefault(name, dict())[str(arity)] = context.functions[(name, arity)]
+            new_blocks[text_hash] = block
+            built.append(block)
+            context.mark_value += marks
+    except Exception:
+        return full_compile(code, options), 0, 0
+    if new_blocks != blocks:
+        cache.put(manifest_key, json.dumps(new_blocks))
+    live = None
+    if options.dead_code:
+        calls = dict()
+        for block in built:
+            calls.setdefault(block[0], set()).update(block[8])
+        live = called_from_main(calls)
+    generated = []
+    mark = 0
+    for block in built:
+        if live is None or block[0] in live:  # the marks of dropped functions are not used, as in a full build
+            generated.append(relabel(block[7], mark - block[6]))
+            mark += block[5]
+    # Program takes already generated blocks as well as Function nodes: strings are copied to the output as they are
+    return Program(generated).masm_32(), reused, len(chunks) - reused
+
+
+def called_signatures(signatures, called):
+    return [[name, signatures.get(name, dict())] for name in called]
+
+
+def full_compile(code, options=Options()):
+    context = CompilationContext()
+    program = program_parsing(StreamWrapper(Lexer.token_stream(code, regex=True)), context)
+    masm = optimize(program, options).masm_32(context=context)
+    return peephole(masm) if options.peephole else masm
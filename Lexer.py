@@ -1,11 +1,7 @@
-from Token import Token
+import re
+from functools import partial
 
-
-def find_row_col(code, i):
-    new_code = code[:i]
-    row = new_code.count("\n") + 1
-    col = i - new_code.rfind("\n")
-    return row, col
+from Token import Token, TokenStore
 
 
 def is_float(stroka):
@@ -28,48 +24,150 @@ def is_string(stroka):
     return stroka[0] == stroka[-1] == '"' and stroka.count('"') == 2
 
 
+def is_constant(stroka):
+    return (stroka.isascii() and stroka.isdigit()) or is_int(stroka) or is_float(stroka) or is_string(stroka)
+
+
+def checked_constant(text, row, column):
+    if not is_constant(text):
+        raise Exception(f"syntax error, row and column: {(row, column)}")
+    return text
+
+
+make_token = partial(tuple.__new__, Token)  # Token from a tuple of its fields, without the Python-level __new__
+
+
 class Lexer:
-    keywords = {"void", "int", "float", "char", "double", "long", "return", "null", "true", "false", "class", "if", "else", "while", "for"}
-    one_symbols = {",", "=", ";", ":", "`", "'", "*", "/", "+", "-", "<", ">", "!", "(", ")", "{", "}", "[", "]", "%", "?"}
+    keywords = {"void", "int", "float", "char", "double", "long", "return", "null", "true", "false", "class", "if",
+                "else", "while", "for"}
+    one_symbols = {",", "=", ";", ":", "`", "'", "*", "/", "+", "-", "<", ">", "!", "(", ")", "{", "}", "[", "]", "%",
+                   "?"}
     double_symbols = {"<=", ">=", "!=", "==", "++", "--", "+=", "-=", "/="}
     whitespaces = {" ", "\t", "\n", "\r"}
 
     @classmethod
-    def tokeniser(cls, code) -> object:
+    def master_pattern(cls):
+        """One regular expression for the whole token grammar, compiled once per class.
+
+        Every match is the whitespace in front of a token followed by the token in the group named after its kind:
+        newline (with the whitespace after it), symbol, constant or word, so the engine dispatches on lastgroup.
+        """
+        pattern = cls.__dict__.get("_master_pattern")
+        if pattern is None:
+            symbols = "".join(map(re.escape, sorted(cls.one_symbols)))
+            spaces = "".join(map(re.escape, sorted(cls.whitespaces)))
+            inline = "".join(map(re.escape, sorted(cls.whitespaces - {"\n"})))
+            doubles = "".join(re.escape(s) + "|" for s in sorted(cls.double_symbols) if s[0] in cls.one_symbols)
+            pattern = re.compile(f"[{inline}]*(?:(?P<newline>\\n[{spaces}]*)|(?P<symbol>{doubles}[{symbols}])"
+                                 f"|(?P<constant>[0-9.'\"][^{symbols}{spaces}]*)|(?P<word>[^{symbols}{spaces}]+))")
+            cls._master_pattern = pattern
+        return pattern
+
+    @classmethod
+    def tokeniser(cls, code, regex=False) -> object:
+        return list(cls.token_stream(code, regex))
+
+    @classmethod
+    def token_stream(cls, code, regex=False):
+        """Lazily yields the tokens of code, raising on a bad constant only when the lexer reaches it."""
+        return cls.regex_tokens(code) if regex else cls.scan_tokens(code)
+
+    @classmethod
+    def token_store(cls, code) -> TokenStore:
+        """Lexes code with the regex engine into compact columnar storage instead of a list of Tokens."""
+        names = sorted(cls.keywords | cls.one_symbols | cls.double_symbols | {"constant", "identifier"})
+        store = TokenStore(code, names)
+        store.extend(cls.regex_spans(code))
+        return store
+
+    @classmethod
+    def scan_tokens(cls, code):
         index = 0
-        tokens = []
+        row, line_start = 1, 0  # current row and the index where it starts
         while index < len(code):
             if code[index] in cls.one_symbols:
                 if code[index: index + 2] in cls.double_symbols:
-                    token = Token(code[index:index + 2], None, *find_row_col(code, index))
-                    tokens.append(token)
+                    yield Token(code[index:index + 2], None, row, index - line_start + 1)
                     index += 2
                 else:
-                    token = Token(code[index], None, *find_row_col(code, index))
-                    tokens.append(token)
+                    yield Token(code[index], None, row, index - line_start + 1)
                     index += 1
             elif code[index] in cls.whitespaces:
+                if code[index] == "\n":
+                    row += 1
+                    line_start = index + 1
                 index += 1
             elif code[index].isnumeric() or code[index] in (".", "'", '"'):
                 i = index
-                while index < len(code) and code[index] not in (*cls.one_symbols, *cls.double_symbols, *cls.whitespaces):
+                while index < len(code) and code[index] not in (*cls.one_symbols, *cls.double_symbols,
+                                                                *cls.whitespaces):
                     index += 1
                 constant = code[i:index]
                 if is_int(constant) or is_float(constant) or is_string(constant):
-                    token = Token("constant", constant, *find_row_col(code, i))
-                    tokens.append(token)
+                    yield Token("constant", constant, row, i - line_start + 1)
                 else:
-                    row_col_show = find_row_col(code, i)
+                    row_col_show = (row, i - line_start + 1)
                     raise Exception(f"syntax error, row and column: {row_col_show}")
             else:
                 i = index
-                while index < len(code) and code[index] not in (*cls.one_symbols, *cls.double_symbols, *cls.whitespaces):
+                while index < len(code) and code[index] not in (*cls.one_symbols, *cls.double_symbols,
+                                                                *cls.whitespaces):
                     index += 1
                 constant = code[i:index]
                 if constant in cls.keywords:
-                    token = Token(constant, None, *find_row_col(code, i))
-                    tokens.append(token)
+                    yield Token(constant, None, row, i - line_start + 1)
+                else:
+                    yield Token("identifier", constant, row, i - line_start + 1)
+
+    @classmethod
+    def regex_tokens(cls, code):
+        """The tokens of scan_tokens, with one match of master_pattern per token."""
+        row, line_start = 1, 0
+        keywords = cls.keywords
+        for match in cls.master_pattern().finditer(code):
+            kind = match.lastgroup
+            if kind == "newline":
+                text = match[kind]
+                row += text.count("\n")
+                line_start = match.start(kind) + text.rfind("\n") + 1
+            elif kind == "symbol":
+                yield make_token((match[kind], None, row, match.start(kind) - line_start + 1))
+            elif kind == "word":
+                word = match[kind]
+                column = match.start(kind) - line_start + 1
+                if word in keywords:
+                    yield make_token((word, None, row, column))
+                elif word[0].isnumeric():  # a digit of another script, which the constant group leaves out
+                    yield make_token(("constant", checked_constant(word, row, column), row, column))
+                else:
+                    yield make_token(("identifier", word, row, column))
+            else:
+                column = match.start(kind) - line_start + 1
+                yield make_token(("constant", checked_constant(match[kind], row, column), row, column))
+
+    @classmethod
+    def regex_spans(cls, code):
+        """Yields (name, start, end, row, column) for every token, as regex_tokens finds them."""
+        row, line_start = 1, 0
+        keywords = cls.keywords
+        for match in cls.master_pattern().finditer(code):
+            kind = match.lastgroup
+            start, end = match.span(kind)
+            if kind == "newline":
+                text = match[kind]
+                row += text.count("\n")
+                line_start = start + text.rfind("\n") + 1
+            elif kind == "symbol":
+                yield match[kind], start, end, row, start - line_start + 1
+            elif kind == "word":
+                word = match[kind]
+                if word in keywords:
+                    yield word, start, end, row, start - line_start + 1
+                elif word[0].isnumeric():
+                    checked_constant(word, row, start - line_start + 1)
+                    yield "constant", start, end, row, start - line_start + 1
                 else:
-                    token = Token("identifier", constant, *find_row_col(code, i))
-                    tokens.append(token)
-        return tokens
+                    yield "identifier", start, end, row, start - line_start + 1
+            else:
+                checked_constant(match[kind], row, start - line_start + 1)
+                yield "constant", start, end, row, start - line_start + 1
@@ -0,0 +1,516 @@
+import sys
+from collections import Counter
+from copy import deepcopy
+from typing import NamedTuple
+
+from Lexer import Lexer
+from Parser import (Assign, BinaryOperation, CompilationContext, Compound, Conditional, Conditional_exp, Constant,
+                    Declare, ExpStatement, For, ForDecl, Function, FunctionCalling, ImmediateOperation, Program,
+                    ReturnStatement, Sequence, TailCall, UnaryOperation, Variable, While, Wrapper, children, fill,
+                    joined, post_order, program_parsing, replace_children)
+from IR import lower
+from Registers import allocate_registers
+
+inline_threshold = 24  # default Options.inline: a return of a few operations on the parameters
+MASK = 0xFFFFFFFF  # eax is 32 bits wide; mul, div and the .if comparisons of the templates are all unsigned
+
+folders = {
+    "+": lambda left, right: (left + right) & MASK,
+    "-": lambda left, right: (left - right) & MASK,
+    "*": lambda left, right: (left * right) & MASK,
+    "/": lambda left, right: left // right,
+    "%": lambda left, right: left % right,
+    "<": lambda left, right: int(left < right),
+    ">": lambda left, right: int(left > right),
+    "==": lambda left, right: int(left == right),
+}
+
+
+class Options(NamedTuple):
+    fold: bool = False  # constant folding, algebraic identities and strength reduction
+    inline: int = 0  # size in nodes of the largest leaf function inlined at its call sites, 0 disables inlining
+    tail_calls: bool = False  # return f(...) in the body of f as a jump back to the start of f
+    dead_code: bool = False  # statements that never run and functions that main never calls
+    loops: bool = False  # loops tested at their bottom, invariant parts of their conditions computed before them
+    peephole: bool = False  # rewriting of the generated instructions, see Peephole.py
+    registers: bool = False  # locals and expression temporaries in registers, see Registers.py
+    ir: bool = False  # generation through the three-address form with its own optimisations, see IR.py
+
+    @classmethod
+    def level(cls, level):
+        """Options of the -O<level> command line flag."""
+        return cls(fold=level >= 1, inline=inline_threshold if level >= 2 else 0, tail_calls=level >= 1,
+                   dead_code=level >= 1, loops=level >= 1, peephole=level >= 1, registers=level >= 2, ir=level >= 3)
+
+
+def optimize(node, options, inlined=None):
+    """Runs the passes enabled in options over the tree of node and returns the node to generate. The calls that
+    are inlined are appended to inlined, if given, as (caller, callee) pairs."""
+    if options.inline:
+        node = inline_functions(node, options.inline, inlined)
+    if options.fold:
+        node = fold_constants(node)
+    if options.tail_calls:
+        node = eliminate_tail_calls(node)
+    if options.dead_code:
+        node = remove_dead_code(node)
+    if options.loops and not options.ir:  # the IR lays out and optimises loops itself
+        node = optimize_loops(node)
+    if options.ir:
+        node = lower(node)  # allocates registers itself
+    elif options.registers:
+        node = allocate_registers(node)
+    return node
+
+
+def fold_constants(node):
+    """Folds constant subtrees, applies x+0, x*1 and x*0, and turns operations with a constant operand into
+    ImmediateOperations; multiplying, dividing and taking the remainder by a power of two become shl, shr and and.
+    """
+    replaced = dict()  # id of an original node -> the node that takes its place
+    pure = dict()  # id of a simplified node -> whether evaluating it has no side effects and cannot fault
+    for current in post_order(node):
+        replace_children(current, replaced)
+        result = simplify(current, pure)
+        pure[id(result)] = is_pure(result, pure)
+        if result is not current:
+            replaced[id(current)] = result
+    return replaced.get(id(node), node)
+
+
+def constant_value(node):
+    return node.value & MASK if type(node) is Constant else None
+
+
+def is_power_of_two(value):
+    return value is not None and value > 1 and value & (value - 1) == 0
+
+
+def is_pure(node, pure):
+    kind = type(node)  # exact types: isinstance against the ABC based node classes is several times slower
+    if kind is Constant or kind is Variable:
+        return True
+    if kind is BinaryOperation:
+        if node.operation in ("/", "%") and not constant_value(node.right):
+            return False
+        return node.operation in folders and pure[id(node.left)] and pure[id(node.right)]
+    if kind is UnaryOperation:
+        return node.operation == "-" and pure[id(node.expression)]
+    if kind is ImmediateOperation:
+        return pure[id(node.expression)]
+    if kind is Conditional_exp:
+        return pure[id(node.condition)] and pure[id(node.con_true)] and pure[id(node.con_false)]
+    return False
+
+
+def simplify(node, pure):
+    kind = type(node)
+    if kind is BinaryOperation:
+        return simplify_binary(node, pure)
+    if kind is UnaryOperation and node.operation == "-":
+        value = constant_value(node.expression)
+        if value is not None:
+            return Constant(-value & MASK)
+        if type(node.expression) is UnaryOperation and node.expression.operation == "-":
+            return node.expression.expression
+    if kind is Conditional_exp:
+        value = constant_value(node.condition)
+        if value is not None:
+            return node.con_true if value else node.con_false
+    return node
+
+
+def simplify_binary(node, pure):
+    left, operation, right = node.left, node.operation, node.right
+    left_value, right_value = constant_value(left), constant_value(right)
+    if operation not in folders:
+        return node
+    if left_value is not None and right_value is not None:
+        if operation in ("/", "%") and right_value == 0:
+            return node  # left to fault at run time
+        return Constant(folders[operation](left_value, right_value))
+    if operation == "+":
+        if right_value is not None:
+            return immediate_add(left, right_value)
+        if left_value is not None:
+            return immediate_add(right, left_value)
+    elif operation == "-":
+        if right_value is not None:
+            return immediate_add(left, -right_value & MASK)
+    elif operation == "*":
+        if right_value == 1:
+            return left
+        if left_value == 1:
+            return right
+        if right_value == 0 and pure[id(left)] or left_value == 0 and pure[id(right)]:
+            return Constant(0)
+        if is_power_of_two(right_value):
+            return ImmediateOperation(left, "shl", right_value.bit_length() - 1)
+        if is_power_of_two(left_value):
+            return ImmediateOperation(right, "shl", left_value.bit_length() - 1)
+    elif operation == "/":
+        if right_value == 1:
+            return left
+        if is_power_of_two(right_value):
+            return ImmediateOperation(left, "shr", right_value.bit_length() - 1)
+    elif operation == "%":
+        if right_value == 1 and pure[id(left)]:
+            return Constant(0)
+        if is_power_of_two(right_value):
+            return ImmediateOperation(left, "and", right_value - 1)
+    return node
+
+
+def immediate_add(expression, operand):
+    """Adds the constant operand to expression, merging it into an addition expression already ends with."""
+    if type(expression) is ImmediateOperation and expression.instruction in ("add", "sub"):
+        previous = expression.operand if expression.instruction == "add" else -expression.operand & MASK
+        operand = (operand + previous) & MASK
+        expression = expression.expression
+    if operand == 0:
+        return expression
+    if operand > MASK // 2:
+        return ImmediateOperation(expression, "sub", -operand & MASK)
+    return ImmediateOperation(expression, "add", operand)
+
+
+def remove_dead_code(node):
+    """Drops the statements after a return, the branches and loops whose condition is a constant that never
+    takes them and, given a Program, the functions that are not reachable from main. A function whose every path
+    returns is marked so that it is generated without the epilogue after its body."""
+    replaced = dict()
+    returns = dict()  # id of a statement -> whether every path through it returns
+    for current in post_order(node):
+        replace_children(current, replaced)
+        kind = type(current)
+        result = current
+        if kind is Function and current.statement_list is not None:
+            current.statement_list = reachable_statements(current.statement_list, returns)
+            current.returns = any(returns[id(statement)] for statement in current.statement_list)
+        elif kind is Compound:
+            current.statements = reachable_statements(current.statements, returns)
+        elif kind is Conditional:
+            value = constant_value(current.condition)
+            if value is not None:
+                result = current.con_true if value else current.con_false or Compound([])
+        elif kind is While and constant_value(current.conditional) == 0:
+            result = Compound([])
+        elif (kind is ForDecl or kind is For) and constant_value(current.conditional) == 0:
+            if isinstance(current.initial, Declare):
+                result = current.initial  # the loop variable is declared in the enclosing scope
+            else:
+                result = ExpStatement(current.initial) if current.initial is not None else Compound([])
+        returns[id(result)] = type(result) is ReturnStatement or type(result) is TailCall \
+            or type(result) is Compound and any(returns[id(statement)] for statement in result.statements) \
+            or type(result) is Conditional and result.con_false is not None \
+            and returns[id(result.con_true)] and returns[id(result.con_false)]
+        if result is not current:
+            replaced[id(current)] = result
+    node = replaced.get(id(node), node)
+    if isinstance(node, Program):
+        calls = dict()
+        for function in node.functions:
+            calls.setdefault(function.name_string, set()).update(called_functions(function))
+        live = called_from_main(calls)
+        if live is not None:
+            node.functions = [function for function in node.functions if function.name_string in live]
+    return node
+
+
+def reachable_statements(statements, returns):
+    for i, statement in enumerate(statements):
+        if returns.get(id(statement)):
+            return statements[:i + 1]
+    return statements
+
+
+def called_functions(function):
+    """Names of the functions that function calls."""
+    return {node.func_name for node in post_order(function) if type(node) is FunctionCalling}
+
+
+def called_from_main(calls):
+    """Given the names each function calls, returns the names reachable from main, or None without a main."""
+    if "main" not in calls:
+        return None
+    live = {"main"}
+    stack = ["main"]
+    while stack:
+        for name in calls.get(stack.pop(), ()):
+            if name not in live:
+                live.add(name)
+                stack.append(name)
+    return live
+
+
+def inline_functions(node, threshold, inlined=None):
+    """Replaces the calls of small leaf functions of a Program by their bodies.
+
+    A callee is inlined if its body is straight line, declarations and expression statements ended by its only
+    return, calls no function and counts at most threshold nodes, twice that at call sites inside loops. The call
+    becomes a Sequence that assigns the arguments to the parameters and runs the body, with the parameters and the
+    locals of the callee renamed to variables that are declared at the start of the caller, so every call site has
+    slots of its own. A parameter that the body never changes and whose argument is a constant is replaced by the
+    constant, for fold_constants. Functions are handled in program order, so a caller whose calls were all
+    inlined may be inlined itself further down. A single Function is returned as it is: the bodies of its
+    callees are not known, which is why Incremental.py compiles in full when inlining.
+    """
+    if not isinstance(node, Program):
+        return node
+    bodies = dict()  # (name, amount of arguments) -> the Function, if it can be inlined
+    for function in node.functions:
+        if function.statement_list is not None:
+            inline_calls(function, bodies, threshold, inlined)
+            if inlinable(function):
+                bodies[(function.name_string, len(function.parameters))] = function
+    return node
+
+
+def inlinable(function):
+    statements = function.statement_list
+    if not statements or type(statements[-1]) is not ReturnStatement:
+        return False
+    if any(type(statement) is not Declare and type(statement) is not ExpStatement for statement in statements[:-1]):
+        return False
+    return not any(type(current) is FunctionCalling for current in post_order(Compound(statements)))
+
+
+def inline_calls(function, bodies, threshold, inlined):
+    in_loops = set()  # ids of the nodes evaluated once per iteration of a loop, as in Registers.variable_weights
+    stack = [(statement, False) for statement in function.statement_list]
+    while stack:
+        current, in_loop = stack.pop()
+        if in_loop:
+            in_loops.add(id(current))
+        loop = type(current) in (While, For, ForDecl)
+        stack.extend((child, in_loop or loop and child is not getattr(current, "initial", None))
+                     for child in children(current))
+    replaced = dict()
+    declarations = []
+    for current in post_order(function):
+        replace_children(current, replaced)
+        if type(current) is not FunctionCalling:
+            continue
+        callee = bodies.get((current.func_name, len(current.args)))
+        if callee is None:
+            continue
+        size = len(post_order(Compound(callee.statement_list)))
+        if size > (threshold * 2 if id(current) in in_loops else threshold):
+            continue
+        replaced[id(current)] = inlined_call(callee, current.args, declarations)
+        if inlined is not None:
+            inlined.append((function.name_string, callee.name_string))
+    function.statement_list = [Declare("int", name) for name in declarations] + function.statement_list
+
+
+def inlined_call(callee, arguments, declarations):
+    """Returns the Sequence that takes the place of a call of callee, adding the variables it needs to
+    declarations."""
+    statements = deepcopy(callee.statement_list)
+    body = Compound(statements)
+    changed = {current.ass_name_string for current in post_order(body) if type(current) is Assign}
+    changed.update(current.expression.name_string for current in post_order(body)
+                   if type(current) is UnaryOperation and current.operation == "postfix_++")
+    names = dict()  # name in the callee -> the variable of the caller
+    constants = dict()  # parameter -> the constant argument that replaces it
+    expressions = []
+    for parameter, argument in list(zip(callee.parameters, arguments))[::-1]:  # arguments are evaluated last first
+        if type(argument) is Constant and parameter not in changed:
+            constants[parameter] = argument
+            continue
+        names[parameter] = f"{callee.name_string}.{parameter}.{len(declarations)}"
+        declarations.append(names[parameter])
+        expressions.append(Assign(names[parameter], argument))
+    for statement in statements:
+        if type(statement) is Declare:
+            names[statement.dec_name_string] = f"{callee.name_string}.{statement.dec_name_string}.{len(declarations)}"
+            declarations.append(names[statement.dec_name_string])
+    replaced = dict()
+    for current in post_order(body):
+        replace_children(current, replaced)
+        kind = type(current)
+        if kind is Variable and current.name_string in constants:
+            replaced[id(current)] = Constant(constants[current.name_string].value)
+        elif kind is Variable:
+            current.name_string = names[current.name_string]
+        elif kind is Assign:
+            current.ass_name_string = names[current.ass_name_string]
+    for statement in body.statements:
+        if type(statement) is Declare:
+            expressions.append(Assign(names[statement.dec_name_string], statement.default_expression or Constant(0)))
+        else:
+            expressions.append(statement.expression)
+    return Sequence(expressions)
+
+
+def eliminate_tail_calls(node):
+    """Turns every return of a call of the function it is in, with as many arguments, into a TailCall."""
+    if isinstance(node, Program):
+        node.functions = [eliminate_tail_calls(function) for function in node.functions]
+        return node
+    if not isinstance(node, Function) or node.statement_list is None:
+        return node
+    replaced = dict()
+    for current in post_order(node):
+        replace_children(current, replaced)
+        if type(current) is ReturnStatement and type(current.expression) is FunctionCalling \
+                and current.expression.func_name == node.name_string \
+                and len(current.expression.args) == len(node.parameters):
+            replaced[id(current)] = TailCall(node.name_string, current.expression.args)
+            node.tail_calls = True
+    return node
+
+
+class RotatedWhile(While):
+    """While loop that jumps to its condition once and tests it at the bottom, so an iteration takes one jump.
+    invariants are Assigns of variables that the condition reads instead of parts of it that the loop does not
+    change; they run before the loop. The .else of the test is there for Peephole.fused_condition."""
+    child_fields = ("invariants", "conditional", "statement")
+    __slots__ = ("invariants",)
+
+    def __init__(self, invariants, conditional, statement):
+        super().__init__(conditional, statement)
+        self.invariants = invariants
+
+    def masm_32_parts(self, context):
+        yield joined("\n", self.invariants)
+        yield from rotated_parts(context, self.conditional, [self.statement])
+
+
+class RotatedForDecl(ForDecl):
+    """ForDecl tested at the bottom, see RotatedWhile."""
+    child_fields = ("initial", "invariants", "conditional", "post_conditional", "statement")
+    __slots__ = ("invariants",)
+
+    def __init__(self, initial, invariants, conditional, post_conditional, statement):
+        super().__init__(initial, conditional, post_conditional, statement)
+        self.invariants = invariants
+
+    def masm_32_parts(self, context):
+        yield joined("\n", [self.initial] + self.invariants)
+        body = [self.statement] if self.post_conditional is None else [self.statement, "\n", self.post_conditional]
+        yield from rotated_parts(context, self.conditional, body)
+
+
+def rotated_parts(context, conditional, body):
+    template = """
+{enter}_{body_mark}:
+{body}
+_{test_mark}:
+{test}
+"""
+    body_mark = context.mark_generating()
+    test_mark = context.mark_generating()
+    if conditional is None or constant_value(conditional):  # runs until a return
+        return fill(template, enter="", body_mark=body_mark, body=body, test_mark=test_mark,
+                    test=f"jmp _{body_mark}")
+    return fill(template, enter=f"\njmp _{test_mark}\n", body_mark=body_mark, body=body, test_mark=test_mark,
+                test=[conditional, f"\n.if eax\njmp _{body_mark}\n.else\nmov eax, 0\n.endif"])
+
+
+def optimize_loops(node):
+    """Replaces the While and ForDecl loops of every function by RotatedWhile and RotatedForDecl, whose maximal
+    pure subexpressions of the condition that read no variable the loop changes are computed once, into variables
+    declared at the start of the function."""
+    if isinstance(node, Program):
+        node.functions = [optimize_loops(function) for function in node.functions]
+        return node
+    if not isinstance(node, Function) or node.statement_list is None:
+        return node
+    replaced = dict()
+    declarations = []
+    for current in post_order(node):
+        replace_children(current, replaced)
+        kind = type(current)
+        if kind is not While and kind is not ForDecl:
+            continue
+        invariants = []
+        if current.conditional is not None:
+            current.conditional = hoisted_condition(current, invariants, declarations)
+        if kind is While:
+            replaced[id(current)] = RotatedWhile(invariants, current.conditional, current.statement)
+        else:
+            replaced[id(current)] = RotatedForDecl(current.initial, invariants, current.conditional,
+                                                   current.post_conditional, current.statement)
+    node.statement_list = [Declare("int", name) for name in declarations] + node.statement_list
+    return node
+
+
+def hoisted_condition(loop, invariants, declarations):
+    """Returns the condition of loop with its invariant parts replaced by variables, whose Assigns are added to
+    invariants and names to declarations."""
+    changed = set()  # the variables that the loop assigns, increments or declares
+    for current in post_order(loop):
+        if type(current) is Assign:
+            changed.add(current.ass_name_string)
+        elif type(current) is UnaryOperation and current.operation == "postfix_++":
+            changed.add(current.expression.name_string)
+        elif isinstance(current, Declare):
+            changed.add(current.dec_name_string)
+    pure = dict()
+    invariant = dict()
+    for current in post_order(loop.conditional):
+        pure[id(current)] = is_pure(current, pure)
+        invariant[id(current)] = pure[id(current)] and (type(current) is not Variable
+                                                        or current.name_string not in changed) \
+            and all(invariant[id(child)] for child in children(current))
+    replaced = dict()
+    stack = [loop.conditional]
+    while stack:
+        current = stack.pop()
+        if invariant[id(current)] and type(current) is not Constant and type(current) is not Variable:
+            name = f"invariant.{len(declarations)}"
+            declarations.append(name)
+            invariants.append(Assign(name, current))
+            replaced[id(current)] = Variable(name)
+        else:
+            stack.extend(children(current))
+    for current in post_order(loop.conditional):
+        replace_children(current, replaced)
+    return replaced.get(id(loop.conditional), loop.conditional)
+
+
+def count_instructions(masm):
+    """Counts the lines of masm that are instructions or .if/.else/.endif directives; labels and PROC/ENDP are not."""
+    count = 0
+    for line in masm.splitlines():
+        line = line.strip()
+        if line and not line.endswith(":") and not line.endswith((" PROC", " ENDP")):
+            count += 1
+    return count
+
+
+def function_instructions(program):
+    """Instruction count of every defined function of program, each generated on its own."""
+    return {f"{function.name_string}/{len(function.parameters)}":
+            count_instructions(function.masm_32(context=CompilationContext()))
+            for function in program.functions if isinstance(function, Function) and function.statement_list is not None}
+
+
+def saved_instructions(program, options, inlined=None):
+    """Optimizes program and returns it with a list of (function, instructions before, instructions after)."""
+    before = function_instructions(program)
+    program = optimize(program, options, inlined)
+    after = function_instructions(program)
+    return program, [(name, count, after.get(name, 0)) for name, count in before.items()]
+
+
+def main(paths):
+    for path in paths:
+        with open(path, "r") as f:
+            program = program_parsing(Wrapper(Lexer.tokeniser(f.read(), regex=True)))
+        inlined = []
+        _, report = saved_instructions(program, Options(fold=True, inline=inline_threshold, dead_code=True), inlined)
+        print(path)
+        print(f"{'function':>24} {'before':>8} {'after':>8} {'saved':>8}")
+        for name, before, after in report:
+            print(f"{name:>24} {before:>8} {after:>8} {before - after:>8}")
+        total_before, total_after = sum(row[1] for row in report), sum(row[2] for row in report)
+        print(f"{'total':>24} {total_before:>8} {total_after:>8} {total_before - total_after:>8}")
+        print(f"{'caller':>24} {'callee':>24} {'calls':>8}")
+        for (caller, callee), calls in Counter(inlined).items():
+            print(f"{caller:>24} {callee:>24} {calls:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"])
@@ -1,43 +1,148 @@
 from abc import ABC
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from string import Formatter
+from sys import intern
+
+from Emitter import Emitter
 
 
 class MyNode:
-    def masm_32(self):
+    """Base of the nodes of the tree. Nodes have __slots__ instead of a __dict__, as a program has millions of them;
+    a subclass lists the attributes it adds."""
+    child_fields = ()  # attributes holding child nodes, or lists of them, for passes that walk the tree
+    __slots__ = ()
+
+    def masm_32(self, output=None, context=None):
+        """Returns the code of the node, or streams it into the text file `output` as the tree is walked."""
+        context = context if context is not None else CompilationContext()
+        if output is None:
+            return "".join(generate(self, context))
+        Emitter(output).write_all(generate(self, context))
+
+    def masm_32_parts(self, context):
+        """Yields the code of the node as strings, with child nodes (or iterables of parts) where their code goes."""
         raise NotImplementedError
 
 
+def generate(node, context):
+    """Yields the code of node and its whole subtree, walking it with an explicit stack instead of recursion."""
+    stack = [iter(node.masm_32_parts(context))]
+    while stack:
+        for part in stack[-1]:
+            if isinstance(part, str):
+                yield part
+            else:
+                stack.append(iter(part.masm_32_parts(context) if isinstance(part, MyNode) else part))
+                break
+        else:
+            stack.pop()
+
+
+@lru_cache(maxsize=None)
+def template_parts(template):
+    return tuple(Formatter().parse(template))
+
+
+def fill(template, **fields):
+    """Like template.format(**fields), but returns a list of parts so that fields may be nodes generated later."""
+    parts = []
+    for literal, field, _, _ in template_parts(template):
+        if literal:
+            parts.append(literal)
+        if field is not None:
+            value = fields[field]
+            parts.append(str(value) if isinstance(value, int) else value)
+    return parts
+
+
+def children(node):
+    for field in node.child_fields:
+        value = getattr(node, field)
+        if isinstance(value, list):
+            yield from (child for child in value if isinstance(child, MyNode))
+        elif isinstance(value, MyNode):
+            yield value
+
+
+def post_order(node):
+    """Returns every node of the tree, children before their parents, without recursion."""
+    order = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        order.append(current)
+        stack.extend(children(current))
+    order.reverse()
+    return order
+
+
+def replace_children(node, replaced):
+    """Swaps every child of node found in `replaced`, a dict from id(child) to the node that takes its place."""
+    for field in node.child_fields:
+        value = getattr(node, field)
+        if isinstance(value, list):
+            setattr(node, field, [replaced.get(id(child), child) for child in value])
+        elif value is not None:
+            setattr(node, field, replaced.get(id(value), value))
+
+
+def joined(separator, nodes):
+    for i, node in enumerate(nodes):
+        if i:
+            yield separator
+        yield node
+
+
 class Statement(MyNode, ABC):
-    pass
+    __slots__ = ("row", "column")  # of the first token, set by the parser only; read them with getattr
 
 
 class Scope(Statement):
+    """Names visible at a point of a function. One flat dict holds the innermost binding of every name; a
+    declaration logs the binding it shadows, and deleting a scope undoes the log back to where the scope started,
+    so every operation takes constant time whatever the nesting."""
+    __slots__ = ("bindings", "shadowed", "marks", "func_array")
+
     def __init__(self):
-        self.scope = [dict()]
+        self.bindings = dict()  # name -> (value, depth of the scope that declared it)
+        self.shadowed = []  # (name, binding it replaced or None) of every declaration of the open scopes
+        self.marks = []  # length of `shadowed` when each open scope was created
         self.func_array = []
 
     def __getitem__(self, item):
-        for scope in self.scope[::-1]:
-            if scope.get(item, None) is not None:
-                return scope.get(item, None)
+        binding = self.bindings.get(item)
+        return binding[0] if binding is not None else None
 
     def __setitem__(self, key, value):
-        for scope in self.scope[::-1]:
-            if scope.get(key, None) is not None:
-                scope[key] = value
-                return True
-        return False
+        binding = self.bindings.get(key)
+        if binding is None:
+            return False
+        self.bindings[key] = (value, binding[1])
+        return True
 
     def local_var(self, key, value):
-        self.scope[-1][key] = value
+        binding = self.bindings.get(key)
+        if binding is None or binding[1] != len(self.marks):
+            self.shadowed.append((key, binding))
+        self.bindings[key] = (value, len(self.marks))
 
     def get_local_var(self, key):
-        return self.scope[-1].get(key, None)
+        binding = self.bindings.get(key)
+        return binding[0] if binding is not None and binding[1] == len(self.marks) else None
 
     def create_scope(self):
-        self.scope.append(dict())
+        self.marks.append(len(self.shadowed))
 
     def delete_scope(self):
-        self.scope.pop()
+        mark = self.marks.pop()
+        while len(self.shadowed) > mark:
+            key, binding = self.shadowed.pop()
+            if binding is None:
+                del self.bindings[key]
+            else:
+                self.bindings[key] = binding
 
     def add_function(self, name_function):
         self.func_array.append(name_function)
@@ -46,91 +151,119 @@ class Scope(Statement):
         return name_function in self.func_array
 
 
+class CompilationContext:
+    """State of one compilation, passed through parsing and code generation so that compilations never share it."""
+
+    def __init__(self):
+        self.var_dict = Scope()
+        self.functions = dict()  # key - tuple(name, amount of arguments), value - is the function defined
+        self.mark_value = 0
+        self.temporaries = []  # free registers for expression temporaries, see Registers.py
+        self.entry = None  # mark of the start of the body of the function being generated, see TailCall
+
+    def mark_generating(self):
+        self.mark_value += 1
+        return self.mark_value
+
+
 class Declare(Statement):
-    var_dict = Scope()
-    offset = -4
+    child_fields = ("default_expression",)
+    __slots__ = ("dec_type", "dec_name_string", "default_expression", "offset")
 
     def __init__(self, dec_type, dec_name_string, default_expression=None):
         self.dec_type = dec_type
         self.dec_name_string = dec_name_string
         self.default_expression = default_expression
+        self.offset = None  # of the slot of the variable from ebp, set by resolve
 
-    def masm_32(self) -> str:
-        if Declare.var_dict.get_local_var(self.dec_name_string) is not None:
-            raise Exception(
-                f"Variable {self.dec_name_string} is already declared. You are trying to switch its type to {self.dec_type}.")
+    def masm_32_parts(self, context):
         template = """
 {dec}
-push eax
+mov [ebp + {offset}], eax
 """.strip()
-        Declare.var_dict.local_var(self.dec_name_string, Declare.offset)
-        Declare.offset -= 4
-        return template.format(
-            dec=self.default_expression.masm_32() if self.default_expression else "mov eax, 0")
+        return fill(template, dec=self.default_expression if self.default_expression else "mov eax, 0",
+                    offset=self.offset)
 
 
 class ReturnStatement(Statement):
+    child_fields = ("expression",)
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
-    def masm_32(self) -> str:
+    def masm_32_parts(self, context):
         template = """
 {expression}
 mov esp, ebp
 pop ebp
 ret
 """.strip()
-        return template.format(expression=self.expression.masm_32())
+        return fill(template, expression=self.expression)
 
 
 class ExpStatement(Statement):
+    child_fields = ("expression",)
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
-    def masm_32(self) -> str:
-        return self.expression.masm_32()
+    def masm_32_parts(self, context):
+        yield self.expression
 
 
 class Conditional(Statement):
+    child_fields = ("condition", "con_true", "con_false")
+    __slots__ = ("condition", "con_true", "con_false")
+
     def __init__(self, condition, con_true, con_false=None):
         self.con_false = con_false
         self.con_true = con_true
         self.condition = condition
 
-    def masm_32(self) -> str:
-        result = [self.condition.masm_32(), self.con_true.masm_32(), self.con_false.masm_32() if self.con_false else '']
-        return result[0] + "\n.if eax\n" + result[1] + "\n.else\n" + result[2] + "\n.endif\n"
+    def masm_32_parts(self, context):
+        return self.condition, "\n.if eax\n", self.con_true, "\n.else\n", self.con_false if self.con_false else '', \
+            "\n.endif\n"
 
 
 class Conditional_exp(ExpStatement):
+    child_fields = ("condition", "con_true", "con_false")
+    __slots__ = ("condition", "con_true", "con_false")
 
     def __init__(self, condition, con_true, con_false):
         self.condition = condition
         self.con_true = con_true
         self.con_false = con_false
 
-    def masm_32(self) -> str:
-        result = [self.condition.masm_32(), self.con_true.masm_32(), self.con_false.masm_32() if self.con_false else '']
-        return result[0] + "\n.if eax\n" + result[1] + "\n.else\n" + result[2] + "\n.endif\n"
+    def masm_32_parts(self, context):
+        return self.condition, "\n.if eax\n", self.con_true, "\n.else\n", self.con_false if self.con_false else '', \
+            "\n.endif\n"
 
 
 class For(Statement):
+    child_fields = ("initial", "conditional", "post_conditional", "statement")
+    __slots__ = ("initial", "conditional", "post_conditional", "statement")
+
     def __init__(self, initial, conditional, post_conditional, statement):
         self.statement = statement
         self.post_conditional = post_conditional
         self.conditional = conditional
         self.initial = initial
 
-    def masm_32(self) -> str:
+    def masm_32_parts(self, context):
         self.initial.masm_32()
 
 
 class While(Statement):
+    child_fields = ("conditional", "statement")
+    __slots__ = ("conditional", "statement")
+
     def __init__(self, conditional, statement):
         self.statement = statement
         self.conditional = conditional
 
-    def masm_32(self) -> str:
+    def masm_32_parts(self, context):
         template = """
 _{start_mark}:
 {conditional}
@@ -141,26 +274,24 @@ jmp _{end_mark}
 jmp _{start_mark}
 .endif
 _{end_mark}:
-add esp, 4
 """
-        start_mark = mark_generating()
-        end_mark = mark_generating()
-        Declare.var_dict.create_scope()
-        result = template.format(start_mark=start_mark, end_mark=end_mark,
-                               conditional=self.conditional.masm_32() if self.conditional is not None else '',
-                               statement=self.statement.masm_32())
-        Declare.var_dict.delete_scope()
-        return result
+        start_mark = context.mark_generating()
+        end_mark = context.mark_generating()
+        return fill(template, start_mark=start_mark, end_mark=end_mark,
+                    conditional=self.conditional if self.conditional is not None else '', statement=self.statement)
 
 
 class ForDecl(Statement):
+    child_fields = ("initial", "conditional", "post_conditional", "statement")
+    __slots__ = ("initial", "conditional", "post_conditional", "statement")
+
     def __init__(self, initial, conditional, post_conditional, statement):
         self.statement = statement
         self.post_conditional = post_conditional
         self.conditional = conditional
         self.initial = initial
 
-    def masm_32(self) -> str:
+    def masm_32_parts(self, context):
         template = """
 {initial}
 _{start_mark}:
@@ -174,35 +305,39 @@ jmp _{start_mark}
 .endif
 _{end_mark}:
 """
-        start_mark = mark_generating()
-        end_mark = mark_generating()
-        return template.format(initial=self.initial.masm_32() if self.initial is not None else '',
-                               start_mark=start_mark, end_mark=end_mark,
-                               conditional=self.conditional.masm_32() if self.conditional is not None else '',
-                               post_conditional=self.post_conditional.masm_32()
-                               if self.post_conditional is not None else '',
-                               statement=self.statement.masm_32())
+        start_mark = context.mark_generating()
+        end_mark = context.mark_generating()
+        return fill(template, initial=self.initial if self.initial is not None else '',
+                    start_mark=start_mark, end_mark=end_mark,
+                    conditional=self.conditional if self.conditional is not None else '',
+                    post_conditional=self.post_conditional if self.post_conditional is not None else '',
+                    statement=self.statement)
 
 
 class Expression(MyNode, ABC):
-    pass
+    __slots__ = ()
 
 
 class Constant(Expression):
+    __slots__ = ("value",)
+
     def __init__(self, value):
-        self.value = value
+        self.value = value  # an int, see constant_value
 
-    def masm_32(self) -> str:
-        return f"mov eax, {int(float(self.value))}"
+    def masm_32_parts(self, context):
+        yield f"mov eax, {self.value}"
 
 
 class BinaryOperation(Expression):
+    child_fields = ("left", "right")
+    __slots__ = ("left", "operation", "right")
+
     def __init__(self, left, operation, right):
         self.left = left
         self.operation = operation
         self.right = right
 
-    def masm_32(self) -> str:
+    def masm_32_parts(self, context):
         template: str
         if self.operation == "+":
             template = """
@@ -288,60 +423,79 @@ mov eax, edx
         else:
             raise Exception(
                 f"Unknown binary operator: {self.operation}")
-        return template.format(left_expression=self.left.masm_32(),
-                               right_expression=self.right.masm_32())
+        return fill(template, left_expression=self.left, right_expression=self.right)
 
 
 class UnaryOperation(Expression):
+    child_fields = ("expression",)
+    __slots__ = ("operation", "expression")
+
     def __init__(self, operation, expression):
         self.operation = operation
         self.expression = expression
 
-    def masm_32(self) -> str:
-        template: str
+    def masm_32_parts(self, context):
         if self.operation == "-":
             template = """
 {operation}
 neg eax
 """
+            return fill(template, operation=self.expression)
         elif self.operation == "postfix_++":
-            offset = Declare.var_dict[self.expression.name_string]
             template = """
-{{operation}}
+{operation}
 inc dword ptr[ebp + {offset}]
-""".format(offset=offset)
+"""
+            return fill(template, operation=self.expression, offset=self.expression.offset)
         else:
             raise Exception(
                 f"Unknown unary operator: {self.operation}")
-        return template.format(operation=self.expression.masm_32())
+
+
+class ImmediateOperation(Expression):
+    """Applies an instruction with a constant operand to the value of expression, e.g. shl eax, 3."""
+    child_fields = ("expression",)
+    __slots__ = ("expression", "instruction", "operand")
+
+    def __init__(self, expression, instruction, operand):
+        self.expression = expression
+        self.instruction = instruction
+        self.operand = operand
+
+    def masm_32_parts(self, context):
+        template = """
+{expression}
+{instruction} eax, {operand}
+""".strip()
+        return fill(template, expression=self.expression, instruction=self.instruction, operand=self.operand)
 
 
 class Variable(Expression):
+    __slots__ = ("name_string", "offset")
+
     def __init__(self, name_string):
         self.name_string = name_string
+        self.offset = None  # of the slot of the variable from ebp, set by resolve
 
-    def masm_32(self) -> str:
-        offset = Declare.var_dict[self.name_string]
-        if offset is None:
-            raise Exception(
-                f"Variable is not declared: {self.name_string}")
-        return f"mov eax, [ebp + {offset}]"
+    def masm_32_parts(self, context):
+        yield f"mov eax, [ebp + {self.offset}]"
 
 
 class Assign(Expression):
+    child_fields = ("ass_expression",)
+    __slots__ = ("ass_expression", "ass_name_string", "offset")
+
     def __init__(self, ass_name_string, ass_expression):
         self.ass_expression = ass_expression
         self.ass_name_string = ass_name_string
+        self.offset = None  # of the slot of the variable from ebp, set by resolve
 
-    def masm_32(self) -> str:
-        offset = Declare.var_dict[self.ass_name_string]
-        if offset is None:
-            raise Exception(f"Variable is not declared: {self.ass_name_string}")
+    def masm_32_parts(self, context):
         template = """
 {asn}
 mov [ebp + {offset}], eax
 """.strip()
-        return template.format(asn=self.ass_expression.masm_32(), offset=offset)
+        return fill(template, asn=self.ass_expression, offset=self.offset)
 
 
 class Wrapper:
@@ -360,13 +514,54 @@ class Wrapper:
     def super_look_ahead(self, amount):
         return self.tokens[self.index + 1:self.index + 1 + amount]
 
+    def peek(self, distance=1):
+        index = self.index + distance
+        return self.tokens[index] if len(self.tokens) > index else None
+
+
+class StreamWrapper:
+    """Wrapper over a lazy token iterator that keeps only the next `lookahead` tokens in a ring buffer."""
+
+    def __init__(self, tokens, lookahead=2):
+        self.index = -1
+        self.tokens = iter(tokens)
+        self.buffer = deque(maxlen=lookahead)
+
+    def fill(self, amount):
+        if amount > self.buffer.maxlen:
+            raise ValueError(f"Lookahead of {amount} tokens exceeds the buffer size {self.buffer.maxlen}.")
+        while len(self.buffer) < amount:
+            token = next(self.tokens, None)
+            if token is None:
+                return False
+            self.buffer.append(token)
+        return True
+
+    def look_ahead(self):
+        return self.buffer[0] if self.fill(1) else None
+
+    def next_index(self):
+        if not self.fill(1):
+            raise IndexError("token stream is exhausted")
+        self.index += 1
+        return self.buffer.popleft()
+
+    def super_look_ahead(self, amount):
+        self.fill(amount)
+        return list(islice(self.buffer, amount))
+
+    def peek(self, distance=1):
+        return self.buffer[distance - 1] if self.fill(distance) else None
+
 
 class Program(MyNode):
+    child_fields = ("functions",)
+    __slots__ = ("functions",)
+
     def __init__(self, functions):
         self.functions = functions
 
-    def masm_32(self) -> str:
-        Declare.var_dict = Scope()
+    def masm_32_parts(self, context):
         template = """.386
 
 .model flat, stdcall
@@ -398,326 +593,489 @@ start:
 
 END start
 """.strip()
-        functions = list()
-        for function in self.functions:
-            functions.append(function.masm_32())
-            Declare.offset = -4
-        return template.format(functions="\n".join(functions))
+        return fill(template, functions=self.functions_parts(context))
+
+    def functions_parts(self, context):
+        for i, function in enumerate(self.functions):
+            if i:
+                yield "\n"
+            yield function
 
 
 class Function(MyNode):
-    functions = dict()  # key - tuple(name, amount of arguments), value - (or have statement list)
+    child_fields = ("statement_list",)
+    __slots__ = ("statement_list", "name_string", "parameters", "returns", "tail_calls", "row", "column")
 
     def __init__(self, name_string, statement_list, parameters):
         self.statement_list = statement_list
         self.name_string = name_string
         self.parameters = parameters
+        self.returns = False  # every path through the body returns, set by Optimizer.remove_dead_code
+        self.tail_calls = False  # the body contains TailCalls, set by Optimizer.eliminate_tail_calls
 
-    def masm_32(self) -> str:
-        Declare.var_dict.create_scope()
-        for i, param in enumerate(self.parameters[::-1]):
-            Declare.var_dict.local_var(param, 8 + i * 4)
+    def masm_32_parts(self, context):
         template = """
 {name} PROC
 push ebp
 mov ebp, esp
-{statement_list}
-mov esp, ebp
-pop ebp
-ret
-{name} ENDP
+{entry}{frame}{statement_list}
+{epilogue}{name} ENDP
 """.strip()
-        code = template.format(
-            name=self.name_string,
-            statement_list="\n".join(
-                s.masm_32()
-                for s in self.statement_list
-            )
-        )
-        Declare.var_dict.delete_scope()
-        return code
+        context.entry = context.mark_generating() if self.tail_calls else None
+        entry = f"_{context.entry}:\n" if self.tail_calls else ""
+        epilogue = "" if self.returns else "mov esp, ebp\npop ebp\nret\n"
+        return fill(template, name=self.name_string, entry=entry, frame=frame_parts(resolve(self)),
+                    statement_list=joined("\n", self.statement_list), epilogue=epilogue)
+
+
+def frame_parts(size):
+    return f"sub esp, {size}\n" if size else ""
+
+
+def resolve(function, base=-4, registers=None):
+    """Binds every Variable, Assign and Declare of function to the slot of its variable in one walk of the body and
+    returns the bytes the slots of the locals take. Parameters are at ebp+8, ebp+12, ...; locals at base, base-4,
+    ..., where scopes that are not open at once share slots. The function reserves the bytes on entry, so that
+    declarations store into their slots instead of pushing. Locals named in registers, name -> register, are bound
+    to their register and take no slot."""
+    registers = registers or dict()
+    scope = Scope()
+    scope.create_scope()
+    for i, param in enumerate(function.parameters):
+        scope.local_var(param, 8 + i * 4)
+    used = size = 0  # slots of the open scopes, slots of the function
+    # besides nodes, the stack holds the slots used before a scope, to go back to when it closes, and a Declare in
+    # a tuple where its variable comes into scope, after its default expression
+    stack = function.statement_list[::-1]
+    while stack:
+        node = stack.pop()
+        if type(node) is int:
+            scope.delete_scope()
+            used = node
+            continue
+        if type(node) is tuple:
+            node = node[0]
+            if scope.get_local_var(node.dec_name_string) is not None:
+                raise Exception(f"Variable {node.dec_name_string} is already declared. "
+                                f"You are trying to switch its type to {node.dec_type}.")
+            if node.dec_name_string in registers:
+                node.offset = registers[node.dec_name_string]
+            else:
+                node.offset = base - used * 4
+                used += 1
+                size = max(size, used)
+            scope.local_var(node.dec_name_string, node.offset)
+            continue
+        kind = resolve_kinds.get(type(node))
+        if kind is None:
+            kind = resolve_kinds[type(node)] = resolve_kind(type(node))
+        if kind == "variable" or kind == "assign":
+            name = node.name_string if kind == "variable" else node.ass_name_string
+            node.offset = scope[name]
+            if node.offset is None:
+                raise Exception(f"Variable is not declared: {name}")
+        elif kind == "declare":
+            stack.append((node,))
+        elif kind == "scope":
+            scope.create_scope()
+            stack.append(used)
+        for field in reversed(node.child_fields):
+            value = getattr(node, field)
+            if type(value) is list:
+                stack.extend(child for child in reversed(value) if isinstance(child, MyNode))
+            elif isinstance(value, MyNode):
+                stack.append(value)
+    return size * 4
+
+
+resolve_kinds = dict()  # node class -> what resolve does with its nodes
+
+
+def resolve_kind(cls):
+    if issubclass(cls, Variable):
+        return "variable"
+    if issubclass(cls, Assign):
+        return "assign"
+    if issubclass(cls, Declare):
+        return "declare"
+    if issubclass(cls, (Compound, While)):
+        return "scope"
+    return "other"
 
 
 class FunctionCalling(Expression):
+    child_fields = ("args",)
+    __slots__ = ("args", "func_name")
 
     def __init__(self, func_name, args):
         self.args = args
         self.func_name = func_name
 
-    def masm_32(self) -> str:
-        arguments = [argument.masm_32() for argument in self.args]
-        code = "\npush eax\n".join(
-            arguments[::-1]) + "\npush eax\n" + f"call {self.func_name}\n" + f"add esp, {len(arguments) * 4}\n"
-        return code
+    def masm_32_parts(self, context):
+        yield joined("\npush eax\n", self.args[::-1])
+        yield ("\npush eax\n" if self.args else "\n") + f"call {self.func_name}\n" + f"add esp, {len(self.args) * 4}\n"
+
+
+class TailCall(Statement):
+    """return f(args) in the body of f: the arguments replace the parameters and the body starts over, instead of
+    a call that grows the stack. Made by Optimizer.eliminate_tail_calls."""
+    child_fields = ("args",)
+    __slots__ = ("args", "func_name")
+
+    def __init__(self, func_name, args):
+        self.args = args
+        self.func_name = func_name
+
+    def masm_32_parts(self, context):
+        yield from self.arguments_parts()
+        yield f"mov esp, ebp\njmp _{context.entry}"
+
+    def arguments_parts(self):
+        # every argument is evaluated before any parameter changes, as they may read the parameters
+        yield joined("\npush eax\n", self.args[::-1])
+        if self.args:
+            yield "\npush eax\n"
+        yield "".join(f"pop eax\nmov [ebp + {8 + i * 4}], eax\n" for i in range(len(self.args)))
+
+
+class Sequence(Expression):
+    """Evaluates expressions in order, its value is that of the last one. The grammar has no comma operator,
+    the inliner of Optimizer.py builds these."""
+    child_fields = ("expressions",)
+    __slots__ = ("expressions",)
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+
+    def masm_32_parts(self, context):
+        yield joined("\n", self.expressions)
 
 
 class Compound(Statement):
+    child_fields = ("statements",)
+    __slots__ = ("statements",)
+
     def __init__(self, statements):
         self.statements = statements
 
-    def masm_32(self):
-        Declare.var_dict.create_scope()
-        result = "\n".join(map(lambda x: x.masm_32(), self.statements))
-        Declare.var_dict.delete_scope()
-        return result
+    def masm_32_parts(self, context):
+        yield joined("\n", self.statements)
+
+
+# The parsing functions below are generators so that nesting depth is not limited by Python's recursion:
+# a parser yields the generator of a sub-parser and is resumed with its result, run_parsing keeps the stack.
+
+
+def run_parsing(parser):
+    stack = [parser]
+    result, error = None, None
+    while stack:
+        try:
+            child = stack[-1].send(result) if error is None else stack[-1].throw(error)
+        except StopIteration as stop:
+            stack.pop()
+            result, error = stop.value, None
+        except Exception as exception:
+            stack.pop()
+            if not stack:
+                raise
+            result, error = None, exception
+        else:
+            stack.append(child)
+            result, error = None, None
+    return result
+
 
+def program_parsing(tokens, context=None) -> Program:
+    context = context if context is not None else CompilationContext()
+    return Program(list(program_stream_parsing(tokens, context)))
 
-def program_parsing(tokens) -> Program:
-    functions = []
+
+def program_stream_parsing(tokens, context=None):
+    """Yields every function as soon as it is parsed, so a StreamWrapper never holds more than its lookahead."""
+    context = context if context is not None else CompilationContext()
     while tokens.look_ahead() is not None:
-        functions.append(func_parsing(tokens))
-    return Program(functions)
+        yield run_parsing(func_parsing(tokens, context))
 
 
-def func_parsing(tokens: Wrapper):
+def func_parsing(tokens: Wrapper, context):
     if tokens.look_ahead().name == "int":
-        tokens.next_index()
+        first = tokens.next_index()
         if tokens.look_ahead().name == "identifier":
-            name = tokens.next_index().value
-            Declare.var_dict.add_function(name)
+            name = intern(tokens.next_index().value)
+            context.var_dict.add_function(name)
             parameters = []
             if tokens.look_ahead().name == "(":
                 tokens.next_index()
                 if tokens.look_ahead().name == "int":
                     tokens.next_index()
                     if tokens.look_ahead().name == "identifier":
-                        parameters.append(tokens.next_index().value)
+                        parameters.append(intern(tokens.next_index().value))
                         while tokens.look_ahead().name == ",":
                             tokens.next_index()
                             if tokens.look_ahead().name == "int":
                                 tokens.next_index()
                                 if tokens.look_ahead().name == "identifier":
-                                    parameters.append(tokens.next_index().value)
+                                    parameters.append(intern(tokens.next_index().value))
                 if tokens.look_ahead().name == ")":
                     tokens.next_index()
                     if tokens.look_ahead().name == ";":
                         tokens.next_index()
-                        Function.functions[(name, len(parameters))] = Function.functions.get((name, len(parameters)),
-                                                                                             False)
-                        return Function(name, None, parameters)
+                        signature = (name, len(parameters))
+                        context.functions[signature] = context.functions.get(signature, False)
+                        return positioned(Function(name, None, parameters), first)
                     t = tokens.look_ahead()
                     if t.name == "{":
                         tokens.next_index()
-                        function_exist = Function.functions.get((name, len(parameters)), None)
+                        function_exist = context.functions.get((name, len(parameters)), None)
                         if function_exist is not None and function_exist:
                             raise Exception(f"Error. Function redeclaration. Row: {t.row}. Column: {t.column}.")
-                        Function.functions[(name, len(parameters))] = True
+                        context.functions[(name, len(parameters))] = True
                         statements = []
-                        Declare.var_dict.create_scope()
+                        context.var_dict.create_scope()
                         for p in parameters:
-                            Declare.var_dict.local_var(p, 0)
+                            context.var_dict.local_var(p, 0)
                         try:
                             while tokens.look_ahead().name != "}":
-                                statement = statement_parsing(tokens)
+                                statement = yield statement_parsing(tokens, context)
                                 statements.append(statement)
                         except AttributeError:
                             raise Exception(f"Error. Missing brace in function. Row: {t.row}. Column: {t.column}.")
-                        Declare.var_dict.delete_scope()
+                        context.var_dict.delete_scope()
                         tokens.next_index()
-                        return Function(name, statements, parameters)
+                        return positioned(Function(name, statements, parameters), first)
+
 
+def positioned(node, token):
+    """Gives node the position of token, its first one."""
+    node.row, node.column = token.row, token.column
+    return node
 
-def statement_parsing(tokens):
-    if tokens.look_ahead().name == "return":
+
+def statement_parsing(tokens, context):
+    first = tokens.look_ahead()
+    kind = first.name
+    if kind == "return":
         tokens.next_index()
-        expression = exp_parsing(tokens)
+        expression = yield exp_parsing(tokens, context)
         if tokens.look_ahead().name == ";":
             tokens.next_index()
-            return ReturnStatement(expression)
-    elif tokens.look_ahead().name in ("int", "float"):
-        return declare_parsing(tokens)
-    elif tokens.look_ahead().name == "if":
+            return positioned(ReturnStatement(expression), first)
+    elif kind in ("int", "float"):
+        return (yield declare_parsing(tokens, context))
+    elif kind == "if":
         tokens.next_index()
         if tokens.next_index().name == "(":
-            expression = exp_parsing(tokens)
+            expression = yield exp_parsing(tokens, context)
             if tokens.next_index().name == ")":
-                statement = statement_parsing(tokens)
+                statement = yield statement_parsing(tokens, context)
                 if tokens.look_ahead().name == "else":
                     tokens.next_index()
-                    other_statement = statement_parsing(tokens)
-                    return Conditional(expression, statement, other_statement)
-                return Conditional(expression, statement)
-    elif tokens.look_ahead().name == "for":
+                    other_statement = yield statement_parsing(tokens, context)
+                    return positioned(Conditional(expression, statement, other_statement), first)
+                return positioned(Conditional(expression, statement), first)
+    elif kind == "for":
         tokens.next_index()
         if tokens.look_ahead().name == "(":
             tokens.next_index()
             if tokens.look_ahead().name in ("int", "float"):
-                initial = declare_parsing(tokens)
-                conditional = exp_option_semicolon_parsing(tokens)
-                post_expression = exp_option_close_paren_parsing(tokens)
+                initial = yield declare_parsing(tokens, context)
+                conditional = yield exp_option_semicolon_parsing(tokens, context)
+                post_expression = yield exp_option_close_paren_parsing(tokens, context)
                 if conditional is None:
                     conditional = Constant(1)
-                statement = statement_parsing(tokens)
-                return ForDecl(initial, conditional, post_expression, statement)
+                statement = yield statement_parsing(tokens, context)
+                return positioned(ForDecl(initial, conditional, post_expression, statement), first)
             else:
-                initial = exp_option_semicolon_parsing(tokens)
-                conditional = exp_option_semicolon_parsing(tokens)
-                post_expression = exp_option_close_paren_parsing(tokens)
+                initial = yield exp_option_semicolon_parsing(tokens, context)
+                conditional = yield exp_option_semicolon_parsing(tokens, context)
+                post_expression = yield exp_option_close_paren_parsing(tokens, context)
                 if conditional is None:
                     conditional = Constant(1)
-                statement = statement_parsing(tokens)
-                return For(initial, conditional, post_expression, statement)
-    elif tokens.look_ahead().name == "while":
+                statement = yield statement_parsing(tokens, context)
+                return positioned(For(initial, conditional, post_expression, statement), first)
+    elif kind == "while":
         tokens.next_index()
         if tokens.look_ahead().name == "(":
             tokens.next_index()
-            conditional = exp_option_close_paren_parsing(tokens)
+            conditional = yield exp_option_close_paren_parsing(tokens, context)
             if conditional is None:
                 conditional = Constant(1)
-            statement = statement_parsing(tokens)
-            return While(conditional, statement)
-    elif tokens.look_ahead().name == "{":
-        Declare.var_dict.create_scope()
+            statement = yield statement_parsing(tokens, context)
+            return positioned(While(conditional, statement), first)
+    elif kind == "{":
+        context.var_dict.create_scope()
         tokens.next_index()
         statements = []
         while tokens.look_ahead().name != "}":
-            statements.append(statement_parsing(tokens))
+            statement = yield statement_parsing(tokens, context)
+            statements.append(statement)
         if tokens.look_ahead().name == "}":
             tokens.next_index()
-            Declare.var_dict.delete_scope()
-            return Compound(statements)
+            context.var_dict.delete_scope()
+            return positioned(Compound(statements), first)
     else:
-        exp = exp_parsing(tokens)
+        exp = yield exp_parsing(tokens, context)
         if tokens.look_ahead().name == ";":
             tokens.next_index()
-            return ExpStatement(exp)
-
-
-def binary_operator_priority(operators, func):
-    def prior_func(tokens):
-        left = func(tokens)
-        while tokens.look_ahead().name in operators:
-            op = tokens.next_index().name
-            right = func(tokens)
-            left = BinaryOperation(left, op, right)
-        return left
+            return positioned(ExpStatement(exp), first)
 
-    return prior_func
 
-
-def declare_parsing(tokens):
+def declare_parsing(tokens, context):
     if tokens.look_ahead().name in ("int", "float"):
-        dec_type = tokens.next_index().name
+        first = tokens.next_index()
+        dec_type = first.name
         if tokens.look_ahead().name == "identifier":
             t = tokens.next_index()
-            id_name = t.value
-            if Declare.var_dict.get_local_var(id_name):
+            id_name = intern(t.value)
+            if context.var_dict.get_local_var(id_name):
                 raise Exception(f"Double declaration of variable. Row: {t.row}. Column: {t.column}.")
             exp = None
             if tokens.look_ahead().name == "=":
                 tokens.next_index()
-                exp = exp_parsing(tokens)
+                exp = yield exp_parsing(tokens, context)
             if tokens.look_ahead().name == ";":
                 tokens.next_index()
-            Declare.var_dict.local_var(id_name, 0)
-            return Declare(dec_type, id_name, exp)
+            context.var_dict.local_var(id_name, 0)
+            return positioned(Declare(dec_type, id_name, exp), first)
 
 
-def exp_option_semicolon_parsing(tokens):
+def exp_option_semicolon_parsing(tokens, context):
     t = tokens.look_ahead()
     if tokens.look_ahead().name == ";":
         tokens.next_index()
         return None
-    exp = exp_parsing(tokens)
+    exp = yield exp_parsing(tokens, context)
     if tokens.next_index().name == ";":
         return exp
     else:
         raise Exception(f"Error. Bad syntax in for. Column: {t.column}. Row: {t.row}.")
 
 
-def exp_option_close_paren_parsing(tokens):
+def exp_option_close_paren_parsing(tokens, context):
     t = tokens.look_ahead()
     if tokens.look_ahead().name == ")":
         tokens.next_index()
         return None
-    exp = exp_parsing(tokens)
+    exp = yield exp_parsing(tokens, context)
     if tokens.next_index().name == ")":
         return exp
     else:
         raise Exception(f"Error. Bad syntax in for. Column: {t.column}. Row: {t.row}.")
 
 
-def exp_parsing(tokens):
-    if list(map(lambda x: x.name, tokens.super_look_ahead(2))) == ["identifier", "="]:
+def exp_parsing(tokens, context):
+    first, second = tokens.peek(1), tokens.peek(2)
+    if second is not None and first.name == "identifier" and second.name == "=":
         id_name = tokens.next_index()
         tokens.next_index()
-        exp = exp_parsing(tokens)
-        return Assign(id_name.value, exp)
-    elif list(map(lambda x: x.name, tokens.super_look_ahead(2))) == ["identifier", "/="]:
+        exp = yield exp_parsing(tokens, context)
+        return Assign(intern(id_name.value), exp)
+    elif second is not None and first.name == "identifier" and second.name == "/=":
         id_name = tokens.next_index()
         tokens.next_index()
-        exp = exp_parsing(tokens)
-        return Assign(id_name.value, BinaryOperation(Variable(id_name.value), "/", exp))
+        exp = yield exp_parsing(tokens, context)
+        name = intern(id_name.value)
+        return Assign(name, BinaryOperation(Variable(name), "/", exp))
     else:
-        return conditional_exp_parsing(tokens)
-
-
-def conditional_exp_parsing(tokens):
-    exp = binary_operator_priority(["=="],
-                                   binary_operator_priority(["<", ">"],
-                                                            binary_operator_priority(["+", "-"],
-                                                                                     binary_operator_priority(
-                                                                                         ["*", "/", "%"],
-                                                                                         binary_operator_priority(
-                                                                                             ["++", "--"],
-                                                                                             factor_parsing)))))(tokens)
+        return (yield conditional_exp_parsing(tokens, context))
+
+
+# binding power of every binary operator, higher binds tighter; all of them are left-associative
+binary_priorities = {"==": 1, "<": 2, ">": 2, "+": 3, "-": 3, "*": 4, "/": 4, "%": 4, "++": 5, "--": 5}
+
+
+def binary_exp_parsing(tokens, context, min_priority=1):
+    left = yield factor_parsing(tokens, context)
+    while True:
+        priority = binary_priorities.get(tokens.look_ahead().name, 0)
+        if priority < min_priority:
+            return left
+        op = tokens.next_index().name
+        right = yield binary_exp_parsing(tokens, context, priority + 1)
+        left = BinaryOperation(left, op, right)
+
+
+def conditional_exp_parsing(tokens, context):
+    exp = yield binary_exp_parsing(tokens, context)
     if tokens.look_ahead().name == '?':
         t = tokens.next_index()
-        cond = exp_parsing(tokens)
+        cond = yield exp_parsing(tokens, context)
         if tokens.look_ahead().name == ":":
             tokens.next_index()
-            cond_exp = conditional_exp_parsing(tokens)
+            cond_exp = yield conditional_exp_parsing(tokens, context)
             return Conditional_exp(exp, cond, cond_exp)
         else:
             raise Exception(f"Error. Expected :. Column: {t.column}. Row: {t.row}.")
     return exp
 
 
-def factor_parsing(tokens):
-    if tokens.look_ahead().name == "(":
+def factor_parsing(tokens, context):
+    kind = tokens.look_ahead().name
+    if kind == "(":
         tokens.next_index()
-        exp = exp_parsing(tokens)
-        if tokens.look_ahead().name == ")":
+        exp = yield exp_parsing(tokens, context)
+        t = tokens.look_ahead()
+        if t.name == ")":
             tokens.next_index()
             return exp
-    elif tokens.look_ahead().name == "-":
-        return UnaryOperation(tokens.next_index().name, factor_parsing(tokens))
-    elif tokens.look_ahead().name == "constant":
-        return Constant(tokens.next_index().value)
-    elif tokens.look_ahead().name == "identifier":
+        raise Exception(f"Error. Expected ). Row: {t.row}. Column: {t.column}.")
+    elif kind == "-":
+        op = tokens.next_index().name
+        return UnaryOperation(op, (yield factor_parsing(tokens, context)))
+    elif kind == "constant":
         t = tokens.next_index()
-        name = t.value
+        value = constant_value(t.value)
+        if value is None:
+            raise Exception(f"Error. Constant {t.value} is not a number: the compiler has int and float constants "
+                            f"only. Row: {t.row}. Column: {t.column}.")
+        return Constant(value)
+    elif kind == "identifier":
+        t = tokens.next_index()
+        name = intern(t.value)
         arguments = []
         if tokens.look_ahead().name == "(":
             tokens.next_index()
             if tokens.look_ahead().name != ")":
-                arguments.append(exp_parsing(tokens))
+                argument = yield exp_parsing(tokens, context)
+                arguments.append(argument)
                 while tokens.look_ahead().name == ",":
                     tokens.next_index()
-                    arguments.append(exp_parsing(tokens))
+                    argument = yield exp_parsing(tokens, context)
+                    arguments.append(argument)
             if tokens.look_ahead().name == ")":
                 tokens.next_index()
-                if Function.functions.get((name, len(arguments)), None) is None:
+                if context.functions.get((name, len(arguments)), None) is None:
                     raise Exception(f"Error. Function is not declared. Row: {t.row}. Column: {t.column}.")
                 return FunctionCalling(name, arguments)
         elif tokens.look_ahead().name == "++":
             tokens.next_index()
-            if Declare.var_dict[name] is None:
+            if context.var_dict[name] is None:
                 raise Exception(f"Such identifier is not exist. Row: {t.row}. Column: {t.column}.")
             return UnaryOperation("postfix_++", Variable(name))
-        if Declare.var_dict[name] is None:
+        if context.var_dict[name] is None:
             raise Exception(f"Such identifier is not exist. Row: {t.row}. Column: {t.column}.")
         return Variable(name)
+    t = tokens.look_ahead()
+    raise Exception(f"Error. Expected an expression. Row: {t.row}. Column: {t.column}.")
+
+
+def constant_value(text):
+    """The int a constant token stands for, or None for a string: hexadecimal, decimal, or a float truncated to
+    an int, converted once here instead of at every use. The generated code has no strings, so the parser
+    rejects a constant that is not a number; before, it failed in code generation instead."""
+    if text[:2] in ("0x", "0X"):
+        return int(text[2:], 16)
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return int(float(text))
+    except (ValueError, OverflowError):
+        return None
 
 
-mark_value = 0
-
-
-def mark_generating():
-    global mark_value
-    mark_value += 1
-    return mark_value
-
 # <function> ::= "int" <id> "(" ")" "{" { <statement> } "}"
 # <statement> ::= "return" <exp> ";"
 #             | <exp> ";"
@@ -0,0 +1,174 @@
+import re
+import sys
+from functools import lru_cache
+
+from Lexer import Lexer
+from Optimizer import count_instructions
+from Parser import Wrapper, program_parsing
+
+comparison = re.compile(r"^\.if (\w+) (<|>|==) (\w+)$")
+registers = {"eax", "ebx", "ecx", "edx", "esi", "edi", "ebp", "esp"}
+negations = {"<": ">=", ">": "<=", "==": "!="}
+
+
+@lru_cache(maxsize=1 << 14)
+def instruction(line):
+    """Splits an instruction into its mnemonic and operands: "mov eax, [ebp + 8]" -> ("mov", ("eax", "[ebp + 8]"))."""
+    mnemonic, _, operands = line.partition(" ")
+    return mnemonic, tuple(operand.strip() for operand in operands.split(",")) if operands else ()
+
+
+@lru_cache(maxsize=1 << 14)
+def mentions(operand, register):
+    return re.search(rf"\b{register}\b", operand) is not None
+
+
+def push_pop(lines, i, blocks):
+    """push R1 / pop R2 -> mov R2, R1"""
+    if i + 1 < len(lines):
+        push, pushed = instruction(lines[i])
+        pop, popped = instruction(lines[i + 1])
+        if push == "push" and pop == "pop" and pushed[0] in registers and popped[0] in registers:
+            return i + 2, [] if pushed == popped else [f"mov {popped[0]}, {pushed[0]}"], None
+
+
+def push_load_pop(lines, i, blocks):
+    """push eax / mov eax, X / pop ebx -> mov ebx, eax / mov eax, X, when X reads neither ebx nor the stack"""
+    if i + 2 < len(lines):
+        push, pushed = instruction(lines[i])
+        load, operands = instruction(lines[i + 1])
+        pop, popped = instruction(lines[i + 2])
+        if push == "push" and load == "mov" and pop == "pop" and pushed[0] in registers and popped[0] in registers \
+                and operands[0] in registers and operands[0] != popped[0] \
+                and not mentions(operands[1], popped[0]) and not mentions(operands[1], "esp"):
+            return i + 3, [f"mov {popped[0]}, {pushed[0]}", lines[i + 1]], None
+
+
+def store_load(lines, i, blocks):
+    """mov [ebp + x], eax / mov eax, [ebp + x] -> mov [ebp + x], eax"""
+    if i + 1 < len(lines):
+        store, stored = instruction(lines[i])
+        load, loaded = instruction(lines[i + 1])
+        if store == "mov" and load == "mov" and stored[0].startswith("[") and stored == loaded[::-1]:
+            return i + 2, [lines[i]], None
+
+
+def dead_move(lines, i, blocks):
+    """mov R, A / mov R, B -> mov R, B, when B does not read R"""
+    if i + 1 < len(lines):
+        first, overwritten = instruction(lines[i])
+        second, operands = instruction(lines[i + 1])
+        if first == "mov" and second == "mov" and overwritten[0] in registers and operands[0] == overwritten[0] \
+                and not mentions(operands[1], overwritten[0]):
+            return i + 2, [lines[i + 1]], None
+
+
+def fused_condition(lines, i, blocks):
+    """Tests a comparison directly instead of materialising it as 1/0 in eax for the .if that follows.
+
+    .if A < B / mov eax, 1 / .else / mov eax, 0 / .endif / .if eax         -> .if A < B / mov eax, 1
+    .if A < B / mov eax, 1 / .else / mov eax, 0 / .endif / .if eax ==0     -> .if A >= B / mov eax, 0
+    The opposite value is moved into eax after the matching .else, so eax still holds it in both branches.
+    """
+    if i + 5 < len(lines) and lines[i + 1:i + 5] == ["mov eax, 1", ".else", "mov eax, 0", ".endif"]:
+        match = comparison.match(lines[i])
+        end = blocks.get(i + 5)
+        if match is not None and end is not None and end[0] is not None:
+            left, operator, right = match.groups()
+            if lines[i + 5] == ".if eax":
+                return i + 6, [lines[i], "mov eax, 1"], (end[0], ["mov eax, 0"])
+            if lines[i + 5] == ".if eax ==0":
+                return i + 6, [f".if {left} {negations[operator]} {right}", "mov eax, 0"], (end[0], ["mov eax, 1"])
+
+
+def load_through(lines, i, blocks):
+    """mov R1, X / mov R2, R1 / mov R1, Y -> mov R2, X / mov R1, Y, when Y does not read R1"""
+    if i + 2 < len(lines):
+        first, loaded = instruction(lines[i])
+        copy, copied = instruction(lines[i + 1])
+        last, reloaded = instruction(lines[i + 2])
+        if first == copy == last == "mov" and loaded[0] in registers and copied[1] == loaded[0] \
+                and copied[0] in registers and copied[0] != loaded[0] and reloaded[0] == loaded[0] \
+                and not mentions(reloaded[1], loaded[0]):
+            moved = [] if copied[0] == loaded[1] else [f"mov {copied[0]}, {loaded[1]}"]
+            return i + 3, moved + [lines[i + 2]], None
+
+
+default_rules = (fused_condition, push_load_pop, push_pop, load_through, store_load, dead_move)
+
+
+def matching_blocks(lines):
+    """Maps the index of every .if line to the indices of its .else (None without one) and .endif lines."""
+    blocks = dict()
+    stack = []
+    for i, line in enumerate(lines):
+        if line.startswith(".if "):
+            stack.append([i, None])
+        elif line == ".else":
+            stack[-1][1] = i
+        elif line == ".endif":
+            start, middle = stack.pop()
+            blocks[start] = (middle, i)
+    return blocks
+
+
+def rewrite(lines, rules):
+    """One pass of rules over lines, a function body without blank lines; returns the new lines and whether they
+    changed. A rule returns None or (end, replacement, insertion): lines[i:end] are replaced and insertion, if any,
+    is an (index, lines) pair placed after that later line, which no rule may consume.
+    """
+    blocks = matching_blocks(lines)
+    output = []
+    insertions = dict()
+    i = 0
+    while i < len(lines):
+        for rule in rules:
+            match = rule(lines, i, blocks)
+            if match is not None:
+                end, replacement, insertion = match
+                if insertion is not None:
+                    insertions[insertion[0]] = insertion[1]
+                output.extend(replacement)
+                i = end
+                break
+        else:
+            output.append(lines[i])
+            output.extend(insertions.pop(i, ()))
+            i += 1
+    return output, len(output) != len(lines) or output != lines
+
+
+def peephole(masm, rules=default_rules, passes=8):
+    """Rewrites the body of every PROC of masm with rules until nothing changes or `passes` passes are done."""
+    output = []
+    body = None
+    for line in masm.split("\n"):
+        stripped = line.strip()
+        if body is None:
+            output.append(line)
+            if stripped.endswith(" PROC"):
+                body = []
+        elif stripped.endswith(" ENDP"):
+            for _ in range(passes):
+                body, changed = rewrite(body, rules)
+                if not changed:
+                    break
+            output.extend(body)
+            output.append(line)
+            body = None
+        elif stripped:
+            body.append(stripped)
+    return "\n".join(output)
+
+
+def main(paths):
+    print(f"{'source':>32} {'before':>8} {'after':>8} {'saved':>8}")
+    for path in paths:
+        with open(path, "r") as f:
+            masm = program_parsing(Wrapper(Lexer.tokeniser(f.read(), regex=True))).masm_32()
+        before, after = count_instructions(masm), count_instructions(peephole(masm))
+        print(f"{path:>32} {before:>8} {after:>8} {before - after:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"])
@@ -0,0 +1,267 @@
+from Parser import (Assign, BinaryOperation, Constant, Declare, For, ForDecl, Function, Program, ReturnStatement,
+                    TailCall, UnaryOperation, Variable, While, children, fill, frame_parts, joined, post_order,
+                    replace_children, resolve)
+
+pool = ("esi", "edi", "ebx", "ecx")  # saved by every function that uses them, so they survive calls
+right_first = ("-", "*")  # operators whose right operand the templates evaluate first
+loop_weight = 10  # a use inside a loop counts as much as this many uses outside it
+min_weight = 4  # uses that pay for saving and restoring a register
+
+
+class RegisterFunction(Function):
+    """Function whose hot locals live in registers; it saves the registers it uses below ebp and restores them."""
+    __slots__ = ("registers", "saved", "temporaries")
+
+    def __init__(self, name_string, statement_list, parameters, registers, saved, temporaries):
+        super().__init__(name_string, statement_list, parameters)
+        self.registers = registers  # name -> register
+        self.saved = saved  # every register the function writes, in the order they are pushed
+        self.temporaries = temporaries  # the saved registers left for expression temporaries
+
+    def masm_32_parts(self, context):
+        context.temporaries = list(self.temporaries)
+        prologue = [f"push {register}" for register in self.saved]
+        context.entry = context.mark_generating() if self.tail_calls else None
+        if self.tail_calls:  # TailCalls come back here: the registers are saved, the parameters are loaded again
+            prologue.append(f"_{context.entry}:")
+        # the locals that stay in memory go below the saved registers
+        prologue.append(frame_parts(resolve(self, -4 - 4 * len(self.saved), self.registers)).strip())
+        prologue += [f"mov {self.registers[param]}, [ebp + {8 + i * 4}]"
+                     for i, param in enumerate(self.parameters) if param in self.registers]
+        template = """
+{name} PROC
+push ebp
+mov ebp, esp
+{prologue}{statement_list}
+{epilogue}{name} ENDP
+""".strip()
+        epilogue = "" if self.returns else restore(self.saved) + "mov esp, ebp\npop ebp\nret\n"
+        return fill(template, name=self.name_string, prologue="".join(line + "\n" for line in prologue if line),
+                    statement_list=joined("\n", self.statement_list), epilogue=epilogue)
+
+
+def restore(saved):
+    return "".join(f"mov {register}, [ebp + {-4 - 4 * i}]\n" for i, register in enumerate(saved))
+
+
+class RegisterReturn(ReturnStatement):
+    __slots__ = ("saved",)
+
+    def __init__(self, expression, saved):
+        super().__init__(expression)
+        self.saved = saved
+
+    def masm_32_parts(self, context):
+        template = """
+{expression}
+{restore}mov esp, ebp
+pop ebp
+ret
+""".strip()
+        return fill(template, expression=self.expression, restore=restore(self.saved))
+
+
+class RegisterTailCall(TailCall):
+    __slots__ = ("saved",)
+
+    def __init__(self, func_name, args, saved):
+        super().__init__(func_name, args)
+        self.saved = saved
+
+    def masm_32_parts(self, context):
+        yield from self.arguments_parts()
+        reset = f"lea esp, [ebp + {-4 * len(self.saved)}]" if self.saved else "mov esp, ebp"
+        yield f"{reset}\njmp _{context.entry}"
+
+
+class RegisterDeclare(Declare):
+    __slots__ = ("register",)
+
+    def __init__(self, dec_type, dec_name_string, default_expression, register):
+        super().__init__(dec_type, dec_name_string, default_expression)
+        self.register = register
+
+    def masm_32_parts(self, context):
+        return fill("{dec}\nmov {register}, eax",
+                    dec=self.default_expression if self.default_expression else "mov eax, 0", register=self.register)
+
+
+class RegisterVariable(Variable):
+    __slots__ = ("register",)
+
+    def __init__(self, name_string, register):
+        super().__init__(name_string)
+        self.register = register
+
+    def masm_32_parts(self, context):
+        yield f"mov eax, {self.register}"
+
+
+class RegisterAssign(Assign):
+    __slots__ = ("register",)
+
+    def __init__(self, ass_name_string, ass_expression, register):
+        super().__init__(ass_name_string, ass_expression)
+        self.register = register
+
+    def masm_32_parts(self, context):
+        return fill("{asn}\nmov {register}, eax", asn=self.ass_expression, register=self.register)
+
+
+class RegisterIncrement(UnaryOperation):
+    __slots__ = ()
+
+    def masm_32_parts(self, context):
+        return fill("{operation}\ninc {register}", operation=self.expression, register=self.expression.register)
+
+
+class RegisterOperation(BinaryOperation):
+    """BinaryOperation that keeps its first operand in a free register instead of pushing it, or, when `direct`,
+    uses the right operand, a constant or a variable, straight from where it is."""
+    __slots__ = ("direct",)
+
+    def __init__(self, left, operation, right, direct):
+        super().__init__(left, operation, right)
+        self.direct = direct
+
+    def masm_32_parts(self, context):
+        if self.direct:
+            yield self.left
+            yield "\n" + combine(self.operation, operand(self.right, context), direct=True)
+            return
+        first, second = (self.right, self.left) if self.operation in right_first else (self.left, self.right)
+        yield first
+        temporary = context.temporaries.pop() if context.temporaries else None
+        yield f"\nmov {temporary}, eax\n" if temporary else "\npush eax\n"
+        yield second
+        if temporary:
+            context.temporaries.append(temporary)
+            yield "\n" + combine(self.operation, temporary)
+        else:
+            yield "\n" + combine(self.operation, "dword ptr [esp]") + "\nadd esp, 4"
+
+
+def operand(node, context):
+    if isinstance(node, Constant):
+        return str(node.value)
+    if isinstance(node, RegisterVariable):
+        return node.register
+    return f"dword ptr [ebp + {node.offset}]"
+
+
+def combine(operation, value, direct=False):
+    """Code that applies operation to eax and value. value holds the first evaluated operand, or the right one
+    when direct, and is a register, a memory operand or, only when direct, a constant."""
+    constant = value[0].isdigit()
+    if operation == "+":
+        return f"add eax, {value}"
+    if operation == "-":
+        return f"sub eax, {value}"
+    if operation == "*":
+        return f"mov edx, {value}\nmul edx" if constant else f"mul {value}"
+    if operation in ("/", "%"):
+        if constant:
+            code = f"push {value}\nxor edx, edx\ndiv dword ptr [esp]\nadd esp, 4"
+        elif direct:
+            code = f"xor edx, edx\ndiv {value}"
+        else:
+            code = f"xchg eax, {value}\nxor edx, edx\ndiv {value}"
+        return code + "\nmov eax, edx" if operation == "%" else code
+    if direct:
+        condition = f"eax {operation} {value}"
+    else:
+        condition = f"eax == {value}" if operation == "==" else f"{value} {operation} eax"
+    return f".if {condition}\nmov eax, 1\n.else\nmov eax, 0\n.endif"
+
+
+def allocate_registers(node):
+    """Puts the most used locals of every function in registers and gives binary operations register temporaries.
+
+    Only variables declared once in their function are candidates, so a name always means the same variable;
+    uses are weighted by loop_weight for every loop around them. Registers left over from the pool serve as
+    temporaries, as many as the deepest expression of the function needs; beyond that operands are pushed.
+    """
+    if isinstance(node, Program):
+        node.functions = [allocate_registers(function) for function in node.functions]
+        return node
+    if not isinstance(node, Function) or node.statement_list is None:
+        return node
+    weights, declarations = variable_weights(node)
+    hot = sorted((name for name, count in declarations.items() if count == 1 and weights[name] >= min_weight),
+                 key=lambda name: (-weights[name], name))
+    registers = dict(zip(hot, pool))
+    saved = list(registers.values())
+    replaced = dict()
+    need = dict()  # id of a rewritten node -> temporaries it needs at once
+    writes = dict()  # id of a rewritten node -> whether it assigns or increments a variable
+    for current in post_order(node):
+        replace_children(current, replaced)
+        result = rewrite(current, registers, saved, writes)
+        below = [need[id(child)] for child in children(result)]
+        if isinstance(result, RegisterOperation) and not result.direct:
+            first, second = (result.right, result.left) if result.operation in right_first \
+                else (result.left, result.right)
+            need[id(result)] = max(need[id(first)], 1 + need[id(second)])
+        else:
+            need[id(result)] = max(below, default=0)
+        writes[id(result)] = isinstance(result, Assign) or isinstance(result, UnaryOperation) \
+            and result.operation == "postfix_++" or any(writes[id(child)] for child in children(result))
+        if result is not current:
+            replaced[id(current)] = result
+    temporaries = [register for register in pool if register not in saved][:need[id(node)]]
+    saved.extend(temporaries)
+    function = RegisterFunction(node.name_string, node.statement_list, node.parameters, registers, saved,
+                                temporaries[::-1])
+    function.returns, function.tail_calls = node.returns, node.tail_calls
+    return function
+
+
+def rewrite(node, registers, saved, writes):
+    kind = type(node)
+    if kind is Variable and node.name_string in registers:
+        return RegisterVariable(node.name_string, registers[node.name_string])
+    if kind is Assign and node.ass_name_string in registers:
+        return RegisterAssign(node.ass_name_string, node.ass_expression, registers[node.ass_name_string])
+    if kind is Declare and node.dec_name_string in registers:
+        return RegisterDeclare(node.dec_type, node.dec_name_string, node.default_expression,
+                               registers[node.dec_name_string])
+    if kind is UnaryOperation and node.operation == "postfix_++" and type(node.expression) is RegisterVariable:
+        return RegisterIncrement(node.operation, node.expression)
+    if kind is ReturnStatement:
+        return RegisterReturn(node.expression, saved)
+    if kind is TailCall:
+        return RegisterTailCall(node.func_name, node.args, saved)
+    if kind is BinaryOperation and node.operation in ("+", "-", "*", "/", "%", "<", ">", "=="):
+        leaf = type(node.right) in (Constant, Variable, RegisterVariable)
+        # the right operand of - and * is read before the left one, which must then not change it
+        direct = leaf and (node.operation not in right_first or type(node.right) is Constant
+                           or not writes[id(node.left)])
+        return RegisterOperation(node.left, node.operation, node.right, direct)
+    return node
+
+
+def variable_weights(function):
+    """Returns the loop weighted number of uses and the number of declarations of every variable of function."""
+    weights = dict.fromkeys(function.parameters, 0)
+    declarations = dict.fromkeys(function.parameters, 0)
+    for parameter in function.parameters:
+        declarations[parameter] += 1
+    stack = [(statement, 1) for statement in function.statement_list]
+    while stack:
+        node, weight = stack.pop()
+        name = None
+        if isinstance(node, Variable):
+            name = node.name_string
+        elif isinstance(node, Assign):
+            name = node.ass_name_string
+        elif isinstance(node, Declare):
+            name = node.dec_name_string
+            declarations[name] = declarations.get(name, 0) + 1
+        if name is not None:
+            weights[name] = weights.get(name, 0) + weight
+        if isinstance(node, (While, For, ForDecl)):
+            stack.extend((child, weight if child is getattr(node, "initial", None) else weight * loop_weight)
+                         for child in children(node))
+        else:
+            stack.extend((child, weight) for child in children(node))
+    return weights, declarations
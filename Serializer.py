@@ -0,0 +1,341 @@
+import gc
+import mmap
+import struct
+import sys
+import time
+from array import array
+
+from Lexer import Lexer
+from Parser import (Assign, BinaryOperation, Compound, Conditional, Conditional_exp, Constant, Declare, ExpStatement,
+                    For, ForDecl, Function, FunctionCalling, ImmediateOperation, Program, ReturnStatement, Sequence,
+                    TailCall, UnaryOperation, Variable, While, Wrapper, program_parsing)
+
+# A file is a header, the lengths of the strings, their UTF-8 bytes, the table of the functions and the words that
+# encode them, all little-endian 32-bit words but the bytes of the strings, which are padded to a multiple of four.
+# Names, operators, types and the decimal text of constants are indices into the strings. Every function is a
+# range of the words: its parameters, then its statements in post-order, every node after its children, so a
+# loader rebuilds it with a stack and a function loads without the others. Statements carry row and column,
+# 0 when unknown.
+MAGIC = b"CAST"
+VERSION = 1  # of the encoding below; a file of another version does not load
+header = struct.Struct("<4sHHIIII")  # magic, version, 0, strings, functions, bytes of the strings, words
+FUNCTION_WORDS = 7  # name, row, column, flags, first word, parameters, words of the statements
+PROTOTYPE, RETURNS, TAIL_CALLS = 1, 2, 4  # flags of a function
+
+# opcode words; the operands follow in the words after them
+NONE = 0  # an optional child that is missing
+CONSTANT = 1  # string of the value
+VARIABLE = 2  # name
+ASSIGN = 3  # name; pops the expression
+BINARY = 4  # operation; pops the right operand, then the left one
+UNARY = 5  # operation; pops the operand
+IMMEDIATE = 6  # instruction, string of the operand; pops the expression
+CALL = 7  # name, count; pops count arguments
+SEQUENCE = 8  # count; pops count expressions
+CONDITIONAL_EXP = 9  # pops the false expression, the true one, the condition
+DECLARE = 10  # row, column, type, name; pops the default expression
+RETURN = 11  # row, column; pops the expression
+EXPRESSION = 12  # row, column; pops the expression
+CONDITIONAL = 13  # row, column; pops the false statement, the true one, the condition
+FOR = 14  # row, column; pops the statement, the post expression, the condition, the initial expression
+WHILE = 15  # row, column; pops the statement, the condition
+FOR_DECL = 16  # row, column; pops as FOR
+TAIL_CALL = 17  # row, column, name, count; pops count arguments
+COMPOUND = 18  # row, column, count; pops count statements
+
+
+class Encoder:
+    """Collects the strings and words of a Program."""
+
+    def __init__(self):
+        self.strings = dict()  # string -> index
+        self.words = array("I")
+        self.table = array("I")
+
+    def string(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def function(self, function):
+        flags = (PROTOTYPE if function.statement_list is None else 0) | (RETURNS if function.returns else 0) \
+            | (TAIL_CALLS if function.tail_calls else 0)
+        first = len(self.words)
+        self.words.extend(self.string(param) for param in function.parameters)
+        for statement in function.statement_list or ():
+            self.node(statement)
+        self.table.extend((self.string(function.name_string), getattr(function, "row", 0),
+                           getattr(function, "column", 0), flags, first, len(function.parameters),
+                           len(self.words) - first - len(function.parameters)))
+
+    def node(self, root):
+        """Appends the words of root and its subtree, children first, walking it with an explicit stack."""
+        words, string = self.words, self.string
+        stack = [(root, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node is None:
+                words.append(NONE)
+                continue
+            if not ready:
+                stack.append((node, True))
+                for field in reversed(node.child_fields):
+                    value = getattr(node, field)
+                    if type(value) is list:
+                        stack.extend((child, False) for child in reversed(value))
+                    else:
+                        stack.append((value, False))
+                continue
+            kind = type(node)
+            if kind is Variable:
+                words.extend((VARIABLE, string(node.name_string)))
+            elif kind is Constant:
+                words.extend((CONSTANT, string(str(node.value))))
+            elif kind is BinaryOperation:
+                words.extend((BINARY, string(node.operation)))
+            elif kind is Assign:
+                words.extend((ASSIGN, string(node.ass_name_string)))
+            elif kind is UnaryOperation:
+                words.extend((UNARY, string(node.operation)))
+            elif kind is FunctionCalling:
+                words.extend((CALL, string(node.func_name), len(node.args)))
+            elif kind is ImmediateOperation:
+                words.extend((IMMEDIATE, string(node.instruction), string(str(node.operand))))
+            elif kind is Sequence:
+                words.extend((SEQUENCE, len(node.expressions)))
+            elif kind is Conditional_exp:
+                words.append(CONDITIONAL_EXP)
+            else:
+                opcode = statement_opcodes.get(kind)
+                if opcode is None:
+                    raise Exception(f"Cannot serialize a {kind.__name__}")
+                words.extend((opcode, getattr(node, "row", 0), getattr(node, "column", 0)))
+                if kind is Declare:
+                    words.extend((string(node.dec_type), string(node.dec_name_string)))
+                elif kind is TailCall:
+                    words.extend((string(node.func_name), len(node.args)))
+                elif kind is Compound:
+                    words.append(len(node.statements))
+
+    def data(self):
+        strings = [text.encode() for text in self.strings]
+        lengths = array("I", map(len, strings))
+        text = b"".join(strings)
+        text += b"\0" * (-len(text) % 4)
+        table, words = array("I", self.table), array("I", self.words)
+        if sys.byteorder != "little":
+            for column in (lengths, table, words):
+                column.byteswap()
+        return b"".join((header.pack(MAGIC, VERSION, 0, len(strings), len(table) // FUNCTION_WORDS,
+                                     len(text), len(words)),
+                         lengths.tobytes(), text, table.tobytes(), words.tobytes()))
+
+
+statement_opcodes = {Declare: DECLARE, ReturnStatement: RETURN, ExpStatement: EXPRESSION, Conditional: CONDITIONAL,
+                     For: FOR, While: WHILE, ForDecl: FOR_DECL, TailCall: TAIL_CALL, Compound: COMPOUND}
+
+
+def dumps(program):
+    """The bytes of program, which must hold only the nodes of Parser.py."""
+    encoder = Encoder()
+    for function in program.functions:
+        encoder.function(function)
+    return encoder.data()
+
+
+def dump(program, path):
+    with open(path, "wb") as f:
+        f.write(dumps(program))
+
+
+class AstFile:
+    """A serialized Program over bytes or a memory-mapped file, decoding each function only when asked for."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        magic, version, _, strings, functions, text, words = header.unpack_from(self.data)
+        if magic != MAGIC:
+            raise Exception("Not a serialized program")
+        if version != VERSION:
+            raise Exception(f"Serialized program of version {version}, this compiler reads version {VERSION}")
+        offset = header.size
+        lengths = self.column(offset, strings)
+        offset += 4 * strings
+        text_bytes = bytes(self.data[offset:offset + text])
+        self.strings = []
+        start = 0
+        for length in lengths:
+            self.strings.append(sys.intern(text_bytes[start:start + length].decode()))
+            start += length
+        offset += text
+        self.table = self.column(offset, functions * FUNCTION_WORDS)
+        offset += 4 * functions * FUNCTION_WORDS
+        self.words_offset = offset
+        self.names = [(self.strings[self.table[i * FUNCTION_WORDS]], self.table[i * FUNCTION_WORDS + 5])
+                      for i in range(functions)]  # (name, amount of parameters) of every function, in order
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def column(self, offset, count):
+        """count words from the byte offset, as a list of ints."""
+        words = array("I")
+        words.frombytes(self.data[offset:offset + 4 * count])
+        if sys.byteorder != "little":
+            words.byteswap()
+        return words.tolist()
+
+    def function(self, index):
+        """Decodes the index-th function into a Function."""
+        name, row, column, flags, first, parameters, length = \
+            self.table[index * FUNCTION_WORDS:(index + 1) * FUNCTION_WORDS]
+        words = self.column(self.words_offset + 4 * first, parameters + length)
+        strings = self.strings
+        function = Function(strings[name], None if flags & PROTOTYPE else decode(words, parameters, strings),
+                            [strings[param] for param in words[:parameters]])
+        function.returns, function.tail_calls = bool(flags & RETURNS), bool(flags & TAIL_CALLS)
+        if row:
+            function.row, function.column = row, column
+        return function
+
+    def program(self):
+        # the nodes form no cycles, so the collections that allocating them would trigger find nothing to free
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return Program([self.function(i) for i in range(len(self.names))])
+        finally:
+            if enabled:
+                gc.enable()
+
+
+def decode(words, i, strings):
+    """Rebuilds the statements encoded in words from index i on."""
+    stack = []
+    push, pop = stack.append, stack.pop
+    values = dict()  # string index -> int, of the constants seen
+    end = len(words)
+    while i < end:
+        opcode = words[i]
+        if opcode == VARIABLE:
+            push(Variable(strings[words[i + 1]]))
+            i += 2
+        elif opcode == CONSTANT:
+            value = values.get(words[i + 1])
+            if value is None:
+                value = values[words[i + 1]] = int(strings[words[i + 1]])
+            push(Constant(value))
+            i += 2
+        elif opcode == BINARY:
+            right = pop()
+            stack[-1] = BinaryOperation(stack[-1], strings[words[i + 1]], right)
+            i += 2
+        elif opcode == ASSIGN:
+            stack[-1] = Assign(strings[words[i + 1]], stack[-1])
+            i += 2
+        elif opcode == NONE:
+            push(None)
+            i += 1
+        elif opcode == UNARY:
+            stack[-1] = UnaryOperation(strings[words[i + 1]], stack[-1])
+            i += 2
+        elif opcode == CALL:
+            count = words[i + 2]
+            arguments = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            push(FunctionCalling(strings[words[i + 1]], arguments))
+            i += 3
+        elif opcode == IMMEDIATE:
+            stack[-1] = ImmediateOperation(stack[-1], strings[words[i + 1]], int(strings[words[i + 2]]))
+            i += 3
+        elif opcode == SEQUENCE:
+            count = words[i + 1]
+            expressions = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            push(Sequence(expressions))
+            i += 2
+        elif opcode == CONDITIONAL_EXP:
+            con_false, con_true = pop(), pop()
+            stack[-1] = Conditional_exp(stack[-1], con_true, con_false)
+            i += 1
+        else:
+            if opcode == DECLARE:
+                node = Declare(strings[words[i + 3]], strings[words[i + 4]], pop())
+                size = 5
+            elif opcode == EXPRESSION:
+                node = ExpStatement(pop())
+                size = 3
+            elif opcode == RETURN:
+                node = ReturnStatement(pop())
+                size = 3
+            elif opcode == CONDITIONAL:
+                con_false, con_true = pop(), pop()
+                node = Conditional(pop(), con_true, con_false)
+                size = 3
+            elif opcode == COMPOUND:
+                count = words[i + 3]
+                node = Compound(stack[len(stack) - count:])
+                del stack[len(stack) - count:]
+                size = 4
+            elif opcode == WHILE:
+                statement = pop()
+                node = While(pop(), statement)
+                size = 3
+            elif opcode in (FOR, FOR_DECL):
+                statement, post_conditional, conditional = pop(), pop(), pop()
+                node = (For if opcode == FOR else ForDecl)(pop(), conditional, post_conditional, statement)
+                size = 3
+            elif opcode == TAIL_CALL:
+                count = words[i + 4]
+                arguments = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                node = TailCall(strings[words[i + 3]], arguments)
+                size = 5
+            else:
+                raise Exception(f"Unknown opcode {opcode} in a serialized program")
+            if words[i + 1]:
+                node.row, node.column = words[i + 1], words[i + 2]
+            push(node)
+            i += size
+    return stack
+
+
+def loads(data):
+    return AstFile(data).program()
+
+
+def load(path):
+    """Reads the Program serialized in the file at path, memory-mapping it."""
+    ast = AstFile.open(path)
+    program = ast.program()
+    del ast  # the nodes hold no part of the mapping
+    return program
+
+
+def main(paths):
+    """Serializes every source next to it, as .ast, and compares loading it with lexing and parsing the source."""
+    print(f"{'source':>40} {'bytes':>10} {'ast bytes':>10} {'parse s':>9} {'load s':>9} {'speedup':>8}")
+    for path in paths:
+        with open(path, "r") as f:
+            code = f.read()
+        start = time.perf_counter()
+        program = program_parsing(Wrapper(Lexer.tokeniser(code, regex=True)))
+        parse = time.perf_counter() - start
+        target = path.rsplit(".", 1)[0] + ".ast"
+        dump(program, target)
+        start = time.perf_counter()
+        loaded = load(target)
+        elapsed = time.perf_counter() - start
+        if loaded.masm_32() != program.masm_32():
+            raise Exception(f"{target} does not load into the program of {path}")
+        with open(target, "rb") as f:
+            size = len(f.read())
+        print(f"{path:>40} {len(code):>10} {size:>10} {parse:>9.4f} {elapsed:>9.4f} {parse / elapsed:>7.1f}x")
+        del program, loaded  # freeing the trees of a large source would count to the times of the next
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"])
@@ -0,0 +1,91 @@
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from Lexer import Lexer
+from Optimizer import Options, optimize
+from Parser import CompilationContext, Program, Wrapper, post_order, program_parsing
+from Peephole import peephole
+
+
+class Phases:
+    """Wall time, CPU time and, when tracemalloc is tracing, the peak of traced memory of named phases."""
+
+    def __init__(self):
+        self.report = dict()
+
+    def run(self, name, function, *arguments):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(*arguments)
+        phase = {"wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+        if tracing:
+            phase["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before  # above what the phase started with
+        self.report[name] = phase
+        return result
+
+
+def generate(program, context, functions):
+    """Program.masm_32 with every function generated on its own, so that its time is known; the code is the same."""
+    blocks = []
+    for function in program.functions:
+        start = time.perf_counter()
+        blocks.append(function.masm_32(context=context))
+        key = f"{function.name_string}/{len(function.parameters)}"
+        functions[key] = functions.get(key, 0) + time.perf_counter() - start
+    # Program takes already generated blocks as well as Function nodes: strings are copied to the output as they are
+    return Program(blocks).masm_32()
+
+
+def measure(code, options=Options(), memory=True):
+    """Returns the MASM of code and a report of its compilation for json.dumps; memory traces it, more slowly."""
+    started = not tracemalloc.is_tracing() and memory
+    if started:
+        tracemalloc.start()
+    try:
+        phases = Phases()
+        wall, cpu = time.perf_counter(), time.process_time()
+        tokens = phases.run("lex", Lexer.tokeniser, code, True)
+        context = CompilationContext()
+        program = phases.run("parse", program_parsing, Wrapper(tokens), context)
+        nodes = Counter(type(node).__name__ for node in post_order(program))
+        program = phases.run("optimize", optimize, program, options)
+        functions = dict()
+        masm = phases.run("generate", generate, program, context, functions)
+        if options.peephole:
+            masm = phases.run("peephole", peephole, masm)
+        total = {"wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+    finally:
+        if started:
+            tracemalloc.stop()
+    lex_seconds = phases.report["lex"]["wall_seconds"]
+    report = {
+        "options": options._asdict(),
+        "bytes": len(code),
+        "tokens": len(tokens),
+        "tokens_per_second": len(tokens) / lex_seconds if lex_seconds else None,
+        "phases": phases.report,
+        "total": total,
+        "nodes": dict(sorted(nodes.items())),
+        "functions": functions,  # "name/amount of parameters" -> seconds of code generation
+    }
+    return masm, report
+
+
+def main(paths):
+    reports = []
+    for path in paths:
+        with open(path, "r") as f:
+            _, report = measure(f.read(), Options.level(1))
+        reports.append({"source": path, **report})
+    json.dump({"sources": reports}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["6-5-Python-IO-81-Dakhno.txt"])
@@ -1,8 +1,87 @@
+from array import array
 from typing import NamedTuple
 
 
 class Token(NamedTuple):
     name: str
     value: str
-    column: int
     row: int
+    column: int
+
+
+class TokenView:
+    """Token lookalike that reads one entry of a TokenStore on demand."""
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def name(self):
+        return self.store.kinds[self.store.kind_ids[self.index]]
+
+    @property
+    def value(self):
+        store = self.store
+        if store.kinds[store.kind_ids[self.index]] not in store.valued:
+            return None
+        return store.code[store.starts[self.index]:store.ends[self.index]]
+
+    @property
+    def column(self):
+        return self.store.columns[self.index]
+
+    @property
+    def row(self):
+        return self.store.rows[self.index]
+
+    def as_token(self):
+        return Token(self.name, self.value, self.row, self.column)
+
+
+class TokenStore:
+    """Columnar token storage: a kind id byte and four 32-bit integers per token instead of a Token each.
+
+    Values are not stored; they are sliced out of the source text by their start/end offsets.
+    """
+    valued = {"constant", "identifier"}
+
+    def __init__(self, code, kinds):
+        if len(kinds) > 256:
+            raise ValueError(f"TokenStore supports at most 256 token kinds, got {len(kinds)}.")
+        self.code = code
+        self.kinds = list(kinds)
+        self.kind_index = {kind: i for i, kind in enumerate(self.kinds)}
+        self.kind_ids = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.columns = array("I")
+        self.rows = array("I")
+
+    def extend(self, spans):
+        """Appends (name, start, end, row, column) tuples, as Lexer.regex_spans yields them."""
+        kind_index = self.kind_index
+        kind_ids, starts, ends = self.kind_ids.append, self.starts.append, self.ends.append
+        columns, rows = self.columns.append, self.rows.append
+        for name, start, end, row, column in spans:
+            kind_ids(kind_index[name])
+            starts(start)
+            ends(end)
+            columns(column)
+            rows(row)
+
+    def __len__(self):
+        return len(self.kind_ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [TokenView(self, i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("token index out of range")
+        return TokenView(self, item)
+
+    def __iter__(self):
+        return (TokenView(self, i) for i in range(len(self)))
@@ -0,0 +1,24 @@
+import os
+import time
+
+from Cache import CompilationCache
+
+ENTRY = "x" * 1024
+
+
+def test_filling_past_the_limit_evicts_the_least_recently_used(tmp_path):
+    cache = CompilationCache(str(tmp_path), max_bytes=10 * len(ENTRY))
+    keys = [CompilationCache.key(str(i), "") for i in range(11)]
+    start = time.time() - 1000
+    for i, key in enumerate(keys[:10]):
+        cache.put(key, ENTRY)
+        os.utime(cache.path(key), (start + i, start + i))  # distinct times, oldest first
+    assert cache.evictions == 0
+    assert cache.get(keys[0]) == ENTRY  # now the most recently used
+    cache.put(keys[10], ENTRY)
+    assert cache.evictions == 2
+    assert cache.disk_size() <= 0.9 * cache.max_bytes
+    hits, misses = cache.hits, cache.misses
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) is None
+    assert all(cache.get(key) == ENTRY for key in [keys[0]] + keys[3:])
+    assert (cache.hits - hits, cache.misses - misses) == (9, 2)
@@ -0,0 +1,17 @@
+import pytest
+
+from Compiler import main
+
+MALFORMED = [
+    ("int main(){\n    int a = 1 +;\n    return a;\n}\n", "Error. Expected an expression. Row: 2. Column: 16."),
+    ("int main(){\n    return (1 + 2;\n}\n", "Error. Expected ). Row: 2. Column: 18."),
+]
+
+
+@pytest.mark.parametrize("level", range(4))
+@pytest.mark.parametrize("code, message", MALFORMED)
+def test_malformed_source_reports_the_parse_error(tmp_path, capsys, code, message, level):
+    source = tmp_path / "bad.c"
+    source.write_text(code)
+    assert main([str(source), "-j", "1", "-O", str(level)]) == 1
+    assert f"FAILED {source}: {message}\n" in capsys.readouterr().out
@@ -0,0 +1,15 @@
+from Evaluator import evaluate
+from Lexer import Lexer
+from Parser import Wrapper, program_parsing
+
+
+def run(code):
+    return evaluate(program_parsing(Wrapper(Lexer.tokeniser(code, regex=True))))
+
+
+def test_returned_value():
+    assert run("int f(int x){\n    return x * 3;\n}\nint main(){\n    return f(2) - 7;\n}\n").value == 0xFFFFFFFF
+
+
+def test_falling_off_a_function_has_no_value():
+    assert run("int f(int x){\n    x = x + 1;\n}\nint main(){\n    return f(2);\n}\n").value is None
@@ -0,0 +1,53 @@
+from Cache import CompilationCache
+from Compiler import compile_source
+from Generator import Shape, generate_program
+from Incremental import compile_incremental, function_chunks
+from Optimizer import Options
+
+LEAF_CALLS = """int sq(int x){
+    return x * x;
+}
+int add3(int a, int b, int c){
+    int s = a + b;
+    return s + c;
+}
+int main(){
+    int t = 0;
+    for (int i = 0; i < 5; i++) {
+        t = t + sq(i) + add3(i, 2, t);
+    }
+    return t;
+}
+"""
+
+
+def test_full_build_does_not_reuse_incremental_output(tmp_path):
+    cache = CompilationCache(str(tmp_path))
+    for level in range(4):
+        options = Options.level(level)
+        compile_source(LEAF_CALLS, cache, str(tmp_path / "leaf.c"), options)
+        assert compile_source(LEAF_CALLS, cache, None, options) == compile_source(LEAF_CALLS, options=options)
+
+
+def test_incremental_build_matches_full_build(tmp_path):
+    for level in range(4):
+        options = Options.level(level)
+        cache = CompilationCache(str(tmp_path / str(level)))
+        masm = compile_incremental(LEAF_CALLS, cache, "leaf.c", options=options)[0]
+        assert masm == compile_source(LEAF_CALLS, options=options)
+        assert compile_incremental(LEAF_CALLS, cache, "leaf.c", options=options)[0] == masm
+
+
+def test_editing_one_function_regenerates_only_it(tmp_path):
+    code = generate_program(3, Shape(functions=8))
+    chunks = function_chunks(code)
+    edited = len(chunks) // 2
+    body = chunks[edited].index("{") + 1
+    chunks[edited] = chunks[edited][:body] + "\n    int edited = 1;" + chunks[edited][body:]
+    for level in range(2):  # -O2 and -O3 inline, and compile in full
+        options = Options.level(level)
+        cache = CompilationCache(str(tmp_path / str(level)))
+        assert compile_incremental(code, cache, "unit.c", options=options)[1:] == (0, len(chunks))
+        masm, reused, regenerated = compile_incremental("".join(chunks), cache, "unit.c", options=options)
+        assert (reused, regenerated) == (len(chunks) - 1, 1)
+        assert masm == compile_source("".join(chunks), options=options)
@@ -0,0 +1,78 @@
+import pytest
+
+from Compiler import compile_source, parse_source
+from Emulator import emulate
+from Evaluator import evaluate
+from IR import allocate, fused_comparisons, loops, lower_function, optimize_function, read_counts
+from Lexer import Lexer
+from Optimizer import Options
+from Parser import CompilationContext, Wrapper, program_parsing
+from Registers import pool
+
+REDUNDANT = """int f(int a, int b){
+    int x = a * b + 1;
+    int y = a * b + 2;
+    return x - y;
+}
+"""
+INVARIANT = """int f(int a, int n){
+    int s = 0;
+    int i = 0;
+    while (i < n) {
+        s = s + a * 3 + i * 5;
+        i = i + 1;
+    }
+    return s;
+}
+"""
+LIVE = """int f(int a, int b){
+    int c = a + b;
+    int d = a - b;
+    int e = a * b;
+    int g = a + 7;
+    int h = b + 9;
+    return c + d + e + g + h;
+}
+"""
+
+
+def lowered(code):
+    return lower_function(program_parsing(Wrapper(Lexer.tokeniser(code, regex=True))).functions[0])
+
+
+def instructions(function, operation):
+    return [(label, instruction) for label, block in function.blocks.items()
+            for instruction in block.instructions if instruction.operation == operation]
+
+
+def allocated(function):
+    return allocate(function, function.order(), fused_comparisons(function, read_counts(function)))
+
+
+@pytest.mark.parametrize("code", [REDUNDANT, INVARIANT, LIVE])
+def test_lowered_function_keeps_its_value(code):
+    code += "int main(){\n    return f(6, 4);\n}\n"
+    expected = evaluate(parse_source(code, CompilationContext())).value
+    assert emulate(compile_source(code, options=Options.level(3))).value == expected
+
+
+def test_value_numbering_computes_a_repeated_product_once():
+    assert len(instructions(lowered(REDUNDANT), "*")) == 2
+    assert len(instructions(optimize_function(lowered(REDUNDANT)), "*")) == 1
+
+
+def test_invariant_is_hoisted_and_variant_is_not():
+    function = optimize_function(lowered(INVARIANT))
+    (_, body), = loops(function, function.order())
+    products = {instruction.operands[1]: label for label, instruction in instructions(function, "*")}
+    assert products[3] not in body  # a * 3: a is not assigned in the loop
+    assert products[5] in body  # i * 5: i is
+
+
+def test_allocator_spills_when_more_values_than_registers_are_live():
+    locations, used, slots = allocated(optimize_function(lowered(LIVE)))
+    assert used == list(pool)
+    assert slots >= 1
+    assert sum(location.startswith("dword ptr") for location in locations.values()) == slots
+    locations, used, slots = allocated(optimize_function(lowered(REDUNDANT)))
+    assert slots == 0 and len(used) < len(pool)
@@ -0,0 +1,41 @@
+import pytest
+
+from Compiler import compile_source, parse_source
+from Emulator import emulate
+from Evaluator import evaluate
+from Generator import Shape, generate_program
+from Optimizer import Options
+from Parser import CompilationContext
+
+# seed 6 with 6 functions returned 1 instead of 0 at -O2 until calls without arguments stopped pushing eax
+PROGRAMS = [(6, 6), (0, 4), (1, 4), (2, 4), (3, 4)]  # (seed, functions)
+
+
+@pytest.mark.parametrize("seed, functions", PROGRAMS)
+def test_every_level_returns_what_the_evaluator_does(seed, functions):
+    code = generate_program(seed, Shape(functions=functions))
+    expected = evaluate(parse_source(code, CompilationContext())).value
+    for level in range(4):
+        assert emulate(compile_source(code, options=Options.level(level))).value == expected, f"-O{level}"
+
+
+NO_ARGUMENT_CALLS = """int f(){
+    return 7;
+}
+int g(){
+    return 2;
+}
+int main(){
+    int x = 3;
+    int y = f() + g() - x;
+    return y * (g() - f() + x) + (x - f()) / g();
+}
+"""
+
+
+def test_calls_without_arguments_in_binary_expressions():
+    expected = evaluate(parse_source(NO_ARGUMENT_CALLS, CompilationContext())).value
+    assert expected == (6 * -2 + (-4 & 0xFFFFFFFF) // 2) & 0xFFFFFFFF
+    for level in range(4):
+        assert emulate(compile_source(NO_ARGUMENT_CALLS, options=Options.level(level))).value == expected, \
+            f"-O{level}"
@@ -0,0 +1,31 @@
+import pytest
+
+from Generator import Shape, generate_program
+from Lexer import Lexer
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+def sources():
+    with open(SAMPLE, "r") as f:
+        yield f.read()
+    for seed in range(5):
+        yield generate_program(seed, Shape(functions=5))
+    yield "int main(){\r\n\tint x = 0x1F;\n\n  x += .5 + 1e3 - \"s\";  \n return x<=1!=2 ?x:-x; }   "
+    yield "int f(){ return ٣; }\n"  # a numeric character outside of ASCII
+
+
+@pytest.mark.parametrize("code", list(sources()))
+def test_engines_agree(code):
+    tokens = Lexer.tokeniser(code)
+    assert Lexer.tokeniser(code, regex=True) == tokens
+    assert [token.as_token() for token in Lexer.token_store(code)] == tokens
+
+
+@pytest.mark.parametrize("code", ["int main(){\n  int x = 1a;\n}", "int y = 0x;", "int z = 1.2.3;"])
+def test_engines_reject_the_same_constant(code):
+    with pytest.raises(Exception) as scan:
+        Lexer.tokeniser(code)
+    with pytest.raises(Exception) as regex:
+        Lexer.tokeniser(code, regex=True)
+    assert str(regex.value) == str(scan.value)
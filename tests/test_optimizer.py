@@ -0,0 +1,76 @@
+import pytest
+
+from Compiler import compile_source, parse_source
+from Emulator import emulate
+from Evaluator import evaluate
+from Optimizer import Options, RotatedForDecl, RotatedWhile, optimize
+from Parser import CompilationContext, post_order
+
+TAIL_RECURSION = """int count(int n, int acc){
+    if (n == 0)
+        return acc;
+    return count(n - 1, acc + 2);
+}
+int main(){
+    return count(20000, 0);
+}
+"""
+ZERO_ITERATIONS = """int main(){
+    int s = 7;
+    int n = 0;
+    while (n > 0) {
+        s = s + 1;
+        n = n - 1;
+    }
+    for (int i = 5; i < 5; i++) {
+        s = s * 2;
+    }
+    return s;
+}
+"""
+CONDITION_READS_BODY = """int main(){
+    int n = 3;
+    int m = 4;
+    int i = 0;
+    int s = 0;
+    while (i < n * 2 + m * 5) {
+        n = n - 1;
+        i = i + 1;
+        s = s + 1;
+    }
+    for (int j = 0; j < s * 3; j++) {
+        s = s - 1;
+    }
+    return s * 100 + i;
+}
+"""
+
+
+def rotated(code):
+    program = optimize(parse_source(code, CompilationContext()), Options(loops=True))
+    return [node for node in post_order(program) if type(node) in (RotatedWhile, RotatedForDecl)]
+
+
+def test_tail_recursion_runs_in_constant_stack():
+    with pytest.raises(Exception, match="Stack overflow"):
+        emulate(compile_source(TAIL_RECURSION, options=Options()), max_stack=64 * 1024)
+    run = emulate(compile_source(TAIL_RECURSION, options=Options(tail_calls=True)), max_stack=64 * 1024)
+    assert run.value == 40000
+    assert run.stack < 64
+
+
+def test_rotated_loops_skip_a_body_that_runs_zero_times():
+    assert len(rotated(ZERO_ITERATIONS)) == 2
+    for level in range(4):
+        assert emulate(compile_source(ZERO_ITERATIONS, options=Options.level(level))).value == 7
+
+
+def test_condition_reading_a_variable_of_the_body_is_not_hoisted():
+    loops = rotated(CONDITION_READS_BODY)
+    assert len(loops) == 2
+    hoisted = [invariant.ass_expression for loop in loops for invariant in loop.invariants]
+    assert [(type(node).__name__, node.left.name_string) for node in hoisted] == [("BinaryOperation", "m")]
+    expected = evaluate(parse_source(CONDITION_READS_BODY, CompilationContext())).value
+    assert expected == 2 * 100 + 9
+    for level in range(4):
+        assert emulate(compile_source(CONDITION_READS_BODY, options=Options.level(level))).value == expected
@@ -0,0 +1,37 @@
+import pytest
+
+from Compiler import compile_source, parse_source
+from Emulator import emulate
+from Evaluator import evaluate
+from Generator import Shape, generate_program
+from Optimizer import Options
+from Parser import CompilationContext
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+def sources():
+    with open(SAMPLE, "r") as f:
+        yield pytest.param(f.read(), id="sample")
+    for seed in range(8):
+        yield pytest.param(generate_program(seed, Shape(functions=4)), id=f"seed-{seed}")
+
+
+SOURCES = list(sources())
+
+
+@pytest.mark.parametrize("code", SOURCES)
+def test_peephole_keeps_results_and_runs_fewer_instructions(code):
+    expected = evaluate(parse_source(code, CompilationContext())).value
+    plain = emulate(compile_source(code, options=Options()))
+    rewritten = emulate(compile_source(code, options=Options(peephole=True)))
+    optimised = emulate(compile_source(code, options=Options.level(1)))
+    assert plain.value == rewritten.value == optimised.value == expected
+    assert rewritten.instructions < plain.instructions
+    assert optimised.instructions < plain.instructions
+
+
+@pytest.mark.parametrize("code", SOURCES)
+def test_peephole_shortens_the_listing(code):
+    plain = compile_source(code, options=Options())
+    assert len(compile_source(code, options=Options(peephole=True)).splitlines()) < len(plain.splitlines())
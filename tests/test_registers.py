@@ -0,0 +1,17 @@
+from Lexer import Lexer
+from Parser import Declare, Wrapper, post_order, program_parsing, resolve
+from Registers import RegisterFunction, allocate_registers
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+def test_locals_in_registers_take_no_frame_slot():
+    with open(SAMPLE, "r") as f:
+        program = allocate_registers(program_parsing(Wrapper(Lexer.tokeniser(f.read(), regex=True))))
+    functions = [function for function in program.functions if isinstance(function, RegisterFunction)]
+    assert functions
+    for function in functions:
+        # no two scopes of the sample share slots, so every local left in memory has a slot of its own
+        memory = {node.dec_name_string for node in post_order(function) if isinstance(node, Declare)}
+        memory -= set(function.registers)
+        assert resolve(function, -4 - 4 * len(function.saved), function.registers) == 4 * len(memory)
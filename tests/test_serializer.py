@@ -0,0 +1,65 @@
+import struct
+
+import pytest
+
+from Generator import Shape, generate_program
+from Lexer import Lexer
+from Parser import Program, Wrapper, program_parsing
+from Serializer import FUNCTION_WORDS, MAGIC, VERSION, AstFile, dump, dumps, header, load, loads
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+def sources():
+    with open(SAMPLE, "r") as f:
+        yield pytest.param(f.read(), id="sample")
+    for seed in range(4):
+        yield pytest.param(generate_program(seed, Shape(functions=6)), id=f"seed-{seed}")
+
+
+def parse(code):
+    return program_parsing(Wrapper(Lexer.tokeniser(code, regex=True)))
+
+
+@pytest.mark.parametrize("code", list(sources()))
+def test_round_trip_generates_the_same_code(tmp_path, code):
+    assert loads(dumps(parse(code))).masm_32() == parse(code).masm_32()
+    dump(parse(code), tmp_path / "program.ast")
+    assert load(tmp_path / "program.ast").masm_32() == parse(code).masm_32()
+
+
+def test_other_magic_or_version_does_not_load():
+    data = bytearray(dumps(parse(generate_program(0, Shape(functions=2)))))
+    magic, version = bytearray(data), bytearray(data)
+    magic[:4] = b"CASX"
+    struct.pack_into("<H", version, 4, VERSION + 1)
+    with pytest.raises(Exception, match="Not a serialized program"):
+        loads(bytes(magic))
+    with pytest.raises(Exception, match=f"version {VERSION + 1}, this compiler reads version {VERSION}"):
+        loads(bytes(version))
+    assert header.unpack_from(data)[:2] == (MAGIC, VERSION)
+
+
+class Reads(AstFile):
+    """An AstFile that records the byte ranges it reads words from."""
+
+    def __init__(self, data):
+        self.reads = []
+        super().__init__(data)
+
+    def column(self, offset, count):
+        self.reads.append((offset, offset + 4 * count))
+        return super().column(offset, count)
+
+
+def test_function_decodes_only_its_own_words():
+    program = parse(generate_program(1, Shape(functions=6)))
+    ast = Reads(dumps(program))
+    assert [name for name, _ in ast.names] == [function.name_string for function in program.functions]
+    for index, function in enumerate(program.functions):
+        ast.reads.clear()
+        decoded = ast.function(index)
+        first, parameters, length = ast.table[index * FUNCTION_WORDS + 4:(index + 1) * FUNCTION_WORDS]
+        start = ast.words_offset + 4 * first
+        assert ast.reads == [(start, start + 4 * (parameters + length))]
+        assert dumps(Program([decoded])) == dumps(Program([function]))
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from Compiler import compile_source, main
+from Optimizer import Options
+from Stats import measure
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+@pytest.mark.parametrize("level", range(4))
+def test_report_has_every_phase(level):
+    with open(SAMPLE, "r") as f:
+        code = f.read()
+    options = Options.level(level)
+    masm, report = measure(code, options)
+    assert masm == compile_source(code, options=options)
+    phases = ["lex", "parse", "optimize", "generate"] + (["peephole"] if options.peephole else [])
+    assert list(report["phases"]) == phases
+    for phase in report["phases"].values():
+        assert phase["wall_seconds"] >= 0
+        assert phase["cpu_seconds"] >= 0
+        assert phase["peak_bytes"] >= 0
+
+
+def test_stats_option_writes_the_same_code(tmp_path):
+    source = tmp_path / "sample.c"
+    with open(SAMPLE, "rb") as f:
+        source.write_bytes(f.read())
+    plain, measured = tmp_path / "plain", tmp_path / "measured"
+    assert main([str(source), "-j", "1", "-O", "1", "-o", str(plain)]) == 0
+    assert main([str(source), "-j", "1", "-O", "1", "-o", str(measured), "--stats", str(tmp_path / "stats.json")]) == 0
+    assert (measured / "sample.asm").read_bytes() == (plain / "sample.asm").read_bytes()
+    with open(tmp_path / "stats.json") as f:
+        (report,) = json.load(f)["sources"]
+    assert report["source"] == str(source)
+    assert set(report["phases"]) == {"lex", "parse", "optimize", "generate", "peephole"}
@@ -0,0 +1,68 @@
+import pytest
+
+from Generator import Shape, generate_program
+from Lexer import Lexer
+from Parser import StreamWrapper, Wrapper, post_order, program_parsing
+
+SAMPLE = "6-5-Python-IO-81-Dakhno.txt"
+
+
+def sources():
+    with open(SAMPLE, "r") as f:
+        yield f.read()
+    for seed in range(3):
+        yield generate_program(seed, Shape(functions=4))
+
+
+def shape(program):
+    """Types and fields of every node of program, in post-order."""
+    return [(type(node).__name__, {field: getattr(node, field) for field in getattr(node, "__slots__", ())
+                                   if not hasattr(getattr(node, field), "child_fields")
+                                   and type(getattr(node, field)) is not list})
+            for node in post_order(program)]
+
+
+def parse_list(code):
+    return program_parsing(Wrapper(Lexer.tokeniser(code, regex=True)))
+
+
+def parse_stream(code):
+    return program_parsing(StreamWrapper(Lexer.token_stream(code, regex=True)))
+
+
+@pytest.mark.parametrize("code", list(sources()))
+def test_stream_parses_the_tree_of_the_list(code):
+    listed, streamed = parse_list(code), parse_stream(code)
+    assert shape(streamed) == shape(listed)
+    assert streamed.masm_32() == listed.masm_32()
+
+
+@pytest.mark.parametrize("code", [
+    "int main(){\n    return 1;\n",
+    "int main(){\n    return x;\n}\n",
+    "int main(){\n    return 1a;\n}\n",
+    "int f(int a){\n    return a;\n}\nint main(){\n    return f(1, 2);\n}\n",
+])
+def test_stream_fails_as_the_list_does(code):
+    with pytest.raises(Exception) as listed:
+        parse_list(code)
+    with pytest.raises(Exception) as streamed:
+        parse_stream(code)
+    assert type(streamed.value) is type(listed.value)
+    assert str(streamed.value) == str(listed.value)
+
+
+def test_stream_holds_at_most_its_lookahead():
+    code = generate_program(0, Shape(functions=4))
+    pending = []  # tokens taken from the lexer but not yet by the parser, whenever the lexer is asked for one
+
+    def tokens():
+        for count, token in enumerate(Lexer.token_stream(code, regex=True)):
+            pending.append(count - (wrapper.index + 1))
+            assert len(wrapper.buffer) < wrapper.buffer.maxlen
+            yield token
+
+    wrapper = StreamWrapper(tokens())
+    program_parsing(wrapper)
+    assert len(pending) == len(Lexer.tokeniser(code, regex=True))
+    assert max(pending) < wrapper.buffer.maxlen == 2